@@ -1,3 +1,7 @@
-import importlib.metadata
+def __getattr__(name):
+    # reading package metadata is slow, so only do it when asked
+    if name == "__version__":
+        import importlib.metadata
 
-__version__ = importlib.metadata.version("slappt")
+        return importlib.metadata.version("slappt")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,802 @@
+"""
+An asyncio counterpart of slappt's submission pipeline (validation, script
+generation, upload, `sbatch` and job ID parsing), for services which submit
+from an event loop. Many jobs, on any number of hosts, are submitted
+concurrently without a thread per submission.
+
+Remote hosts are reached with asyncssh, which is optional (install with
+`pip install slappt[async]`). Local submissions need nothing extra.
+"""
+
+import asyncio
+import os
+import shlex
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from functools import partial
+from os.path import dirname, join
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import httpx
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+from slappt import docker
+from slappt.exceptions import ExitStatusException
+from slappt.inputs import (
+    LineScanner,
+    count_lines,
+    format_index,
+    get_index_path,
+    get_remote_count_command,
+    get_remote_index_command,
+    write_index,
+)
+from slappt.models import SlapptConfig
+from slappt.scripts import ScriptGenerator
+from slappt.slappt import (
+    cache_max_array_size,
+    check_index_status,
+    get_cached_max_array_size,
+    get_job_name,
+    get_script_name,
+    get_staged_files,
+    get_submit_commands,
+    parse_input_count,
+    parse_job_ids,
+)
+from slappt.transfer import DEFAULT_BLOCK_SIZE, TransferStats
+
+# the default number of jobs to validate or submit at once
+DEFAULT_CONCURRENCY = 16
+
+
+async def run_blocking(fn, *args):
+    # file I/O (or blocking lookups) would otherwise stall every other
+    # submission on the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+@retry(
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    stop=stop_after_attempt(3),
+    retry=(
+        retry_if_exception_type(httpx.TransportError)
+        | retry_if_exception_type(httpx.HTTPStatusError)
+    ),
+    reraise=True,
+)
+async def query_manifest(
+    ref: docker.ImageReference,
+    client: httpx.AsyncClient,
+    credentials: Optional[Tuple[str, str]] = None,
+) -> httpx.Response:
+    """
+    Sends a `HEAD` request for the given image's manifest. See
+    `slappt.docker.query_manifest`.
+    """
+    credentials = credentials or docker.registry_credentials()
+    url = docker.manifest_url(ref)
+    headers = {"Accept": docker.MANIFEST_MEDIA_TYPES}
+    response = await client.head(url, headers=headers)
+
+    if response.status_code == 401:
+        challenge = response.headers.get("WWW-Authenticate", "")
+        if challenge.lower().startswith("bearer"):
+            realm, params, key = docker.parse_challenge(challenge, credentials)
+            token = docker.cached_token(key) if realm else None
+            if realm and token is None:
+                now = time.time()
+                token = docker.read_token(
+                    key,
+                    await client.get(realm, params=params, auth=credentials),
+                    now,
+                )
+            if token is not None:
+                headers["Authorization"] = f"Bearer {token}"
+                response = await client.head(url, headers=headers)
+        elif credentials is not None:
+            response = await client.head(
+                url, headers=headers, auth=credentials
+            )
+
+    docker.check_response(response)
+    return response
+
+
+async def images_exist(
+    images: Iterable[str],
+    use_cache: bool = True,
+    client: Optional[httpx.AsyncClient] = None,
+    local_paths: bool = True,
+    concurrency: int = docker.IMAGE_QUERY_WORKERS,
+) -> Dict[str, bool]:
+    """
+    Checks whether each of the given images exists, with at most
+    `concurrency` registry lookups in flight. See
+    `slappt.docker.images_exist`, whose cache this shares.
+    """
+    refs = {image: docker.parse_image_reference(image) for image in images}
+    cache = docker.image_cache() if use_cache else None
+    found, pending = docker.plan_lookups(refs.values(), cache, local_paths)
+
+    if pending:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        async with AsyncExitStack() as stack:
+            if client is None:
+                client = await stack.enter_async_context(
+                    httpx.AsyncClient(timeout=15)
+                )
+
+            async def query(key):
+                async with semaphore:
+                    response = await query_manifest(pending[key], client)
+                return key, response.status_code == 200
+
+            for key, exists in await asyncio.gather(
+                *[query(key) for key in pending]
+            ):
+                found[key] = exists
+                if cache is not None:
+                    docker.cache_result(cache, key, exists)
+
+    return {image: found[str(ref)] for image, ref in refs.items()}
+
+
+async def validate_configs(
+    configs: Iterable[SlapptConfig], use_cache: bool = True, **kwargs
+) -> List[Tuple[bool, List[str]]]:
+    """
+    Validates many configs at once, looking each distinct image up only
+    once. Extra keyword arguments are passed to `images_exist`. See
+    `ScriptGenerator.validate_configs`.
+
+    Returns:
+        A `(valid, errors)` tuple for each config, in order.
+    """
+    configs = list(configs)
+
+    # resolving digests also caches whether the images exist
+    pinned = {c.image for c in configs if ScriptGenerator.pins_digest(c)}
+    digests = {}
+    if pinned:
+        digests = await run_blocking(
+            partial(docker.resolve_digests, pinned, use_cache=use_cache)
+        )
+
+    local, remote = await asyncio.gather(
+        *[
+            images_exist(
+                [c.image for c in configs if (c.host is None) == is_local],
+                use_cache=use_cache,
+                local_paths=is_local,
+                **kwargs,
+            )
+            for is_local in (True, False)
+        ]
+    )
+
+    results = []
+    for config in configs:
+        errors = ScriptGenerator.get_errors(
+            config,
+            (local if config.host is None else remote)[config.image],
+            digests.get(config.image, None),
+        )
+        results.append((len(errors) == 0, errors))
+    return results
+
+
+async def validate_config(
+    config: SlapptConfig, use_cache: bool = True, **kwargs
+) -> Tuple[bool, List[str]]:
+    return (await validate_configs([config], use_cache, **kwargs))[0]
+
+
+async def generate_script(config: SlapptConfig) -> List[str]:
+    # generating may count the inputs file, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: ScriptGenerator(config, validate=False).get_job_script()
+    )
+
+
+class _LocalFile:
+    def __init__(self, file):
+        self.file = file
+
+    @staticmethod
+    async def open(path: str) -> "_LocalFile":
+        return _LocalFile(await run_blocking(open, path, "wb"))
+
+    async def write(self, data: bytes):
+        await run_blocking(self.file.write, data)
+
+    async def close(self):
+        await run_blocking(self.file.close)
+
+
+class LocalHost:
+    """
+    Runs commands on this machine as subprocesses.
+    """
+
+    name = "localhost"
+
+    async def run(self, command: str) -> Tuple[int, str, str]:
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(command),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        return proc.returncode, stdout.decode(), stderr.decode()
+
+    async def mkdir(self, path: str):
+        if path:
+            await run_blocking(partial(os.makedirs, path, exist_ok=True))
+
+    async def open(self, path: str, block_size: int = DEFAULT_BLOCK_SIZE):
+        return await _LocalFile.open(path)
+
+    async def close(self):
+        pass
+
+
+class SSHHost:
+    """
+    Runs commands and writes files on a remote host over a single asyncssh
+    connection and SFTP session.
+    """
+
+    def __init__(self, name: str, connection, sftp):
+        self.name = name
+        self.connection = connection
+        self.sftp = sftp
+
+    @staticmethod
+    async def connect(
+        config: SlapptConfig,
+        known_hosts: Optional[str] = None,
+        require_host_key: bool = False,
+    ) -> "SSHHost":
+        """
+        Opens a connection to the given config's host. Host keys are checked
+        like `slappt.ssh.SSH` does: against the given known hosts file (or
+        the platform's default), rejecting changed keys, and rejecting
+        unknown hosts too if `require_host_key` is set.
+        """
+        try:
+            import asyncssh
+        except ImportError:
+            raise ImportError(
+                "Submitting to remote hosts asynchronously requires asyncssh "
+                "(pip install slappt[async])"
+            )
+        from slappt.ssh import default_known_hosts_path
+
+        if known_hosts:
+            path = Path(known_hosts).expanduser().absolute()
+            if not path.is_file():
+                raise FileNotFoundError(
+                    f"Known hosts file {path} does not exist"
+                )
+        else:
+            path = Path(default_known_hosts_path())
+        known = str(path) if path.is_file() else None
+
+        class Client(asyncssh.SSHClient):
+            def validate_host_public_key(self, host, addr, port, key):
+                # only asked about keys the known hosts file doesn't list.
+                # like paramiko's AutoAddPolicy, trust hosts never seen
+                # before, but not hosts whose key has changed
+                if require_host_key:
+                    return False
+                if known is None:
+                    return True
+                trusted = asyncssh.match_known_hosts(
+                    known, host, addr, port if port != 22 else None
+                )[0]
+                return not trusted
+
+        kwargs = {}
+        if config.password:
+            kwargs["password"] = config.password
+        elif config.pkey:
+            kwargs["client_keys"] = [os.path.expanduser(config.pkey)]
+
+        connection = await asyncssh.connect(
+            config.host,
+            port=config.port,
+            username=config.username,
+            known_hosts=known if known is not None else (),
+            client_factory=Client,
+            connect_timeout=config.timeout,
+            **kwargs,
+        )
+        try:
+            sftp = await connection.start_sftp_client()
+        except BaseException:
+            connection.close()
+            raise
+        return SSHHost(config.host, connection, sftp)
+
+    async def run(self, command: str) -> Tuple[int, str, str]:
+        result = await self.connection.run(command, check=False)
+        return result.exit_status, result.stdout, result.stderr
+
+    async def mkdir(self, path: str):
+        import asyncssh
+
+        # other jobs may be creating the same directory concurrently
+        if path and not await self.sftp.isdir(path):
+            try:
+                await self.sftp.mkdir(path)
+            except asyncssh.SFTPError:
+                if not await self.sftp.isdir(path):
+                    raise
+
+    async def makedirs(self, path: str):
+        import asyncssh
+
+        if path and not await self.sftp.isdir(path):
+            try:
+                await self.sftp.makedirs(path, exist_ok=True)
+            except asyncssh.SFTPError:
+                if not await self.sftp.isdir(path):
+                    raise
+
+    async def list_attrs(self, directories: Iterable[str]) -> Dict[str, tuple]:
+        """
+        Lists the given directories. See `slappt.transfer.get_remote_attrs`.
+        """
+        import asyncssh
+
+        attrs = {}
+        for directory in directories:
+            try:
+                entries = await self.sftp.readdir(directory or ".")
+            except asyncssh.SFTPError:
+                continue  # doesn't exist yet
+            for entry in entries:
+                path = join(directory, entry.filename)
+                attrs[path] = (entry.attrs.size, entry.attrs.mtime)
+        return attrs
+
+    async def utime(self, path: str, times: Tuple[float, float]):
+        await self.sftp.utime(path, times)
+
+    async def open(self, path: str, block_size: int = DEFAULT_BLOCK_SIZE):
+        return await self.sftp.open(path, "wb", block_size=block_size)
+
+    async def close(self):
+        self.sftp.exit()
+        self.connection.close()
+        await self.connection.wait_closed()
+
+
+Host = Union[LocalHost, SSHHost]
+
+
+async def upload_chunks(
+    host: Host,
+    chunks: Iterable[bytes],
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TransferStats:
+    start = time.perf_counter()
+    total = 0
+    remote_file = await host.open(remote_path, block_size)
+    try:
+        for chunk in chunks:
+            await remote_file.write(chunk)
+            total += len(chunk)
+    finally:
+        await remote_file.close()
+    return TransferStats(remote_path, total, time.perf_counter() - start)
+
+
+async def upload_file(
+    host: Host,
+    local_path,
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TransferStats:
+    start = time.perf_counter()
+    total = 0
+    async with AsyncExitStack() as stack:
+        local_file = stack.enter_context(
+            await run_blocking(Path(local_path).open, "rb")
+        )
+        remote_file = await host.open(remote_path, block_size)
+        stack.push_async_callback(remote_file.close)
+        while True:
+            chunk = await run_blocking(local_file.read, block_size)
+            if not chunk:
+                break
+            await remote_file.write(chunk)
+            total += len(chunk)
+    return TransferStats(remote_path, total, time.perf_counter() - start)
+
+
+async def upload_staged_files(
+    config: SlapptConfig, host: Host, verbose: bool = False
+) -> List[TransferStats]:
+    """
+    Uploads the files selected by the job's `upload` section (if any) to
+    its working directory on a remote host, `upload.workers` at a time,
+    skipping any unchanged since the last upload. See
+    `slappt.slappt.upload_staged_files`.
+
+    Returns:
+        Stats for each file uploaded.
+    """
+    if not config.upload or isinstance(host, LocalHost):
+        return []
+    upload, dest, files = await run_blocking(get_staged_files, config)
+    await host.makedirs(dest)
+
+    remote = await host.list_attrs({dirname(r) for _, r in files})
+    pending = []
+    for local, remote_path in files:
+        st = await run_blocking(os.stat, local)
+        if remote.get(remote_path, None) != (st.st_size, int(st.st_mtime)):
+            pending.append((local, remote_path, st))
+
+    semaphore = asyncio.Semaphore(max(1, upload.workers))
+
+    async def upload_one(local, remote_path, st):
+        async with semaphore:
+            stats = await upload_file(
+                host, local, remote_path, config.upload_block_size
+            )
+            # so the next upload can tell the file is unchanged
+            await host.utime(remote_path, (st.st_atime, st.st_mtime))
+            return stats
+
+    stats = await asyncio.gather(*[upload_one(*p) for p in pending])
+    if verbose:
+        print(
+            f"Uploaded {len(stats)} of {len(files)} file(s) to {host.name}: "
+            f"{dest or '.'}"
+        )
+    return list(stats)
+
+
+async def upload_inputs(
+    host: Host,
+    local_path,
+    remote_path: str,
+    index_path: Optional[str] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Tuple[int, List[TransferStats]]:
+    """
+    Uploads an inputs file in a single streaming pass, counting its lines
+    and (if an index path is given) uploading its line index as it goes.
+    See `slappt.inputs.upload_inputs`.
+    """
+    scanner = LineScanner()
+    index_bytes = 0
+    start = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        local_file = stack.enter_context(
+            await run_blocking(Path(local_path).open, "rb")
+        )
+        remote_file = await host.open(remote_path, block_size)
+        stack.push_async_callback(remote_file.close)
+        index_file = None
+        if index_path is not None:
+            index_file = await host.open(index_path, block_size)
+            stack.push_async_callback(index_file.close)
+
+        while True:
+            chunk = await run_blocking(local_file.read, block_size)
+            if not chunk:
+                break
+            offsets = scanner.scan(chunk, offsets=index_file is not None)
+            await remote_file.write(chunk)
+            if index_file is not None and offsets:
+                records = format_index(offsets)
+                await index_file.write(records)
+                index_bytes += len(records)
+
+    seconds = time.perf_counter() - start
+    stats = [TransferStats(remote_path, scanner.offset, seconds)]
+    if index_path is not None:
+        stats.append(TransferStats(index_path, index_bytes, seconds))
+    return scanner.count, stats
+
+
+async def get_max_array_size(config: SlapptConfig, host: Host) -> int:
+    """
+    Returns the cluster's `MaxArraySize`. See
+    `slappt.slappt.get_max_array_size`, whose cache this shares.
+    """
+    max_array_size = get_cached_max_array_size(config)
+    if max_array_size is not None:
+        return max_array_size
+
+    try:
+        _, output, _ = await host.run("scontrol show config")
+    except FileNotFoundError:
+        output = ""
+    return cache_max_array_size(config, output)
+
+
+async def prepare_inputs(config: SlapptConfig, host: Host) -> int:
+    """
+    Puts the given job's inputs file (and its line index, if array tasks
+    will look their input up by it) where the job expects it.
+
+    Returns:
+        The number of inputs.
+    """
+    workdir = config.workdir if config.workdir else ""
+    loop = asyncio.get_running_loop()
+    use_index = await loop.run_in_executor(
+        None, ScriptGenerator.uses_input_index, config
+    )
+
+    if config.remote_inputs:
+        status, output, stderr = await host.run(
+            get_remote_count_command(config.inputs)
+        )
+        input_count = parse_input_count(config, output)
+        if use_index:
+            status, _, stderr = await host.run(
+                get_remote_index_command(config.inputs)
+            )
+            check_index_status(config, status, stderr)
+        return input_count
+
+    if isinstance(host, LocalHost):
+        return await loop.run_in_executor(
+            None,
+            write_index if use_index else count_lines,
+            config.inputs,
+        )
+
+    remote_path = join(workdir, Path(config.inputs).name)
+    input_count, _ = await upload_inputs(
+        host,
+        config.inputs,
+        remote_path,
+        get_index_path(remote_path) if use_index else None,
+        config.upload_block_size,
+    )
+    return input_count
+
+
+def check_supported(config: SlapptConfig):
+    """
+    Raises `ValueError` for options this module can't honour yet, rather
+    than submitting without them: `remote_cache` (see
+    `slappt.transfer.RemoteCache`) needs the blocking SFTP client.
+    """
+    if config.host and config.remote_cache:
+        raise ValueError(
+            f"{get_job_name(config)}: remote_cache is not supported by "
+            "slappt.aio, submit with slappt.slappt.submit instead"
+        )
+
+
+async def submit_job(
+    config: SlapptConfig,
+    host: Host,
+    script: Optional[Sequence[str]] = None,
+    verbose: bool = False,
+) -> List[str]:
+    """
+    Generates (unless a script is given), uploads and submits the given job
+    on the given host. The config is assumed to be valid.
+
+    Returns:
+        The job's Slurm job ID(s).
+    """
+    check_supported(config)
+    if script is None and not config.file:
+        script = await generate_script(config)
+
+    workdir = config.workdir if config.workdir else ""
+    await host.mkdir(workdir)
+    input_count = await prepare_inputs(config, host) if config.inputs else 0
+
+    script_path = join(workdir, get_script_name(config))
+    if config.file:
+        data = await run_blocking(Path(config.file).read_bytes)
+    else:
+        data = "".join(f"{line}\n" for line in script).encode("utf-8")
+    if not (isinstance(host, LocalHost) and config.file):
+        await upload_chunks(
+            host, [data], script_path, config.upload_block_size
+        )
+    if verbose:
+        print(f"Uploaded job script to {host.name}: {script_path}")
+    await upload_staged_files(config, host, verbose)
+
+    if isinstance(host, LocalHost):
+        for pre_cmd in config.pre if config.pre else []:
+            status, stdout, stderr = await host.run(pre_cmd)
+            if status != 0:
+                raise ExitStatusException(
+                    f"Received non-zero exit status from pre-command: {stdout + stderr}"
+                )
+
+    max_array_size = (
+        await get_max_array_size(config, host) if config.inputs else None
+    )
+    job_ids = []
+    for command in get_submit_commands(
+        config, input_count, max_array_size, parsable=True
+    ):
+        status, stdout, stderr = await host.run(command)
+        if status != 0:
+            raise ExitStatusException(
+                f"Received non-zero exit status from submission command on {host.name}: {stdout + stderr}"
+            )
+        job_ids += parse_job_ids(stdout)
+    if verbose:
+        print(f"Submitted {config.name} to {host.name}: {job_ids}")
+    return job_ids
+
+
+class HostPool:
+    """
+    Opens one connection per remote host (and user), shared by every job
+    submitted through the pool, and closes them all on exit. Host keys are
+    checked as `SSHHost.connect` describes.
+    """
+
+    def __init__(
+        self, known_hosts: Optional[str] = None, require_host_key: bool = False
+    ):
+        self._hosts: Dict[tuple, asyncio.Future] = {}
+        self._local = LocalHost()
+        self.known_hosts = known_hosts
+        self.require_host_key = require_host_key
+
+    async def get(self, config: SlapptConfig) -> Host:
+        if not config.host:
+            return self._local
+        key = (config.host, config.port, config.username)
+        if key not in self._hosts:
+            self._hosts[key] = asyncio.ensure_future(
+                SSHHost.connect(
+                    config, self.known_hosts, self.require_host_key
+                )
+            )
+        return await self._hosts[key]
+
+    async def close(self):
+        for future in self._hosts.values():
+            if future.done() and not future.cancelled():
+                if future.exception() is None:
+                    await future.result().close()
+            else:
+                future.cancel()
+        self._hosts.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+async def submit(
+    config: SlapptConfig,
+    script: Optional[Sequence[str]] = None,
+    validate: bool = True,
+    verbose: bool = False,
+    pool: Optional[HostPool] = None,
+) -> List[str]:
+    """
+    Validates, generates (unless a script is given), uploads and submits
+    the given job.
+
+    Returns:
+        The job's Slurm job ID(s).
+    """
+    check_supported(config)
+    if validate:
+        valid, errors = await validate_config(config)
+        if not valid:
+            raise ValueError(f"Invalid config: {errors}")
+
+    async with AsyncExitStack() as stack:
+        if pool is None:
+            pool = await stack.enter_async_context(HostPool())
+        return await submit_job(
+            config, await pool.get(config), script, verbose
+        )
+
+
+async def submit_many(
+    jobs: Iterable[Union[SlapptConfig, Tuple[SlapptConfig, Sequence[str]]]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    validate: bool = True,
+    verbose: bool = False,
+    pool: Optional[HostPool] = None,
+) -> Dict[str, List[str]]:
+    """
+    Submits many jobs concurrently, with at most `concurrency` in flight
+    at once. Jobs bound for the same host share one connection. Images are
+    validated up front, each distinct image only once. Cancelling the
+    calling task cancels every submission still in flight and closes the
+    connections.
+
+    Args:
+        jobs: Job configurations, or pairs of configuration and script.
+        concurrency: The maximum number of jobs to submit at once.
+        validate: Whether to validate the configs before submitting.
+        verbose: Whether to print progress information.
+        pool: The connections to submit over (a new pool, closed on
+            return, by default).
+    Returns:
+        A dictionary mapping each job's name to its Slurm job ID(s).
+    """
+    jobs = [j if isinstance(j, tuple) else (j, None) for j in jobs]
+    names = [get_job_name(config) for config, _ in jobs]
+    duplicates = [n for n, count in Counter(names).items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Duplicate job name(s): {', '.join(duplicates)}")
+    for config, _ in jobs:
+        check_supported(config)
+
+    if validate:
+        results = await validate_configs([config for config, _ in jobs])
+        invalid = [
+            f"{name}: {errors}"
+            for name, (valid, errors) in zip(names, results)
+            if not valid
+        ]
+        if invalid:
+            raise ValueError(f"Invalid config(s): {invalid}")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    async with AsyncExitStack() as stack:
+        if pool is None:
+            pool = await stack.enter_async_context(HostPool())
+
+        async def submit_one(config, script):
+            async with semaphore:
+                host = await pool.get(config)
+                return await submit_job(config, host, script, verbose)
+
+        results = await asyncio.gather(
+            *[submit_one(config, script) for config, script in jobs],
+            return_exceptions=True,
+        )
+
+    job_ids, errors = {}, {}
+    for name, result in zip(names, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException):
+            errors[name] = result
+        else:
+            job_ids[name] = result
+    if errors:
+        raise ExitStatusException(
+            f"Failed to submit {len(errors)} job(s) (submitted: {job_ids})\n"
+            + "\n".join(f"{n}: {e}" for n, e in errors.items())
+        )
+    return job_ids
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+def default_cache_dir() -> Path:
+    """
+    Returns the directory slappt keeps its local caches in. Defaults to
+    `$XDG_CACHE_HOME/slappt` (or `~/.cache/slappt`), and can be overridden
+    with the `SLAPPT_CACHE_DIR` environment variable.
+    """
+    override = os.environ.get("SLAPPT_CACHE_DIR", None)
+    if override:
+        return Path(override).expanduser()
+
+    xdg = os.environ.get("XDG_CACHE_HOME", None)
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "slappt"
+
+
+class FileCache:
+    """
+    A small JSON key/value store on disk with per-entry expiry. Writes take
+    a file lock and replace the file atomically, so any number of processes
+    on the same host can share one cache. Reads don't need the lock.
+
+    Expired entries are dropped whenever the cache is written. If there are
+    still more than `max_entries` entries after that, the oldest ones (by
+    time stored) are evicted.
+    """
+
+    def __init__(self, path, max_entries: int = 1024, timeout: int = 10):
+        self.path = Path(path).expanduser()
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._lock = None
+
+    @property
+    def lock(self):
+        # only writers take the lock, so don't import filelock until then
+        if self._lock is None:
+            from filelock import FileLock
+
+            self._lock = FileLock(f"{self.path}.lock", timeout=self.timeout)
+        return self._lock
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+    def _evict(self, entries: dict, now: float) -> dict:
+        entries = {k: e for k, e in entries.items() if e["expires"] > now}
+        if len(entries) > self.max_entries:
+            newest = sorted(
+                entries.items(), key=lambda i: i[1]["stored"], reverse=True
+            )
+            entries = dict(newest[: self.max_entries])
+        return entries
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._read().get(key, None)
+        if entry is None or entry["expires"] <= time.time():
+            return default
+        return entry["value"]
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self.lock:
+            now = time.time()
+            entries = self._read()
+            entries[key] = {
+                "value": value,
+                "stored": now,
+                "expires": now + ttl,
+            }
+            self._write(self._evict(entries, now))
+
+    def invalidate(self, key: str) -> bool:
+        with self.lock:
+            entries = self._read()
+            if key not in entries:
+                return False
+            del entries[key]
+            self._write(self._evict(entries, time.time()))
+            return True
+
+    def clear(self):
+        with self.lock:
+            self._write({})
+
+    def __len__(self):
+        now = time.time()
+        return sum(1 for e in self._read().values() if e["expires"] > now)
+
+    def __contains__(self, key: str):
+        return self.get(key, None) is not None
+
+
+_caches = {}
+
+
+def get_cache(name: str, directory: Optional[str] = None) -> FileCache:
+    """
+    Returns the process-wide cache with the given name, stored in the given
+    directory (the default cache directory if none is given).
+    """
+    path = Path(directory or default_cache_dir()) / f"{name}.json"
+    cache = _caches.get(str(path), None)
+    if cache is None:
+        cache = FileCache(path)
+        _caches[str(path)] = cache
+    return cache
@@ -1,62 +1,544 @@
-import requests
-from requests import HTTPError, ReadTimeout, RequestException, Timeout
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
+import functools
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+from slappt.cache import FileCache, get_cache
+
+# httpx and tenacity are only imported once a registry is actually queried,
+# so generating scripts for cached or local images stays quick to start
+if TYPE_CHECKING:
+    import httpx
+
+# how long to trust a cached lookup, in seconds. images rarely disappear,
+# but a missing image may be pushed at any moment, so misses expire sooner
+IMAGE_CACHE_POSITIVE_TTL = 24 * 60 * 60
+IMAGE_CACHE_NEGATIVE_TTL = 10 * 60
+
+# a tag may be moved to another image at any moment, so the digest it
+# resolved to is only trusted briefly (digests themselves never change)
+DIGEST_CACHE_TTL = 5 * 60
+
+# how many lookups to run at once when validating images in bulk
+IMAGE_QUERY_WORKERS = 8
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def with_retries(fn):
+    """
+    Retries the decorated registry query (up to 3 attempts, with backoff)
+    on transport errors and throttled or failed responses. tenacity is
+    imported on the first call.
+    """
+    retrying = None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        nonlocal retrying
+        if retrying is None:
+            import httpx
+            from tenacity import (
+                retry,
+                retry_if_exception_type,
+                stop_after_attempt,
+                wait_exponential,
+            )
+
+            retrying = retry(
+                wait=wait_exponential(multiplier=1, min=4, max=10),
+                stop=stop_after_attempt(3),
+                retry=(
+                    retry_if_exception_type(httpx.TransportError)
+                    | retry_if_exception_type(httpx.HTTPStatusError)
+                ),
+                reraise=True,
+            )(fn)
+        return retrying(*args, **kwargs)
+
+    return wrapper
+
 
+def http_client() -> "httpx.Client":
+    """
+    Returns a process-wide HTTP client. Connections are pooled and kept
+    alive, so repeated lookups skip the TCP and TLS handshakes.
+    """
+    import httpx
 
-@retry(
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    stop=stop_after_attempt(3),
-    retry=(
-        retry_if_exception_type(ConnectionError)
-        | retry_if_exception_type(RequestException)
-        | retry_if_exception_type(ReadTimeout)
-        | retry_if_exception_type(Timeout)
-        | retry_if_exception_type(HTTPError)
-    ),
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                timeout=15,
+                limits=httpx.Limits(
+                    max_connections=IMAGE_QUERY_WORKERS,
+                    max_keepalive_connections=IMAGE_QUERY_WORKERS,
+                ),
+            )
+        return _client
+
+
+def image_cache() -> FileCache:
+    return get_cache("images")
+
+
+# registry scheme prefixes which slappt resolves without a network call
+LOCAL_SCHEMES = ("library", "oras")
+
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+DOCKER_HUB_ALIASES = ("docker.io", "index.docker.io", DOCKER_HUB_REGISTRY)
+
+MANIFEST_MEDIA_TYPES = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
 )
-def image_exists(name, owner=None, tag=None):
-    url = f"https://hub.docker.com/v2/repositories/{owner if owner is not None else 'library'}/{name}/"
-    if tag is not None:
-        url += f"tags/{tag}/"
-    response = requests.get(url)
-    try:
-        content = response.json()
-        if "user" not in content and "name" not in content:
-            return False
-        if (
-            content["name"] != tag
-            and content["name"] != name
-            and content["user"] != (owner if owner is not None else "library")
-        ):
-            return False
-        return True
-    except:
-        return False
-
-
-def parse_image_components(value):
-    container_split = (
-        value.split("#", 1)[0].strip().split("/")
-    )  # get rid of comments first
-    container_name = container_split[-1]
-
-    if len(container_split) > 1:
-        container_owner = (
-            None if container_split[-2] == "" else container_split[-2]
-        )
-    else:
-        container_owner = None
 
-    if ":" in container_name:
-        container_name_split = container_name.split(":")
-        container_name = container_name_split[0]
-        container_tag = container_name_split[1]
+
+@dataclass
+class ImageReference:
+    registry: Optional[str]
+    repository: str
+    tag: Optional[str] = None
+    digest: Optional[str] = None
+    scheme: str = "docker"
+
+    @property
+    def is_remote(self) -> bool:
+        return self.scheme == "docker"
+
+    @property
+    def reference(self) -> str:
+        return self.digest or self.tag or "latest"
+
+    def __str__(self):
+        if not self.is_remote:
+            return (
+                self.repository
+                if self.scheme == "sif"
+                else f"{self.scheme}://{self.repository}"
+            )
+        sep = "@" if self.digest else ":"
+        return f"{self.registry}/{self.repository}{sep}{self.reference}"
+
+
+def parse_image_reference(value: str) -> ImageReference:
+    """
+    Parses an image reference such as `docker://alpine`,
+    `ghcr.io/owner/name:tag`, `localhost:5000/name@sha256:...`,
+    `library://owner/collection/name` or `/path/to/image.sif`. References
+    without a registry host are assumed to be on Docker Hub.
+    """
+    value = value.split("#", 1)[0].strip()  # get rid of comments first
+
+    scheme, sep, rest = value.partition("://")
+    if not sep:
+        scheme, rest = "docker", value
+    if scheme in LOCAL_SCHEMES:
+        return ImageReference(registry=None, repository=rest, scheme=scheme)
+    if scheme == "file" or rest.endswith(".sif"):
+        return ImageReference(registry=None, repository=rest, scheme="sif")
+
+    rest, _, digest = rest.partition("@")
+    parts = rest.split("/")
+    if len(parts) > 1 and (
+        "." in parts[0] or ":" in parts[0] or parts[0] == "localhost"
+    ):
+        registry, parts = parts[0], parts[1:]
     else:
-        container_tag = None
+        registry = DOCKER_HUB_REGISTRY
+
+    name, _, tag = parts[-1].partition(":")
+    parts[-1] = name
+    if registry in DOCKER_HUB_ALIASES:
+        registry = DOCKER_HUB_REGISTRY
+        if len(parts) == 1:
+            parts.insert(0, "library")
+
+    return ImageReference(
+        registry=registry,
+        repository="/".join(parts),
+        tag=tag or None,
+        digest=digest or None,
+    )
+
+
+def local_image_exists(ref: ImageReference, local_paths: bool = True) -> bool:
+    if ref.scheme == "sif":
+        return not local_paths or Path(ref.repository).expanduser().is_file()
+    return bool(ref.repository)
+
+
+def registry_url(registry: str) -> str:
+    # like the docker daemon, talk plain HTTP to registries on this machine
+    host = registry.rsplit(":", 1)[0]
+    insecure = host in ("localhost", "127.0.0.1")
+    return f"{'http' if insecure else 'https'}://{registry}"
+
+
+def registry_credentials() -> Optional[Tuple[str, str]]:
+    username = os.environ.get("SLAPPT_REGISTRY_USERNAME", None)
+    password = os.environ.get("SLAPPT_REGISTRY_PASSWORD", None)
+    return (username, password) if username and password else None
+
+
+def manifest_url(ref: ImageReference) -> str:
+    return f"{registry_url(ref.registry)}/v2/{ref.repository}/manifests/{ref.reference}"
+
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+_token_fetches = {}
+
+
+def parse_challenge(
+    challenge: str, credentials: Optional[Tuple[str, str]] = None
+) -> Tuple[Optional[str], dict, tuple]:
+    """
+    Parses a `WWW-Authenticate: Bearer` challenge into the token realm, the
+    parameters to request a token with, and a key to cache the token under.
+    """
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop("realm", None)
+    key = (realm, params.get("service"), params.get("scope"), credentials)
+    return realm, params, key
+
+
+def cached_token(key: tuple) -> Optional[str]:
+    with _tokens_lock:
+        token, expires = _tokens.get(key, (None, 0))
+    return token if expires > time.time() else None
+
+
+def store_token(key: tuple, content: dict, now: float) -> Optional[str]:
+    token = content.get("token", None) or content.get("access_token", None)
+    with _tokens_lock:
+        # refresh a little early rather than risk using a stale token
+        _tokens[key] = (token, now + int(content.get("expires_in", 60)) - 10)
+    return token
+
+
+def check_response(response: "httpx.Response"):
+    # throttled or unavailable, retry rather than reporting a miss
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+
+
+def read_token(
+    key: tuple, response: "httpx.Response", now: float
+) -> Optional[str]:
+    """
+    Stores and returns the token in a token endpoint's response. Throttled
+    or failed responses raise (to be retried), while any other failure is
+    a miss, since the manifest request then stays unauthorized.
+    """
+    check_response(response)
+    if response.status_code != 200:
+        return None
+    return store_token(key, response.json(), now)
+
+
+def get_registry_token(
+    client: "httpx.Client",
+    challenge: str,
+    credentials: Optional[Tuple[str, str]] = None,
+) -> Optional[str]:
+    """
+    Fetches (or reuses) a bearer token satisfying the given
+    `WWW-Authenticate` challenge, anonymously unless credentials are given.
+    """
+    realm, params, key = parse_challenge(challenge, credentials)
+    if realm is None:
+        return None
+
+    token = cached_token(key)
+    if token is not None:
+        return token
+
+    # concurrent lookups share one fetch per challenge rather than racing
+    with _tokens_lock:
+        fetching = _token_fetches.setdefault(key, threading.Lock())
+    with fetching:
+        token = cached_token(key)
+        if token is not None:
+            return token
+
+        now = time.time()
+        response = client.get(realm, params=params, auth=credentials)
+        return read_token(key, response, now)
+
+
+@with_retries
+def query_manifest(
+    ref: ImageReference,
+    client: Optional["httpx.Client"] = None,
+    credentials: Optional[Tuple[str, str]] = None,
+) -> "httpx.Response":
+    """
+    Sends a `HEAD` request for the given image's manifest, authenticating
+    first if the registry asks for it. Only headers cross the wire.
+    """
+    client = client if client is not None else http_client()
+    credentials = credentials or registry_credentials()
+    url = manifest_url(ref)
+    headers = {"Accept": MANIFEST_MEDIA_TYPES}
+    response = client.head(url, headers=headers)
+
+    if response.status_code == 401:
+        challenge = response.headers.get("WWW-Authenticate", "")
+        if challenge.lower().startswith("bearer"):
+            token = get_registry_token(client, challenge, credentials)
+            if token is not None:
+                headers["Authorization"] = f"Bearer {token}"
+                response = client.head(url, headers=headers)
+        elif credentials is not None:
+            response = client.head(url, headers=headers, auth=credentials)
+
+    check_response(response)
+    return response
+
+
+def query_manifest_exists(
+    ref: ImageReference, client: Optional["httpx.Client"] = None
+) -> bool:
+    # registries answer 401/403 for private or missing repositories alike
+    return query_manifest(ref, client=client).status_code == 200
+
+
+def cache_result(cache: FileCache, key: str, exists: bool):
+    cache.set(
+        key,
+        exists,
+        ttl=(IMAGE_CACHE_POSITIVE_TTL if exists else IMAGE_CACHE_NEGATIVE_TTL),
+    )
+
+
+def plan_lookups(
+    refs: Iterable[ImageReference],
+    cache: Optional[FileCache],
+    local_paths: bool = True,
+) -> Tuple[Dict[str, bool], Dict[str, ImageReference]]:
+    """
+    Sorts the given references into those already known to exist or not,
+    and those which need a registry lookup, each keyed by `str(ref)`.
+    Local references never touch the network, and each distinct registry
+    reference consults the cache only once.
+    """
+    found, pending = {}, {}
+    for ref in refs:
+        key = str(ref)
+        if key in found or key in pending:
+            continue
+        if not ref.is_remote:
+            found[key] = local_image_exists(ref, local_paths=local_paths)
+            continue
+        exists = cache.get(key, None) if cache is not None else None
+        if exists is None:
+            pending[key] = ref
+        else:
+            found[key] = exists
+    return found, pending
+
+
+def images_exist(
+    images: Iterable[str],
+    use_cache: bool = True,
+    workers: int = IMAGE_QUERY_WORKERS,
+    client: Optional["httpx.Client"] = None,
+    local_paths: bool = True,
+) -> Dict[str, bool]:
+    """
+    Checks whether each of the given images exists. Duplicate references are
+    looked up once, and uncached registry lookups run concurrently over a
+    single pooled HTTP client.
+
+    Args:
+        images: Image references, e.g. `docker://alpine:latest`.
+        use_cache: Whether to consult and update the cache.
+        workers: The maximum number of concurrent lookups.
+        client: The HTTP client to use (the process-wide client by default).
+        local_paths: Whether `.sif` paths refer to this machine (if not,
+            they are accepted without checking).
+    Returns:
+        A dictionary mapping each distinct reference to whether it exists.
+    """
+    refs = {image: parse_image_reference(image) for image in images}
+    cache = image_cache() if use_cache else None
+    found, pending = plan_lookups(refs.values(), cache, local_paths)
+
+    def query(key):
+        return key, query_manifest_exists(pending[key], client=client)
+
+    if pending:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for key, exists in executor.map(query, pending):
+                found[key] = exists
+                if cache is not None:
+                    cache_result(cache, key, exists)
+
+    return {image: found[str(ref)] for image, ref in refs.items()}
+
+
+def check_image(
+    image: str,
+    use_cache: bool = True,
+    client: Optional["httpx.Client"] = None,
+    local_paths: bool = True,
+) -> bool:
+    """
+    Checks whether the given image exists. Registry images are checked with
+    a manifest `HEAD` request against any OCI distribution registry, while
+    `library://` and `oras://` references and `.sif` paths are checked
+    locally. See `images_exist` for the arguments.
+    """
+    return images_exist(
+        [image], use_cache=use_cache, client=client, local_paths=local_paths
+    )[image]
+
+
+def image_exists(name, owner=None, tag=None, use_cache=True) -> bool:
+    """
+    Checks whether the given Docker Hub image exists. Kept for callers of
+    the old `name`/`owner`/`tag` interface, see `check_image`.
+    """
+    image = f"{owner if owner is not None else 'library'}/{name}"
+    return check_image(
+        image if tag is None else f"{image}:{tag}", use_cache=use_cache
+    )
+
+
+def digest_cache() -> FileCache:
+    return get_cache("digests")
+
+
+def query_manifest_digest(
+    ref: ImageReference, client: Optional["httpx.Client"] = None
+) -> Tuple[bool, Optional[str]]:
+    """
+    Returns whether the given image exists and, if the registry says, the
+    digest of its manifest (from the same `HEAD` request's
+    `Docker-Content-Digest` header).
+    """
+    response = query_manifest(ref, client=client)
+    if response.status_code != 200:
+        return False, None
+    return True, response.headers.get("Docker-Content-Digest", None) or None
+
+
+def resolve_digests(
+    images: Iterable[str],
+    use_cache: bool = True,
+    workers: int = IMAGE_QUERY_WORKERS,
+    client: Optional["httpx.Client"] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Resolves each of the given registry images (e.g. `docker://alpine`) to
+    the digest its tag currently points to. Duplicate references are
+    resolved once, and uncached lookups run concurrently. References which
+    already name a digest resolve to it without a lookup, and `library://`,
+    `oras://` and `.sif` references (which have no digest to resolve) to
+    None, as do images which don't exist.
+
+    Digests are cached on disk for `DIGEST_CACHE_TTL` seconds (misses like
+    image lookups, see `images_exist`), and each lookup also caches whether
+    the image exists, so validating the same images afterwards costs no
+    further requests.
+
+    Returns:
+        A dictionary mapping each distinct reference to its digest.
+    """
+    refs = {image: parse_image_reference(image) for image in images}
+    cache = digest_cache() if use_cache else None
+    found = {}
+
+    pending = {}
+    for image, ref in refs.items():
+        key = str(ref)
+        if key in found or key in pending:
+            continue
+        if not ref.is_remote or ref.digest:
+            found[key] = ref.digest
+            continue
+        # misses are cached as empty strings
+        digest = cache.get(key, None) if cache is not None else None
+        if digest is None:
+            pending[key] = ref
+        else:
+            found[key] = digest or None
+
+    def query(key):
+        return key, query_manifest_digest(pending[key], client=client)
+
+    if pending:
+        from concurrent.futures import ThreadPoolExecutor
+
+        exists_cache = image_cache() if use_cache else None
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for key, (exists, digest) in executor.map(query, pending):
+                found[key] = digest
+                if cache is not None:
+                    cache.set(
+                        key,
+                        digest or "",
+                        ttl=(
+                            DIGEST_CACHE_TTL
+                            if digest
+                            else IMAGE_CACHE_NEGATIVE_TTL
+                        ),
+                    )
+                    cache_result(exists_cache, key, exists)
+
+    return {image: found[str(ref)] for image, ref in refs.items()}
+
+
+def resolve_digest(
+    image: str,
+    use_cache: bool = True,
+    client: Optional["httpx.Client"] = None,
+) -> Optional[str]:
+    """
+    Resolves the given image to a digest. See `resolve_digests`.
+    """
+    return resolve_digests([image], use_cache=use_cache, client=client)[image]
+
+
+def pin_image(image: str, digest: str) -> str:
+    """
+    Returns the given image reference with its tag (or digest) replaced
+    by the given digest, e.g. `docker://alpine:3` to
+    `docker://alpine@sha256:...`.
+    """
+    value = image.split("#", 1)[0].strip()
+    scheme, sep, rest = value.partition("://")
+    if not sep:
+        scheme, rest = "", value
+    rest = rest.partition("@")[0]
+    path, slash, name = rest.rpartition("/")
+    return f"{scheme}{sep}{path}{slash}{name.partition(':')[0]}@{digest}"
+
+
+def invalidate_image(image: str) -> bool:
+    """
+    Forgets any cached lookup (and resolved digest) for the given image.
+
+    Returns:
+        True if anything was cached for it, otherwise False.
+    """
+    key = str(parse_image_reference(image))
+    invalidated = image_cache().invalidate(key)
+    return digest_cache().invalidate(key) or invalidated
+
 
-    return container_owner, container_name, container_tag
+def clear_image_cache():
+    image_cache().clear()
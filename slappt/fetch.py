@@ -0,0 +1,400 @@
+import logging
+import os
+import stat
+import tarfile
+import threading
+import time
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+from shlex import quote
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from slappt.transfer import (
+    DEFAULT_UPLOAD_WORKERS,
+    TransferStats,
+    download_file,
+    map_sessions,
+)
+
+_logger = logging.getLogger(__name__)
+
+# above this many files (averaging under `TAR_MAX_AVERAGE_SIZE` bytes), they
+# are fetched in one tar stream rather than one download per file
+TAR_THRESHOLD = 50
+TAR_MAX_AVERAGE_SIZE = 1024 * 1024
+
+# the most bytes of a log read per request while following
+LOG_READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class RemoteFile:
+    path: str
+    size: int
+    mtime: float
+
+
+def get_output_patterns(name: str) -> List[str]:
+    # as written by the `--output` and `--error` headers, for every job (or
+    # array task, each of which has its own job ID) with the given name
+    return [f"slappt.{name}.*.out", f"slappt.{name}.*.err"]
+
+
+def get_output_job_id(name: str, filename: str) -> Optional[str]:
+    """
+    Returns the job ID in the name of one of the given job's output or
+    error files, or None if the file isn't one of them (e.g. it belongs to
+    a job whose name starts with this one's, like `<name>.2`).
+    """
+    prefix = f"slappt.{name}."
+    for ext in (".out", ".err"):
+        if filename.startswith(prefix) and filename.endswith(ext):
+            job_id = filename[len(prefix) : -len(ext)]
+            return job_id if job_id.isdigit() else None
+    return None
+
+
+def get_task_ids_command(job_ids: Iterable[str]) -> str:
+    # every array task has its own job ID, which `%j` in file names expands
+    # to, so list them along with the jobs'
+    return f"sacct --allocations --noheader --parsable2 --format=JobIDRaw --jobs={','.join(job_ids)}"
+
+
+def parse_task_ids(output: str) -> Set[str]:
+    return {line.strip() for line in output.splitlines() if line.strip()}
+
+
+def get_find_command(workdir: str, name: str) -> str:
+    """
+    Returns a command listing the given job's output files in its working
+    directory, one `<size> <mtime> <name>` line per file.
+    """
+    names = " -o ".join(f"-name {quote(p)}" for p in get_output_patterns(name))
+    return f"find {quote(workdir or '.')} -maxdepth 1 -type f \\( {names} \\) -printf '%s %T@ %f\\n'"
+
+
+def read_command(client, command: str) -> str:
+    stdin, stdout, stderr = client.exec_command(command)
+    stdin.close()
+    return stdout.read().decode("utf-8", errors="replace")
+
+
+def parse_find_output(output: str) -> List[RemoteFile]:
+    files = []
+    for line in output.splitlines():
+        parts = line.strip().split(" ", 2)
+        if len(parts) < 3:
+            continue
+        try:
+            files.append(RemoteFile(parts[2], int(parts[0]), float(parts[1])))
+        except ValueError:
+            continue
+    return files
+
+
+def is_unchanged(file: RemoteFile, local_path: Path) -> bool:
+    try:
+        st = local_path.stat()
+    except OSError:
+        return False
+    return st.st_size == file.size and int(st.st_mtime) == int(file.mtime)
+
+
+def use_tar(files: List[RemoteFile]) -> bool:
+    return (
+        len(files) > TAR_THRESHOLD
+        and sum(f.size for f in files) / len(files) < TAR_MAX_AVERAGE_SIZE
+    )
+
+
+def fetch_tar(
+    client, workdir: str, files: List[RemoteFile], dest: Path
+) -> List[TransferStats]:
+    """
+    Packs the given files into a tar stream on the cluster and unpacks it
+    locally as it arrives: one command, however many files.
+    """
+    start = time.perf_counter()
+    command = f"tar -C {quote(workdir or '.')} --null -T - -cf -"
+    stdin, stdout, stderr = client.exec_command(command)
+
+    # send the file names while the archive streams back, so neither side
+    # waits on the other however long the list
+    def send_names():
+        for f in files:
+            stdin.write(f"{f.path}\0")
+        stdin.close()
+
+    sender = threading.Thread(target=send_names, daemon=True)
+    sender.start()
+
+    # and drain its errors meanwhile, so a lot of them can't stall the
+    # archive (`read_channel` would decode it as text)
+    errors = []
+    reader = threading.Thread(
+        target=lambda: errors.append(stderr.read()), daemon=True
+    )
+    reader.start()
+
+    wanted = {f.path for f in files}
+    stats = []
+    with tarfile.open(fileobj=stdout, mode="r|") as tar:
+        for member in tar:
+            # only extract the regular files asked for, never paths
+            if not member.isfile() or member.name not in wanted:
+                continue
+            local_path = dest / member.name
+            source = tar.extractfile(member)
+            with open(local_path, "wb") as local_file:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    local_file.write(chunk)
+            os.utime(local_path, (member.mtime, member.mtime))
+            stats.append(
+                TransferStats(
+                    str(local_path),
+                    member.size,
+                    time.perf_counter() - start,
+                )
+            )
+
+    sender.join()
+    status = stdout.channel.recv_exit_status()
+    reader.join()
+    errors = b"".join(errors).decode("utf-8", errors="replace")
+    if status == 1:
+        # GNU tar's "file changed as we read it", e.g. a log still being
+        # written: the archive is complete, with what the file held then
+        _logger.warning(f"Output files changed while packing: {errors}")
+    elif status != 0:
+        raise IOError(f"Failed to pack output files in {workdir}: {errors}")
+    return stats
+
+
+def fetch_outputs(
+    client,
+    name: str,
+    workdir: Optional[str] = None,
+    dest=".",
+    workers: int = DEFAULT_UPLOAD_WORKERS,
+    tar: Optional[bool] = None,
+    progress: bool = False,
+    job_ids: Optional[Iterable[str]] = None,
+) -> List[TransferStats]:
+    """
+    Fetches the output and error files of the given job (including each of
+    its array tasks) from its working directory. The files are listed with
+    one `find`, then either downloaded concurrently over several SFTP
+    sessions or, if there are many small ones, packed into a single tar
+    stream. Files already fetched (with the same size and modification
+    time) are skipped. If job IDs are given, only their files (and their
+    array tasks') are fetched, rather than every run's with the name.
+
+    Args:
+        client: An open connection to the job's host.
+        name: The job's name.
+        workdir: The job's working directory (the home directory if none).
+        dest: The local directory to fetch files into.
+        workers: The number of concurrent downloads.
+        tar: Whether to fetch via a tar stream (decided by the number and
+            size of files if not given).
+        progress: Whether to show a progress bar.
+        job_ids: Slurm job ID(s) of the run to fetch.
+    Returns:
+        Stats for each file fetched.
+    """
+    files = [
+        f
+        for f in parse_find_output(
+            read_command(client, get_find_command(workdir, name))
+        )
+        if get_output_job_id(name, f.path) is not None
+    ]
+    if job_ids is not None:
+        job_ids = list(job_ids)
+        task_ids = set(job_ids)
+        if job_ids:
+            task_ids |= parse_task_ids(
+                read_command(client, get_task_ids_command(job_ids))
+            )
+        files = [
+            f for f in files if get_output_job_id(name, f.path) in task_ids
+        ]
+
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    pending = [f for f in files if not is_unchanged(f, dest / f.path)]
+    _logger.debug(
+        f"Found {len(files)} output file(s) for {name}, {len(pending)} new"
+    )
+    if not pending:
+        return []
+
+    if tar is None:
+        tar = use_tar(pending)
+    if tar:
+        return fetch_tar(client, workdir, pending, dest)
+
+    prefix = f"{workdir}/" if workdir else ""
+    return map_sessions(
+        client,
+        lambda session, f: download_file(
+            session, f"{prefix}{f.path}", dest / f.path, f.mtime
+        ),
+        [(f,) for f in pending],
+        workers,
+        sum(f.size for f in pending),
+        progress,
+    )
+
+
+class LogFollower:
+    """
+    Tails the output and error files of the given jobs (including each of
+    their array tasks) in one working directory over a single SFTP session.
+    Each poll lists the directory once, then reads only the bytes appended
+    to each file since the last poll, through a file handle kept open
+    between polls. Files appearing later (e.g. as array tasks start) are
+    picked up, and files that shrink are read again from the start.
+    """
+
+    def __init__(
+        self, sftp, names: Iterable[str], workdir: Optional[str] = None
+    ):
+        self.sftp = sftp
+        self.workdir = workdir
+        self.patterns = [p for n in names for p in get_output_patterns(n)]
+        self.offsets: Dict[str, int] = {}
+        self.handles = {}
+        self.partial: Dict[str, bytes] = {}
+
+    def path(self, name: str) -> str:
+        return f"{self.workdir}/{name}" if self.workdir else name
+
+    def list(self) -> Dict[str, int]:
+        try:
+            entries = self.sftp.listdir_attr(self.workdir or ".")
+        except IOError:
+            return {}  # not created yet
+        return {
+            e.filename: e.st_size
+            for e in entries
+            if stat.S_ISREG(e.st_mode)
+            and any(fnmatch(e.filename, p) for p in self.patterns)
+        }
+
+    def read(self, name: str, size: int) -> bytes:
+        offset = self.offsets.get(name, 0)
+        if size < offset:
+            # truncated or replaced, so start over
+            _logger.debug(f"{name} shrank, reading from the start")
+            self.close_file(name)
+            offset = 0
+        if size == offset:
+            return b""
+        handle = self.handles.get(name, None)
+        if handle is None:
+            handle = self.handles[name] = self.sftp.open(self.path(name), "rb")
+        handle.seek(offset)
+        chunks = []
+        while offset < size:
+            chunk = handle.read(min(size - offset, LOG_READ_SIZE))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        self.offsets[name] = offset
+        return b"".join(chunks)
+
+    def poll(self) -> List[Tuple[str, str]]:
+        """
+        Reads whatever has been appended to each file since the last poll.
+
+        Returns:
+            A `(file name, line)` pair for each complete line read, in order
+            within each file. Incomplete last lines are held back until the
+            rest arrives (or `flush` is called).
+        """
+        sizes = self.list()
+        for name in set(self.handles) - set(sizes):
+            self.close_file(name)
+        lines = []
+        for name in sorted(sizes):
+            # read first: a file that shrank drops its partial line
+            data = self.read(name, sizes[name])
+            data = self.partial.pop(name, b"") + data
+            *complete, rest = data.split(b"\n")
+            if rest:
+                self.partial[name] = rest
+            lines.extend(
+                (name, line.decode("utf-8", errors="replace"))
+                for line in complete
+            )
+        return lines
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """
+        Returns any incomplete last lines held back by `poll`.
+        """
+        lines = [
+            (name, rest.decode("utf-8", errors="replace"))
+            for name, rest in sorted(self.partial.items())
+        ]
+        self.partial.clear()
+        return lines
+
+    def close_file(self, name: str):
+        handle = self.handles.pop(name, None)
+        if handle is not None:
+            handle.close()
+        self.offsets.pop(name, None)
+        self.partial.pop(name, None)
+
+    def close(self):
+        for name in list(self.handles):
+            self.close_file(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def follow_logs(
+    followers: List[LogFollower],
+    until: Optional[Callable[[], bool]] = None,
+    interval: float = 1,
+    max_interval: float = 30,
+    backoff: float = 1.5,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Polls the given followers, yielding each new line as `(file name,
+    line)`. The polling interval grows by `backoff` after each cycle in
+    which no file grew, up to `max_interval`, and drops back to `interval`
+    as soon as one does. Runs until `until` (checked once per cycle)
+    returns true, then yields any last lines, or forever if not given.
+    """
+    delay = interval
+    while True:
+        # decide before polling, so lines written just before the end are
+        # still read
+        done = until is not None and until()
+        lines = [line for f in followers for line in f.poll()]
+        yield from lines
+        if done:
+            for follower in followers:
+                yield from follower.flush()
+            return
+        delay = interval if lines else min(delay * backoff, max_interval)
+        _logger.debug(f"Polling logs again in {delay:.1f}s")
+        time.sleep(delay)
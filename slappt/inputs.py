@@ -0,0 +1,227 @@
+import os
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from shlex import quote
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from slappt.transfer import (
+    DEFAULT_BLOCK_SIZE,
+    RemoteCache,
+    TransferStats,
+    content_digest,
+)
+
+# each index record is a zero-padded byte offset and a newline, so the
+# record for task N starts at byte (N - 1) * INDEX_RECORD_SIZE
+INDEX_DIGITS = 20
+INDEX_RECORD_SIZE = INDEX_DIGITS + 1
+
+# above this many inputs, job arrays look up their input via the index
+# rather than scanning the inputs file from the top
+INDEX_THRESHOLD = 1000
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def get_index_path(inputs: str) -> str:
+    return f"{inputs}.idx"
+
+
+class LineScanner:
+    """
+    Counts lines (including a final line without a trailing newline) over
+    successive chunks of a file, optionally noting the byte offset at which
+    each line starts.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.offset = 0
+        self.line_start = True
+
+    def scan(self, chunk: bytes, offsets: bool = False) -> List[int]:
+        if not chunk:
+            return []
+
+        starts = []
+        if offsets:
+            if self.line_start:
+                starts.append(self.offset)
+            pos = chunk.find(b"\n")
+            while pos != -1:
+                if pos + 1 < len(chunk):
+                    starts.append(self.offset + pos + 1)
+                pos = chunk.find(b"\n", pos + 1)
+            self.count += len(starts)
+        else:
+            newlines = chunk.count(b"\n")
+            self.count += (
+                newlines
+                - (1 if chunk.endswith(b"\n") else 0)
+                + (1 if self.line_start else 0)
+            )
+
+        self.line_start = chunk.endswith(b"\n")
+        self.offset += len(chunk)
+        return starts
+
+
+def format_index(offsets: List[int]) -> bytes:
+    return "".join(f"{o:0{INDEX_DIGITS}d}\n" for o in offsets).encode()
+
+
+# line counts keyed by path, size and modification time, so a file already
+# counted (e.g. while generating its script) isn't read again
+_counts = {}
+
+
+def count_lines(path, block_size: int = READ_BLOCK_SIZE) -> int:
+    """
+    Counts the lines in the given file in constant memory.
+    """
+    stat = os.stat(path)
+    key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if key in _counts:
+        return _counts[key]
+
+    scanner = LineScanner()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(block_size), b""):
+            scanner.scan(chunk)
+    _counts[key] = scanner.count
+    return scanner.count
+
+
+def iter_index(
+    fileobj: BinaryIO, block_size: int = READ_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """
+    Reads the given binary file object and yields its line index: the byte
+    offset at which each line starts, as fixed-width records.
+    """
+    scanner = LineScanner()
+    for chunk in iter(lambda: fileobj.read(block_size), b""):
+        yield format_index(scanner.scan(chunk, offsets=True))
+
+
+def write_index(path, index_path=None) -> int:
+    """
+    Writes the line index for the given inputs file (by default alongside
+    it, see `get_index_path`).
+
+    Returns:
+        The number of lines indexed.
+    """
+    index_path = index_path or get_index_path(str(path))
+    size = 0
+    with Path(path).open("rb") as src, open(index_path, "wb") as dst:
+        for records in iter_index(src):
+            dst.write(records)
+            size += len(records)
+    return size // INDEX_RECORD_SIZE
+
+
+def upload_inputs(
+    sftp,
+    local_path,
+    remote_path: str,
+    index_path: Optional[str] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Tuple[int, List[TransferStats]]:
+    """
+    Uploads an inputs file in a single streaming pass, counting its lines
+    and (if an index path is given) uploading its line index as it goes.
+    Memory use is bounded by the block size, however large the file.
+
+    Returns:
+        The number of lines, and stats for each file uploaded.
+    """
+    scanner = LineScanner()
+    index_bytes = 0
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        local_file = stack.enter_context(Path(local_path).open("rb"))
+        remote_file = stack.enter_context(
+            sftp.open(remote_path, "wb", bufsize=block_size)
+        )
+        remote_file.set_pipelined(True)
+        index_file = None
+        if index_path is not None:
+            index_file = stack.enter_context(
+                sftp.open(index_path, "wb", bufsize=block_size)
+            )
+            index_file.set_pipelined(True)
+
+        for chunk in iter(lambda: local_file.read(block_size), b""):
+            offsets = scanner.scan(chunk, offsets=index_file is not None)
+            remote_file.write(chunk)
+            if index_file is not None and offsets:
+                records = format_index(offsets)
+                index_file.write(records)
+                index_bytes += len(records)
+
+    seconds = time.perf_counter() - start
+    stats = [TransferStats(remote_path, scanner.offset, seconds)]
+    if index_path is not None:
+        stats.append(TransferStats(index_path, index_bytes, seconds))
+    return scanner.count, stats
+
+
+def scan_inputs(
+    local_path, block_size: int = DEFAULT_BLOCK_SIZE
+) -> Tuple[int, str]:
+    """
+    Reads an inputs file once, counting its lines and hashing its content.
+
+    Returns:
+        The number of lines, and the content's digest.
+    """
+    scanner = LineScanner()
+
+    def chunks():
+        with Path(local_path).open("rb") as f:
+            for chunk in iter(lambda: f.read(block_size), b""):
+                scanner.scan(chunk)
+                yield chunk
+
+    digest = content_digest(chunks())
+    return scanner.count, digest
+
+
+def upload_inputs_cached(
+    cache: RemoteCache,
+    local_path,
+    remote_path: str,
+    index_path: Optional[str] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Tuple[int, List[TransferStats]]:
+    """
+    Like `upload_inputs`, but via the given cache: the file (and its index)
+    is only uploaded if its content isn't cached yet, and the remote paths
+    are linked to the cached copies.
+    """
+    count, digest = scan_inputs(local_path, block_size)
+    keys = [digest] + ([f"{digest}.idx"] if index_path is not None else [])
+    stats = []
+    if not cache.has(*keys):
+
+        def upload(path, index=None):
+            return upload_inputs(
+                cache.sftp, local_path, path, index, block_size
+            )[1]
+
+        stats = cache.store(keys, upload)
+    for key, path in zip(keys, [remote_path, index_path]):
+        cache.link(key, path)
+    return count, stats
+
+
+def get_remote_count_command(path: str) -> str:
+    # unlike `wc -l`, this counts a final line without a trailing newline
+    return f"grep -c '' {quote(path)}"
+
+
+def get_remote_index_command(path: str) -> str:
+    index = get_index_path(path)
+    return f"LC_ALL=C awk '{{ printf \"%0{INDEX_DIGITS}d\\n\", o; o += length($0) + 1 }}' {quote(path)} > {quote(index)}"
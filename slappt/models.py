@@ -1,11 +1,16 @@
+import re
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from enum import Enum
+from itertools import product
 from pathlib import Path
 from pprint import pformat
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-import yaml
+from slappt.transfer import DEFAULT_REMOTE_CACHE_TTL
+
+# `{{ key }}` placeholders for matrix values
+MATRIX_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
 
 
 class Shell(Enum):
@@ -14,9 +19,9 @@ class Shell(Enum):
     SH = "sh"
 
 
-# class Parallelism(Enum):
-#     JOBARRAY = "jobarray"
-#     LAUNCHER = "launcher"
+class Parallelism(Enum):
+    JOBARRAY = "jobarray"
+    LAUNCHER = "launcher"
 
 
 @dataclass
@@ -34,6 +39,20 @@ class EnvironmentVariable:
     value: str
 
 
+@dataclass
+class Upload:
+    # local directory whose files (filtered as by `list_local_files`) are
+    # uploaded to `dest` (relative to the job's working directory)
+    path: str
+    dest: Optional[str] = None
+    include_patterns: Optional[List[str]] = None
+    include_names: Optional[List[str]] = None
+    exclude_patterns: Optional[List[str]] = None
+    exclude_names: Optional[List[str]] = None
+    # how many files to upload at once, each over its own SFTP session
+    workers: int = 8
+
+
 @dataclass
 class SlapptConfig:
     # script attributes
@@ -47,7 +66,12 @@ class SlapptConfig:
     file: Optional[str] = None
     pre: Optional[List[str]] = None
     inputs: Optional[str] = None
-    # parallelism: Parallelism = Parallelism.JOBARRAY
+    input_index: Optional[bool] = None
+    remote_inputs: bool = False
+    parallelism: Parallelism = Parallelism.JOBARRAY
+    chunk_size: int = 1
+    array_throttle: Optional[int] = None
+    max_array_size: Optional[int] = None
     environment: Optional[List[EnvironmentVariable]] = None
     bind_mounts: Optional[List[BindMount]] = None
     no_cache: bool = False
@@ -67,15 +91,167 @@ class SlapptConfig:
     pkey: Optional[str] = None
     allow_stderr: bool = False
     timeout: int = 15
+    upload_block_size: int = 1048576
+    # directory on the cluster to keep uploads in by content hash (if any),
+    # and how long to keep them after their last use, in seconds
+    remote_cache: Optional[str] = None
+    remote_cache_ttl: int = DEFAULT_REMOTE_CACHE_TTL
+    upload: Optional[Upload] = None
+    # directory on the cluster's shared filesystem to pull images into as
+    # `.sif` files (if any), once for every task and job using them
+    sif_cache: Optional[str] = None
+    # whether to stage the image (if a SIF) and inputs on each node's local
+    # storage before tasks start
+    node_local: bool = False
+    # whether to resolve the image's tag to a digest when generating the
+    # script, so every task runs the same image
+    pin_digest: bool = False
 
     def __repr__(self):
         return pformat(deepcopy(self))
 
     @staticmethod
     def from_yaml(path):
-        if not Path(path).is_file():
-            raise ValueError(f"Invalid path to configuration file: {path}")
+        yml = read_yaml(path)
+        if "matrix" in yml:
+            raise ValueError(
+                f"Configuration file {path} defines a matrix, load it with ConfigMatrix.from_yaml"
+            )
+        return SlapptConfig(**yml)
+
+
+def read_yaml(path) -> dict:
+    if not Path(path).is_file():
+        raise ValueError(f"Invalid path to configuration file: {path}")
+
+    import yaml
+
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+def find_placeholders(value) -> List[str]:
+    if isinstance(value, str):
+        return MATRIX_PLACEHOLDER.findall(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [k for v in value for k in find_placeholders(v)]
+    return []
+
+
+def substitute(value, values: Dict[str, Any]):
+    """
+    Replaces `{{ key }}` placeholders in the given (possibly nested) value.
+    A string consisting of a single placeholder takes the value as is, so
+    e.g. `gpus: "{{ gpus }}"` stays an integer.
+    """
+    if isinstance(value, str):
+        match = MATRIX_PLACEHOLDER.fullmatch(value.strip())
+        if match:
+            return values[match.group(1)]
+        return MATRIX_PLACEHOLDER.sub(lambda m: str(values[m.group(1)]), value)
+    if isinstance(value, dict):
+        return {k: substitute(v, values) for k, v in value.items()}
+    if isinstance(value, list):
+        return [substitute(v, values) for v in value]
+    return value
+
+
+@dataclass
+class ConfigMatrix:
+    """
+    A parameter sweep: a config template and a `matrix` of values, expanding
+    lazily into one config per combination (the cartesian product). Matrix
+    keys are substituted for `{{ key }}` placeholders anywhere in the
+    template; keys naming a config field which no placeholder refers to set
+    that field directly. Unless the template's name contains placeholders,
+    each job is named `<name>-<n>`, numbered from 1.
 
-        with open(path, "r") as f:
-            yml = yaml.safe_load(f)
-            return SlapptConfig(**yml)
+        name: sweep
+        image: docker://owner/tool:{{ tag }}
+        entrypoint: python train.py --lr {{ lr }}
+        matrix:
+          tag: ["1.0", "1.1"]
+          lr: [0.1, 0.01]
+          mem: [1GB, 2GB]
+
+    Without a matrix, the template expands into the one config as is, so
+    `{{ ... }}` in e.g. an entrypoint is left alone.
+    """
+
+    template: Dict[str, Any]
+    matrix: Dict[str, List[Any]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.matrix = {
+            k: v if isinstance(v, list) else [v]
+            for k, v in (self.matrix or {}).items()
+        }
+        empty = [k for k, v in self.matrix.items() if not v]
+        if empty:
+            raise ValueError(f"Matrix keys with no values: {empty}")
+        self._direct, self._numbered = [], False
+        if not self.matrix:
+            return
+
+        referenced = set(find_placeholders(self.template))
+        unknown = referenced - set(self.matrix)
+        if unknown:
+            raise ValueError(f"Unknown matrix keys: {sorted(unknown)}")
+
+        names = {f.name for f in fields(SlapptConfig)}
+        invalid = set(self.matrix) - referenced - names
+        if invalid:
+            raise ValueError(
+                f"Matrix keys neither referenced nor config fields: {sorted(invalid)}"
+            )
+        self._direct = [k for k in self.matrix if k not in referenced]
+        self._numbered = not find_placeholders(
+            self.template.get("name", None)
+        )
+
+    @staticmethod
+    def from_yaml(path) -> "ConfigMatrix":
+        yml = read_yaml(path)
+        matrix = yml.pop("matrix", None)
+        return ConfigMatrix(
+            {"name": Path(path).stem, **yml} if matrix else yml, matrix
+        )
+
+    def expand(self, values: Dict[str, Any], index: int) -> SlapptConfig:
+        """
+        Returns the config for the given matrix values (the `index`-th
+        combination, counting from 1).
+        """
+        if not self.matrix:
+            return SlapptConfig(**self.template)
+        attrs = substitute(self.template, values)
+        attrs.update({k: values[k] for k in self._direct})
+        if self._numbered:
+            attrs["name"] = f"{attrs.get('name', None) or 'job'}-{index}"
+        return SlapptConfig(**attrs)
+
+    def __iter__(self) -> Iterator[SlapptConfig]:
+        keys = list(self.matrix)
+        for i, combination in enumerate(product(*self.matrix.values())):
+            yield self.expand(dict(zip(keys, combination)), i + 1)
+
+    def __len__(self) -> int:
+        count = 1
+        for values in self.matrix.values():
+            count *= len(values)
+        return count
+
+
+@dataclass
+class SubmissionResult:
+    name: str
+    job_ids: List[str]
+    host: Optional[str] = None
+    script_path: Optional[str] = None
+    inputs_path: Optional[str] = None
+    index_path: Optional[str] = None
+    input_count: int = 0
+    # seconds spent uploading files and submitting, and in total
+    timings: Dict[str, float] = field(default_factory=dict)
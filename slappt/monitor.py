@@ -0,0 +1,239 @@
+import logging
+import subprocess
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from slappt.slurm import get_category
+
+_logger = logging.getLogger(__name__)
+
+# one allocation per line (no job steps), e.g. `123_4|COMPLETED|0:0`
+SACCT_FORMAT = "JobID,State,ExitCode"
+
+# the state given to jobs sacct doesn't report for `missing_polls` polls
+MISSING_STATE = "MISSING"
+
+
+@dataclass
+class JobState:
+    job_id: str
+    state: str
+    exit_code: str = ""
+
+    @property
+    def category(self) -> Optional[str]:
+        return get_category(self.state)
+
+    @property
+    def complete(self) -> bool:
+        # states slappt doesn't recognize (e.g. from a newer Slurm) are
+        # terminal, and count as failures, rather than waited on forever
+        return self.category != "running"
+
+
+@dataclass
+class Transition:
+    job_id: str
+    previous: Optional[str]
+    state: str
+    exit_code: str = ""
+
+
+def get_sacct_command(job_ids: Iterable[str]) -> str:
+    return f"sacct --allocations --noheader --parsable2 --format={SACCT_FORMAT} --jobs={','.join(job_ids)}"
+
+
+def parse_sacct_output(output: str) -> List[JobState]:
+    """
+    Parses `sacct --parsable2` output into job states. Array tasks are
+    listed individually (e.g. `123_4`), except those still pending, which
+    sacct folds into a single range (e.g. `123_[5-10]`). States carrying a
+    reason (e.g. `CANCELLED by 1000`) are reduced to the state itself.
+    """
+    states = []
+    for line in output.splitlines():
+        fields = line.strip().split("|")
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            continue
+        states.append(
+            JobState(
+                job_id=fields[0],
+                state=fields[1].split()[0],
+                exit_code=fields[2] if len(fields) > 2 else "",
+            )
+        )
+    return states
+
+
+def get_parent_id(job_id: str) -> str:
+    return job_id.split("_")[0].split(".")[0]
+
+
+class JobMonitor:
+    """
+    Tracks the state of any number of Slurm jobs, including every task of
+    array jobs, with a single `sacct` call per polling cycle. The polling
+    interval grows by `backoff` after each cycle in which nothing changed,
+    up to `max_interval`, and drops back to `interval` on any change.
+
+    If a client is given, `sacct` is run over it, otherwise locally. Jobs
+    sacct hasn't reported after `missing_polls` polls (e.g. purged from
+    its database, or never submitted) are given the `MISSING` state, and
+    count as failed.
+    """
+
+    def __init__(
+        self,
+        job_ids: Iterable[str],
+        client=None,
+        interval: float = 5,
+        max_interval: float = 60,
+        backoff: float = 1.5,
+        timeout: Optional[float] = None,
+        missing_polls: int = 10,
+    ):
+        self.job_ids = list(dict.fromkeys(str(i) for i in job_ids))
+        self.client = client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.missing_polls = missing_polls
+        self.states: Dict[str, JobState] = {}
+        self.unseen: Dict[str, int] = {}
+
+    def query(self) -> str:
+        command = get_sacct_command(self.job_ids)
+        if self.client is not None:
+            stdin, stdout, stderr = self.client.exec_command(command)
+            stdin.close()
+            return stdout.read().decode("utf-8", errors="replace")
+        proc = subprocess.run(command.split(), capture_output=True)
+        return proc.stdout.decode("utf-8", errors="replace")
+
+    def poll(self) -> List[Transition]:
+        """
+        Queries the tracked jobs once and returns any state transitions
+        since the last poll. Rows sacct no longer reports (e.g. a pending
+        array range whose tasks have all started) are dropped.
+        """
+        states = {s.job_id: s for s in parse_sacct_output(self.query())}
+        seen = {get_parent_id(i) for i in states} | set(states)
+        for job_id in self.job_ids:
+            if job_id in seen:
+                self.unseen.pop(job_id, None)
+                continue
+            self.unseen[job_id] = self.unseen.get(job_id, 0) + 1
+            if self.unseen[job_id] >= self.missing_polls:
+                states[job_id] = JobState(job_id=job_id, state=MISSING_STATE)
+
+        transitions = []
+        for job_id, state in states.items():
+            previous = self.states.get(job_id, None)
+            if previous is None or previous.state != state.state:
+                if state.category is None:
+                    _logger.warning(
+                        f"Job {job_id} is in unrecognized state {state.state}, treating it as failed"
+                    )
+                transitions.append(
+                    Transition(
+                        job_id=job_id,
+                        previous=previous.state if previous else None,
+                        state=state.state,
+                        exit_code=state.exit_code,
+                    )
+                )
+        self.states = states
+        return transitions
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether every tracked job has been seen and all of its tasks have
+        reached a terminal state.
+        """
+        seen = {get_parent_id(i) for i in self.states} | set(self.states)
+        return all(i in seen for i in self.job_ids) and all(
+            s.complete for s in self.states.values()
+        )
+
+    def watch(self, timeout: Optional[float] = None) -> Iterator[Transition]:
+        """
+        Polls until every tracked job is complete, yielding each state
+        transition as it is observed.
+
+        Args:
+            timeout: How long to poll for, in seconds (by default the
+                monitor's own timeout, if any).
+        Raises:
+            TimeoutError: If the timeout elapses first.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        start = time.monotonic()
+        interval = self.interval
+        while True:
+            transitions = self.poll()
+            yield from transitions
+            if self.complete:
+                return
+
+            interval = (
+                self.interval
+                if transitions
+                else min(interval * self.backoff, self.max_interval)
+            )
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Jobs still incomplete after {timeout}s: {self.pending()}"
+                    )
+                interval = min(interval, remaining)
+            _logger.debug(f"Polling again in {interval:.1f}s")
+            time.sleep(interval)
+
+    def wait(
+        self,
+        callback: Optional[Callable[[Transition], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, JobState]:
+        """
+        Blocks until every tracked job is complete, passing each state
+        transition to the given callback, if any.
+
+        Args:
+            callback: Called with each state transition.
+            timeout: How long to wait, in seconds (see `watch`).
+        Returns:
+            The final state of each job (or array task).
+        Raises:
+            TimeoutError: If the timeout elapses first.
+        """
+        for transition in self.watch(timeout):
+            if callback is not None:
+                callback(transition)
+        return dict(self.states)
+
+    def pending(self) -> List[str]:
+        return [i for i, s in self.states.items() if not s.complete]
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Returns the number of jobs (or array tasks) in each state category.
+        """
+        return dict(
+            Counter(s.category or "unknown" for s in self.states.values())
+        )
+
+    def exit_status(self) -> int:
+        """
+        Returns 0 if every job (or array task) succeeded, otherwise 1.
+        """
+        return (
+            0
+            if self.states
+            and all(s.category == "success" for s in self.states.values())
+            else 1
+        )
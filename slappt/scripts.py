@@ -1,49 +1,221 @@
 import dataclasses
+import hashlib
+import logging
+import re
 from datetime import timedelta
+from itertools import islice
 from math import ceil
 from os import linesep
-from typing import List, Optional, Tuple
+from pathlib import Path
+from shlex import quote
+from typing import Iterable, Iterator, List, Optional, Tuple
 from uuid import uuid4
 
 from slappt import docker
-from slappt.models import BindMount, EnvironmentVariable, Shell, SlapptConfig
+from slappt.inputs import (
+    INDEX_RECORD_SIZE,
+    INDEX_THRESHOLD,
+    count_lines,
+    get_index_path,
+)
+from slappt.models import (
+    BindMount,
+    EnvironmentVariable,
+    Parallelism,
+    Shell,
+    SlapptConfig,
+)
 
 SHEBANG = "#!/bin/bash"
 
+_logger = logging.getLogger(__name__)
+
+# how many streamed configs to validate (and look up images for) at once
+VALIDATION_BATCH_SIZE = 256
+
+# the image tasks run once pulled into the SIF cache
+CACHED_SIF = '"$SLAPPT_SIF"'
+
+
+def quote_path(path: str) -> str:
+    # quoted for the shell, but with a leading `~` still expanded
+    if path == "~" or path.startswith("~/"):
+        return '"$HOME"' + (quote(path[1:]) if path != "~" else "")
+    return quote(path)
+
 
 class ScriptGenerator:
-    def __init__(self, config: SlapptConfig):
-        valid, validation_errors = ScriptGenerator.validate_config(config)
-        if not valid:
-            raise ValueError(f"Invalid config: {validation_errors}")
+    def __init__(
+        self,
+        config: SlapptConfig,
+        validate: bool = True,
+        use_cache: bool = True,
+    ):
+        if validate:
+            valid, validation_errors = ScriptGenerator.validate_config(
+                config, use_cache
+            )
+            if not valid:
+                raise ValueError(f"Invalid config: {validation_errors}")
 
         self.config = config
+        self.use_cache = use_cache
 
     @staticmethod
-    def validate_config(config: SlapptConfig) -> Tuple[bool, List[str]]:
-        errors = []
-
-        # check required attributes
+    def get_missing_fields(config: SlapptConfig) -> List[str]:
         fields = dataclasses.fields(SlapptConfig)
         ftypes = {f.name: f.type for f in fields}
-        missing = [
+        return [
             f
             for f, t in ftypes.items()
             if getattr(config, f) is None and t != Optional[t]
         ]
+
+    @staticmethod
+    def validate_config(
+        config: SlapptConfig, use_cache: bool = True
+    ) -> Tuple[bool, List[str]]:
+        # resolving a digest also caches whether the image exists
+        digest = (
+            docker.resolve_digest(config.image, use_cache=use_cache)
+            if ScriptGenerator.pins_digest(config)
+            else None
+        )
+
+        # check image exists (.sif paths on a remote host can't be checked)
+        exists = docker.check_image(
+            config.image, use_cache=use_cache, local_paths=config.host is None
+        )
+
+        errors = ScriptGenerator.get_errors(config, exists, digest)
+        return len(errors) == 0, errors
+
+    @staticmethod
+    def get_errors(
+        config: SlapptConfig, image_exists: bool, digest: Optional[str] = None
+    ) -> List[str]:
+        """
+        Lists what's wrong with the given config, given whether its image
+        exists and (if it pins one) the digest its image resolved to.
+        """
+        errors = []
+        missing = ScriptGenerator.get_missing_fields(config)
         if len(missing) > 0:
             errors.append(f"Missing required fields: {', '.join(missing)}")
+        if not image_exists:
+            errors.append(f"Image {config.image} not found")
+        elif ScriptGenerator.pins_digest(config) and not digest:
+            errors.append(
+                f"Could not resolve a digest for image {config.image}"
+            )
+        if int(config.upload_block_size) <= 0:
+            # uploads would otherwise never make progress
+            errors.append(
+                f"upload_block_size must be positive, not {config.upload_block_size}"
+            )
+        return errors
+
+    @staticmethod
+    def validate_configs(
+        configs: Iterable[SlapptConfig], use_cache: bool = True, **kwargs
+    ) -> List[Tuple[bool, List[str]]]:
+        """
+        Validates many configs at once. Each distinct image is looked up
+        only once, and lookups run concurrently (extra keyword arguments
+        are passed through to `docker.images_exist`).
+
+        Returns:
+            A `(valid, errors)` tuple for each config, in order.
+        """
+        return [
+            (len(errors) == 0, errors)
+            for _, errors in ScriptGenerator.iter_validated(
+                configs, use_cache, **kwargs
+            )
+        ]
 
-        # check image is on DockerHub
-        image_owner, image_name, image_tag = docker.parse_image_components(
-            config.image
+    @staticmethod
+    def iter_validated(
+        configs: Iterable[SlapptConfig],
+        use_cache: bool = True,
+        batch_size: int = VALIDATION_BATCH_SIZE,
+        **kwargs,
+    ) -> Iterator[Tuple[SlapptConfig, List[str]]]:
+        """
+        Validates a stream of configs (e.g. a `ConfigMatrix`) without
+        holding more than `batch_size` of them at once. The images in each
+        batch are looked up concurrently, and each distinct image only once
+        for the whole stream.
+
+        Returns:
+            A generator of `(config, errors)` pairs, in order.
+        """
+        found, digests = {}, {}
+        configs = iter(configs)
+        while True:
+            batch = list(islice(configs, batch_size))
+            if not batch:
+                return
+
+            # resolve digests first, since that caches whether images exist
+            pinned = {
+                c.image
+                for c in batch
+                if ScriptGenerator.pins_digest(c) and c.image not in digests
+            }
+            if pinned:
+                digests.update(
+                    docker.resolve_digests(
+                        pinned, use_cache=use_cache, **kwargs
+                    )
+                )
+
+            for local in (True, False):
+                images = {
+                    c.image
+                    for c in batch
+                    if (c.host is None) == local
+                    and (c.image, local) not in found
+                }
+                if not images:
+                    continue
+                exists = docker.images_exist(
+                    images, use_cache=use_cache, local_paths=local, **kwargs
+                )
+                found.update({(i, local): exists[i] for i in images})
+
+            for config in batch:
+                yield config, ScriptGenerator.get_errors(
+                    config,
+                    found[(config.image, config.host is None)],
+                    digests.get(config.image, None),
+                )
+
+    @staticmethod
+    def pins_digest(config: SlapptConfig) -> bool:
+        # only registry images have digests to resolve
+        return bool(
+            config.pin_digest
+            and config.image
+            and docker.parse_image_reference(config.image).scheme == "docker"
         )
-        if not docker.image_exists(
-            image_name, owner=image_owner, tag=image_tag
-        ):
-            errors.append(f"Image {config.image} not found on Docker Hub")
 
-        return len(errors) == 0, errors
+    @staticmethod
+    def uses_input_index(config: SlapptConfig) -> bool:
+        """
+        Whether array tasks should find their input via a byte-offset index
+        (see `slappt.inputs`) rather than by reading the inputs file up to
+        their line. Unless the config says otherwise, the index is used if
+        the (local) inputs file has more than `INDEX_THRESHOLD` lines.
+        """
+        if not config.inputs:
+            return False
+        if config.input_index is not None:
+            return config.input_index
+        if config.remote_inputs:
+            return False
+        path = Path(config.inputs)
+        return path.is_file() and count_lines(path) > INDEX_THRESHOLD
 
     @staticmethod
     def get_job_time(config: SlapptConfig):
@@ -94,16 +266,34 @@ class ScriptGenerator:
         return headers
 
     def get_job_command(self) -> List[str]:
-        commands = []
+        if (
+            self.config.inputs
+            and Parallelism(self.config.parallelism) == Parallelism.LAUNCHER
+        ):
+            return self.get_launcher_command()
 
-        if self.config.inputs:
+        commands = self.get_task_id()
+        pull, image = self.get_image_pull()
+        staging, image = self.get_node_staging(image)
+        commands = commands + pull + staging
+        inputs = self.get_inputs_path()
+
+        if self.config.inputs and ScriptGenerator.uses_input_index(
+            self.config
+        ):
+            # seek straight to this task's line via its byte offset
+            commands += self.get_input_seek("$((SLAPPT_TASK_ID - 1))")
             commands.append(
-                f"SLAPPT_INPUT=$(head -n $SLURM_ARRAY_TASK_ID {self.config.inputs} | tail -1)"
+                f"SLAPPT_INPUT=$(tail -c +$((10#$SLAPPT_OFFSET + 1)) {inputs} | head -n 1)"
+            )
+        elif self.config.inputs:
+            commands.append(
+                f"SLAPPT_INPUT=$(head -n $SLAPPT_TASK_ID {inputs} | tail -1)"
             )
 
         commands = commands + ScriptGenerator.get_container_invocation(
             work_dir=self.config.workdir,
-            image=self.config.image,
+            image=image,
             commands=self.config.entrypoint,
             env=self.config.environment,
             bind_mounts=self.config.bind_mounts,
@@ -115,6 +305,290 @@ class ScriptGenerator:
 
         return commands
 
+    def get_task_id(self) -> List[str]:
+        """
+        Arrays too large for the cluster are submitted in parts, each told
+        where it starts via `SLAPPT_TASK_OFFSET`. `SLAPPT_TASK_ID` is the
+        task's (one-based) position across all parts.
+        """
+        if not self.config.inputs:
+            return []
+        return [
+            "SLAPPT_TASK_ID=$(( SLURM_ARRAY_TASK_ID + ${SLAPPT_TASK_OFFSET:-0} ))"
+        ]
+
+    def get_input_seek(self, line: str) -> List[str]:
+        """
+        Reads the byte offset of the given (zero-based) line of the inputs
+        file from its index into `SLAPPT_OFFSET`.
+        """
+        index = get_index_path(self.get_inputs_path())
+        return [
+            f"SLAPPT_OFFSET=$(dd if={index} bs={INDEX_RECORD_SIZE} skip={line} count=1 2>/dev/null)"
+        ]
+
+    def get_image(self) -> str:
+        """
+        Returns the image for tasks to run: as configured or, if the config
+        pins digests, with its tag resolved to the digest it currently
+        points to (once per image, see `docker.resolve_digests`), so every
+        task runs the same image without looking it up again.
+        """
+        image = self.config.image
+        if not ScriptGenerator.pins_digest(self.config):
+            return image
+        digest = docker.resolve_digest(image, use_cache=self.use_cache)
+        if digest is None:
+            raise ValueError(f"Could not resolve a digest for image {image}")
+        return docker.pin_image(image, digest)
+
+    @staticmethod
+    def get_sif_name(image: str) -> Optional[str]:
+        """
+        Returns the file name to pull the given image to in the SIF cache,
+        or None if it is already a `.sif` file. Names are unique to the
+        full reference, so images referenced by digest are pulled again
+        only when the digest changes.
+        """
+        ref = docker.parse_image_reference(image)
+        if ref.scheme == "sif":
+            return None
+        slug = re.sub(
+            r"[^A-Za-z0-9._-]+", "_", f"{ref.repository}_{ref.reference}"
+        )
+        key = hashlib.sha256(str(ref).encode("utf-8")).hexdigest()[:12]
+        return f"{slug}-{key}.sif"
+
+    def get_image_pull(self) -> Tuple[List[str], str]:
+        """
+        With a SIF cache, pulls the image into it unless already there, so
+        only the first of any number of tasks (or jobs) using it contacts the
+        registry and builds the SIF. The rest wait on a lock file, then run
+        the cached SIF. Pulls go to a temporary file, moved into place once
+        complete.
+
+        Registry images are pulled by the digest their tag points to when
+        the script is generated, so the SIF is named after the digest, and
+        pulled again once the tag moves.
+
+        Returns:
+            The commands to run first, and the image for tasks to run.
+        """
+        image = self.get_image()
+        if not self.config.sif_cache or not ScriptGenerator.get_sif_name(
+            image
+        ):
+            return [], image
+
+        ref = docker.parse_image_reference(image)
+        if ref.is_remote and not ref.digest:
+            digest = docker.resolve_digest(image, use_cache=self.use_cache)
+            if digest is not None:
+                image = docker.pin_image(image, digest)
+            else:
+                _logger.warning(
+                    f"Could not resolve a digest for image {image}, caching it by tag (it won't be pulled again if the tag moves)"
+                )
+        name = ScriptGenerator.get_sif_name(image)
+
+        program = "singularity" if self.config.singularity else "apptainer"
+        pull = f"{program} pull"
+        if self.config.no_cache:
+            pull += " --disable-cache"
+        temp = '"$SLAPPT_SIF.${SLURM_JOB_ID:-$$}.tmp"'
+        sif_cache = quote_path(self.config.sif_cache.rstrip("/"))
+        return [
+            f"SLAPPT_SIF={sif_cache}/{quote(name)}",
+            'mkdir -p "$(dirname "$SLAPPT_SIF")"',
+            'if [ ! -s "$SLAPPT_SIF" ]; then',
+            "    (",
+            "        flock -x 9",
+            '        if [ ! -s "$SLAPPT_SIF" ]; then',
+            f'            {pull} {temp} {quote(image)} && mv -f {temp} "$SLAPPT_SIF"',
+            f"            rm -f {temp}",
+            "        fi",
+            '    ) 9>"$SLAPPT_SIF.lock"',
+            "fi",
+            f'[ -s "$SLAPPT_SIF" ] || {{ echo "slappt: failed to pull" {quote(image)} >&2; exit 1; }}',
+        ], CACHED_SIF
+
+    def get_inputs_path(self) -> Optional[str]:
+        # where tasks read their inputs from
+        if self.config.node_local and self.config.inputs:
+            return "$SLAPPT_INPUTS"
+        return self.config.inputs
+
+    def get_node_staging(self, image: str) -> Tuple[List[str], str]:
+        """
+        With node-local staging, copies the job's SIF image (if it has one,
+        either given or pulled into the SIF cache) and its inputs to each
+        node's local storage (`$TMPDIR`, or `/tmp`), so tasks don't all read
+        them from the shared filesystem at once.
+
+        Multi-node jobs broadcast the files to all their nodes with `sbcast`
+        and remove them from every node on exit. Otherwise the first task
+        of an array to start on each node copies them (holding a lock while
+        it does) for all the array's tasks on that node. Tasks count
+        themselves in and out under the same lock, and the last one out
+        removes the directory, lock and count included.
+
+        Returns:
+            The commands to run first, and the image for tasks to run.
+        """
+        if not self.config.node_local:
+            return [], image
+
+        # a registry image not pulled into the SIF cache can't be staged
+        files = []
+        if image == CACHED_SIF:
+            files.append((image, "image.sif"))
+        elif docker.parse_image_reference(image).scheme == "sif":
+            files.append((quote_path(image), "image.sif"))
+        if self.config.inputs:
+            files.append((quote_path(self.config.inputs), "inputs"))
+            if ScriptGenerator.uses_input_index(self.config):
+                files.append(
+                    (
+                        quote_path(str(get_index_path(self.config.inputs))),
+                        "inputs.idx",
+                    )
+                )
+        if not files:
+            return [], image
+
+        if int(self.config.nodes) > 1:
+            nodes = 'srun -N "$SLURM_JOB_NUM_NODES" --ntasks-per-node=1'
+            commands = [
+                "SLAPPT_LOCAL=${TMPDIR:-/tmp}/slappt.$SLURM_JOB_ID",
+                f'{nodes} mkdir -p "$SLAPPT_LOCAL"',
+                f'slappt_cleanup() {{ {nodes} rm -rf "$SLAPPT_LOCAL"; }}',
+                "trap slappt_cleanup EXIT",
+            ] + [
+                f'sbcast -f {source} "$SLAPPT_LOCAL/{name}" || exit 1'
+                for source, name in files
+            ]
+        else:
+            # tasks count themselves in and out of `.users` while holding
+            # `.lock` (both inside the directory), so however they exit, the
+            # last one removes everything. a task may open the lock just as
+            # the last one removes it, so it checks it locked the live file
+            lock = '"$SLAPPT_LOCAL/.lock"'
+            users = '"$SLAPPT_LOCAL/.users"'
+            commands = [
+                "SLAPPT_LOCAL=${TMPDIR:-/tmp}/slappt.${SLURM_ARRAY_JOB_ID:-$SLURM_JOB_ID}",
+                "slappt_cleanup() {",
+                '    [ -n "$SLAPPT_STAGED" ] || return 0',
+                "    SLAPPT_STAGED=",
+                "    flock -x 9",
+                f"    SLAPPT_USERS=$(( $(cat {users} 2>/dev/null || echo 1) - 1 ))",
+                f'    if [ "$SLAPPT_USERS" -gt 0 ]; then echo "$SLAPPT_USERS" > {users}; else rm -rf "$SLAPPT_LOCAL"; fi',
+                "    flock -u 9",
+                "}",
+                "trap slappt_cleanup EXIT",
+                "for SLAPPT_TRY in 1 2 3; do",
+                f'    mkdir -p "$SLAPPT_LOCAL" && exec 9>>{lock} && flock -x 9 || continue',
+                f"    [ {lock} -ef /dev/fd/9 ] && break",
+                "    exec 9>&-",
+                "done",
+                f'[ {lock} -ef /dev/fd/9 ] || {{ echo "slappt: failed to lock $SLAPPT_LOCAL" >&2; exit 1; }}',
+                f"echo $(( $(cat {users} 2>/dev/null || echo 0) + 1 )) > {users}",
+                "SLAPPT_STAGED=1",
+            ]
+            for source, name in files:
+                local = f'"$SLAPPT_LOCAL/{name}"'
+                temp = f'"$SLAPPT_LOCAL/{name}.tmp"'
+                commands.append(
+                    f"[ -s {local} ] || {{ cp {source} {temp} && mv -f {temp} {local}; }} || exit 1"
+                )
+            commands.append("flock -u 9")
+
+        if self.config.inputs:
+            commands.append('SLAPPT_INPUTS="$SLAPPT_LOCAL/inputs"')
+        if files[0][1] == "image.sif":
+            image = '"$SLAPPT_LOCAL/image.sif"'
+        return commands, image
+
+    def get_launcher_command(self) -> List[str]:
+        """
+        Each array task takes a chunk of `chunk_size` inputs and runs up to
+        `cores` of them at once in a single container instance, reporting
+        each input's exit status. The task fails if any of its inputs do.
+        """
+        chunk = max(1, int(self.config.chunk_size))
+        cores = max(1, int(self.config.cores))
+        inputs = self.get_inputs_path()
+        program = "singularity" if self.config.singularity else "apptainer"
+        commands = self.get_task_id() + [
+            f"SLAPPT_CHUNK_START=$(( (SLAPPT_TASK_ID - 1) * {chunk} ))",
+            "SLAPPT_INSTANCE=slappt_${SLURM_JOB_ID}",
+            "SLAPPT_STATUS=$(mktemp)",
+        ]
+
+        # start one instance for the whole chunk, stopping it however we exit
+        pull, image = self.get_image_pull()
+        staging, image = self.get_node_staging(image)
+        commands += pull + staging
+        commands += ScriptGenerator.get_instance_start(
+            image=image,
+            instance="$SLAPPT_INSTANCE",
+            work_dir=self.config.workdir,
+            bind_mounts=self.config.bind_mounts,
+            no_cache=self.config.no_cache,
+            gpus=self.config.gpus,
+            singularity=self.config.singularity,
+        )
+        cleanup = "; slappt_cleanup" if staging else ""
+        commands.append(
+            f'trap \'{program} instance stop "$SLAPPT_INSTANCE" >/dev/null; rm -f "$SLAPPT_STATUS"{cleanup}\' EXIT'
+        )
+
+        # run one input, recording its exit status
+        invocation = ScriptGenerator.get_container_invocation(
+            image="instance://$SLAPPT_INSTANCE",
+            commands=self.config.entrypoint,
+            env=self.config.environment,
+            shell=self.config.shell,
+            singularity=self.config.singularity,
+        )[0]
+        commands += [
+            "slappt_run() {",
+            '    SLAPPT_INPUT="$1"',
+            f"    {invocation}",
+            "    local status=$?",
+            '    printf \'%s\\t%s\\n\' "$status" "$SLAPPT_INPUT" >> "$SLAPPT_STATUS"',
+            "    echo \"slappt: input '$SLAPPT_INPUT' exited with status $status\"",
+            "}",
+        ]
+
+        # stream this task's chunk of inputs, throttled to the core count
+        if ScriptGenerator.uses_input_index(self.config):
+            commands += self.get_input_seek("$SLAPPT_CHUNK_START")
+            source = f"tail -c +$((10#$SLAPPT_OFFSET + 1)) {inputs}"
+        else:
+            source = f"tail -n +$((SLAPPT_CHUNK_START + 1)) {inputs}"
+        commands += [
+            'while IFS= read -r SLAPPT_LINE || [ -n "$SLAPPT_LINE" ]; do',
+            f'    while [ "$(jobs -rp | wc -l)" -ge {cores} ]; do wait -n; done',
+            '    slappt_run "$SLAPPT_LINE" &',
+            f"done < <({source} | head -n {chunk})",
+            "wait",
+            "SLAPPT_FAILED=$(awk -F '\\t' '$1 != 0' \"$SLAPPT_STATUS\" | wc -l)",
+            'echo "slappt: $SLAPPT_FAILED input(s) failed"',
+            '[ "$SLAPPT_FAILED" -eq 0 ]',
+        ]
+
+        return commands
+
+    @staticmethod
+    def get_array_size(config: SlapptConfig, input_count: int) -> int:
+        """
+        Returns how many array tasks are needed to cover the given number of
+        inputs, given the config's parallelism mode.
+        """
+        if Parallelism(config.parallelism) == Parallelism.LAUNCHER:
+            return ceil(input_count / max(1, int(config.chunk_size)))
+        return input_count
+
     def get_job_script(self, verbose=False) -> List[str]:
         headers = self.get_job_headers()
         precmds = self.config.pre if self.config.pre else []
@@ -127,6 +601,29 @@ class ScriptGenerator:
 
         return script
 
+    @staticmethod
+    def get_instance_start(
+        image: str,
+        instance: str,
+        work_dir: str = None,
+        bind_mounts: List[BindMount] = None,
+        no_cache: bool = False,
+        gpus: int = 0,
+        singularity: bool = False,
+    ) -> List[str]:
+        program = "singularity" if singularity else "apptainer"
+        command = f"{program} instance start"
+        if work_dir is not None:
+            command += f" --home {work_dir}"
+        if bind_mounts is not None and len(bind_mounts) > 0:
+            command += " --bind " + ",".join([str(bm) for bm in bind_mounts])
+        if no_cache:
+            command += " --disable-cache"
+        if gpus:
+            command += " --nv"
+        command += f' {image} "{instance}"'
+        return [command]
+
     @staticmethod
     def get_container_invocation(
         image: str,
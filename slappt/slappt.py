@@ -1,20 +1,77 @@
+import sys
+import time
 import uuid
+from collections import Counter
+from contextlib import ExitStack
+from itertools import chain
 from os import linesep
 from os.path import join
 from pathlib import Path
+from shlex import quote
 from subprocess import PIPE, Popen
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from weakref import WeakKeyDictionary
 
 import click
 
-import slappt
+from slappt.cache import get_cache
 from slappt.exceptions import ExitStatusException
-from slappt.models import Shell, SlapptConfig
+from slappt.inputs import (
+    count_lines,
+    get_index_path,
+    get_remote_count_command,
+    get_remote_index_command,
+    upload_inputs,
+    upload_inputs_cached,
+    write_index,
+)
+from slappt.models import (
+    ConfigMatrix,
+    Parallelism,
+    Shell,
+    SlapptConfig,
+    SubmissionResult,
+    Upload,
+)
+from slappt.monitor import JobMonitor, Transition
 from slappt.scripts import ScriptGenerator
-from slappt.ssh import SSH
-from slappt.utils import clean_html
+from slappt.slurm import DEFAULT_MAX_ARRAY_SIZE, parse_max_array_size
+from slappt.transfer import (
+    DEFAULT_REMOTE_CACHE_TTL,
+    RemoteCache,
+    TransferStats,
+    makedirs,
+    upload_cached,
+    upload_file,
+    upload_files,
+    upload_lines,
+)
+from slappt.utils import (
+    clean_html,
+    expand_config_paths,
+    list_local_files,
+    parse_job_id,
+    parse_parsable_job_id,
+    readable_bytes,
+)
+
+# paramiko (via slappt.ssh) is only needed to submit to remote hosts, and is
+# slow to import, so it is imported by the functions that need it
+if TYPE_CHECKING:
+    from slappt.ssh import SSH, SSHPool
 
 
-def get_ssh_client(config: SlapptConfig) -> SSH:
+def get_ssh_client(config: SlapptConfig, pool: "SSHPool" = None) -> "SSH":
+    from slappt.ssh import SSH
+
     if config.password:
         return SSH(
             host=config.host,
@@ -22,6 +79,7 @@ def get_ssh_client(config: SlapptConfig) -> SSH:
             username=config.username,
             password=config.password,
             timeout=config.timeout,
+            pool=pool,
         )
     else:
         return SSH(
@@ -30,6 +88,7 @@ def get_ssh_client(config: SlapptConfig) -> SSH:
             username=config.username,
             pkey=config.pkey,
             timeout=config.timeout,
+            pool=pool,
         )
 
 
@@ -54,126 +113,792 @@ def run_cmd(*args, verbose: bool = False, **kwargs):
     return returncode, stdout, stderr
 
 
-def submit_script(config, script, verbose: bool = False):
-    def read_stream(str, name="stdout"):
-        for line in iter(lambda: str.readline(2048), ""):
-            clean = clean_html(line).strip()
-            if verbose:
-                print(f"Received {name} from '{config.host}': '{clean}'")
-            yield clean
+def get_script_name(config: SlapptConfig) -> str:
+    return Path(config.file).name if config.file else f"{config.name}.sh"
+
+
+# how long to trust a cluster's cached MaxArraySize, in seconds
+MAX_ARRAY_SIZE_TTL = 24 * 60 * 60
+
+
+def get_max_array_size(config: SlapptConfig, client=None) -> int:
+    """
+    Returns the cluster's `MaxArraySize`, unless the config overrides it.
+    The value is read with `scontrol show config` (over the given client,
+    if the cluster is remote) and cached on disk per host.
+    """
+    max_array_size = get_cached_max_array_size(config)
+    if max_array_size is not None:
+        return max_array_size
 
-    # the script's name
-    script_name = (
-        Path(config.file).name if config.file else f"{config.name}.sh"
+    if client is not None:
+        output = read_remote_command(client, "scontrol show config")
+    else:
+        try:
+            _, output, _ = run_cmd("scontrol", "show", "config")
+        except FileNotFoundError:
+            output = ""
+    return cache_max_array_size(config, output)
+
+
+def get_max_array_size_key(config: SlapptConfig) -> str:
+    user = f"{config.username}@" if config.username else ""
+    return f"{user}{config.host or 'localhost'}:{config.port}:MaxArraySize"
+
+
+def get_cached_max_array_size(config: SlapptConfig) -> Optional[int]:
+    """
+    Returns the config's `MaxArraySize` override or the cluster's cached
+    value, or None if `scontrol` must be asked.
+    """
+    if config.max_array_size:
+        return int(config.max_array_size)
+    return get_cache("clusters").get(get_max_array_size_key(config), None)
+
+
+def cache_max_array_size(config: SlapptConfig, output: str) -> int:
+    """
+    Parses and caches the `MaxArraySize` in `scontrol show config`'s output.
+    The default is returned, but not cached, if the output has none (e.g.
+    `scontrol` failed), so the next submission asks again.
+    """
+    max_array_size = parse_max_array_size(output, default=None)
+    if max_array_size is None:
+        return DEFAULT_MAX_ARRAY_SIZE
+    get_cache("clusters").set(
+        get_max_array_size_key(config), max_array_size, ttl=MAX_ARRAY_SIZE_TTL
     )
+    return max_array_size
+
+
+def get_submit_commands(
+    config: SlapptConfig,
+    input_count: int = 0,
+    max_array_size: int = None,
+    parsable: bool = False,
+) -> List[str]:
+    """
+    Composes the `sbatch` command(s) to submit the given job. Arrays too
+    large for the cluster's `MaxArraySize` are split into several
+    submissions, each told its offset into the inputs via the
+    `SLAPPT_TASK_OFFSET` environment variable. The `array_throttle` is
+    divided between the parts so that together they run no more tasks at
+    once than it allows (each part gets at least one, so a throttle smaller
+    than the number of parts is exceeded). With `parsable`, `sbatch` prints
+    just the job ID.
+    """
+    script_path = join(
+        config.workdir if config.workdir else "", get_script_name(config)
+    )
+    sbatch = "sbatch --parsable" if parsable else "sbatch"
+    if not config.inputs:
+        return [f"{sbatch} {script_path}"]
+
+    array_size = ScriptGenerator.get_array_size(config, input_count)
+    limit = (max_array_size or DEFAULT_MAX_ARRAY_SIZE) - 1
+    if array_size <= limit:
+        throttle = get_throttle(config, 1, 0)
+        return [f"{sbatch} --array=1-{array_size}{throttle} {script_path}"]
+    offsets = range(0, array_size, limit)
+    return [
+        f"{sbatch} --array=1-{min(limit, array_size - offset)}{get_throttle(config, len(offsets), i)} --export=ALL,SLAPPT_TASK_OFFSET={offset} {script_path}"
+        for i, offset in enumerate(offsets)
+    ]
 
-    # the job working directory
+
+def get_throttle(config: SlapptConfig, parts: int, part: int) -> str:
+    """
+    Returns the `%N` suffix for the given part of an array split into
+    `parts` submissions, sharing the `array_throttle` between them.
+    """
+    if not config.array_throttle:
+        return ""
+    share, extra = divmod(int(config.array_throttle), parts)
+    return f"%{max(1, share + (1 if part < extra else 0))}"
+
+
+# remote caches by SFTP session, so each session resolves its cache once
+_remote_caches = WeakKeyDictionary()
+
+
+def get_remote_cache(sftp, config: SlapptConfig) -> Optional[RemoteCache]:
+    """
+    Returns the given session's content-addressed cache for the given job's
+    uploads, if the job uses one.
+    """
+    if not config.remote_cache:
+        return None
+    caches = _remote_caches.setdefault(sftp, {})
+    key = (config.remote_cache, config.remote_cache_ttl)
+    if key not in caches:
+        caches[key] = RemoteCache(sftp, *key)
+    return caches[key]
+
+
+def upload_job(
+    sftp, config: SlapptConfig, script, verbose: bool = False
+) -> Tuple[int, List[TransferStats]]:
+    """
+    Uploads the given job's script and inputs file (unless the inputs are
+    already on the cluster) to its working directory.
+
+    Returns:
+        The number of inputs uploaded, and stats for each file uploaded.
+    """
     workdir = config.workdir if config.workdir else ""
+    input_count = 0
+    stats = []
+    cache = get_remote_cache(sftp, config)
 
-    # compose the submission command, determining if we have inputs to map over
-    input_lines = []
-    if config.inputs:
-        input_lines = Path(config.inputs).open("r").readlines()
-        command = (
-            f"sbatch --array=1-{len(input_lines)} {join(workdir, script_name)}"
+    # create working directory
+    try:
+        sftp.mkdir(workdir)
+        if verbose:
+            print(f"Created working directory: {workdir}")
+    except OSError:
+        if verbose:
+            print(f"Working directory already exists: {workdir}")
+
+    # copy inputs file (and its line index, if array tasks will look their
+    # input up by it) if we have one, counting inputs on the way
+    if config.inputs and not config.remote_inputs:
+        remote_path = join(workdir, Path(config.inputs).name)
+        index_path = (
+            get_index_path(remote_path)
+            if ScriptGenerator.uses_input_index(config)
+            else None
         )
+        if cache is not None:
+            input_count, input_stats = upload_inputs_cached(
+                cache,
+                config.inputs,
+                remote_path,
+                index_path,
+                config.upload_block_size,
+            )
+        else:
+            input_count, input_stats = upload_inputs(
+                sftp,
+                config.inputs,
+                remote_path,
+                index_path,
+                config.upload_block_size,
+            )
+        stats += input_stats
+        if verbose:
+            for s in input_stats:
+                print(f"Uploaded inputs file: {s.path} ({s})")
+
+    # copy job script, or write it if provided in text
+    remote_path = join(workdir, get_script_name(config))
+    if cache is not None:
+        data = (
+            Path(config.file).read_bytes()
+            if config.file
+            else "".join(f"{line}\n" for line in script).encode("utf-8")
+        )
+        script_stats = upload_cached(
+            cache, data, remote_path, config.upload_block_size
+        )
+        stats += script_stats
+        if verbose:
+            print(
+                f"Uploaded job script: {remote_path} ({script_stats[0]})"
+                if script_stats
+                else f"Linked cached job script: {remote_path}"
+            )
     else:
-        command = f"sbatch {join(workdir, script_name)}"
+        if config.file:
+            stats.append(
+                upload_file(
+                    sftp, config.file, remote_path, config.upload_block_size
+                )
+            )
+        else:
+            stats.append(
+                upload_lines(
+                    sftp, script, remote_path, config.upload_block_size
+                )
+            )
+        if verbose:
+            print(f"Uploaded job script: {remote_path} ({stats[-1]})")
+
+    return input_count, stats
+
+
+def get_staged_files(
+    config: SlapptConfig,
+) -> Tuple[Upload, str, List[Tuple[str, str]]]:
+    """
+    Selects the files named by the job's `upload` section.
+
+    Returns:
+        The section, the remote directory to upload to, and the local and
+        remote path of each file.
+    """
+    upload = (
+        config.upload
+        if isinstance(config.upload, Upload)
+        else Upload(**config.upload)
+    )
+    files = list_local_files(
+        upload.path,
+        upload.include_patterns,
+        upload.include_names,
+        upload.exclude_patterns,
+        upload.exclude_names,
+    )
+    dest = join(config.workdir or "", upload.dest or "").rstrip("/")
+    return upload, dest, [(f, join(dest, Path(f).name)) for f in files]
+
+
+def upload_staged_files(
+    client, config: SlapptConfig, verbose: bool = False
+) -> List[TransferStats]:
+    """
+    Uploads the files selected by the job's `upload` section (if any) to
+    its working directory, skipping any unchanged since the last upload.
+
+    Returns:
+        Stats for each file uploaded.
+    """
+    if not config.upload:
+        return []
+    upload, dest, files = get_staged_files(config)
+    if dest:
+        with client.open_sftp() as sftp:
+            makedirs(sftp, dest)
+
+    stats = upload_files(
+        client,
+        files,
+        upload.workers,
+        config.upload_block_size,
+        progress=verbose,
+    )
+    if verbose:
+        sent = readable_bytes(sum(s.bytes for s in stats))
+        print(
+            f"Uploaded {len(stats)} of {len(files)} file(s) to {dest or '.'} "
+            f"({sent}, {len(files) - len(stats)} unchanged)"
+        )
+    return stats
+
+
+def read_remote_command(client, command: str) -> str:
+    stdin, stdout, stderr = client.exec_command(command)
+    stdin.close()
+    return stdout.read().decode("utf-8", errors="replace")
+
+
+def parse_input_count(config: SlapptConfig, output: str) -> int:
+    try:
+        return int(output.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        raise ExitStatusException(
+            f"Failed to count inputs in {config.inputs} on {config.host}: {output}"
+        )
+
+
+def check_index_status(config: SlapptConfig, status: int, errors: str):
+    # a missing or partial index would send tasks to the wrong inputs
+    if status != 0:
+        raise ExitStatusException(
+            f"Failed to index inputs in {config.inputs} on {config.host}: {errors}"
+        )
+
+
+def parse_job_ids(output: str) -> List[str]:
+    # the output of `sbatch --parsable`, one job per line
+    return [
+        parse_parsable_job_id(line)
+        for line in output.splitlines()
+        if line.strip()
+    ]
+
+
+def prepare_remote_inputs(
+    client, config: SlapptConfig, verbose: bool = False
+) -> int:
+    """
+    Sizes a job whose inputs file is already on the cluster, building its
+    line index there too if array tasks will need it.
+
+    Returns:
+        The number of inputs.
+    """
+    output = read_remote_command(
+        client, get_remote_count_command(config.inputs)
+    )
+    input_count = parse_input_count(config, output)
+    if verbose:
+        print(f"Found {input_count} input(s) in {config.inputs}")
+
+    if ScriptGenerator.uses_input_index(config):
+        stdin, stdout, stderr = client.exec_command(
+            get_remote_index_command(config.inputs)
+        )
+        stdin.close()
+        check_index_status(
+            config,
+            stdout.channel.recv_exit_status(),
+            stderr.read().decode("utf-8", errors="replace"),
+        )
+        if verbose:
+            print(f"Indexed inputs file: {config.inputs}")
+
+    return input_count
+
+
+def submit_script(
+    config: SlapptConfig,
+    script: Optional[List[str]],
+    verbose: bool = False,
+    pool: "SSHPool" = None,
+) -> SubmissionResult:
+    """
+    Uploads and submits the given (already validated) job script. Kept for
+    existing callers, see `submit`.
+
+    Returns:
+        The job's ID(s), remote paths and timings.
+    """
+    return submit(config, script, validate=False, verbose=verbose, pool=pool)
+
+
+def submit(
+    config: SlapptConfig,
+    script: Optional[List[str]] = None,
+    client=None,
+    validate: bool = True,
+    verbose: bool = False,
+    pool: "SSHPool" = None,
+) -> SubmissionResult:
+    """
+    Generates (unless a script is given), uploads and submits the given
+    job, returning its job ID(s).
+
+    Args:
+        config: The job configuration.
+        script: The job script (generated from the config if not given).
+        client: An open connection to the job's host, reused rather than
+            opening a new one (and left open).
+        validate: Whether to validate the config before generating.
+        verbose: Whether to print progress information.
+        pool: A connection pool to borrow a connection from, if no client
+            is given.
+    Returns:
+        The job's ID(s), remote paths and timings.
+    """
+    start = time.perf_counter()
+    if script is None and not config.file:
+        script = ScriptGenerator(config, validate=validate).get_job_script()
+
+    workdir = config.workdir if config.workdir else ""
+    result = SubmissionResult(
+        name=get_job_name(config),
+        job_ids=[],
+        host=config.host,
+        script_path=join(workdir, get_script_name(config)),
+    )
+    if config.inputs:
+        result.inputs_path = (
+            config.inputs
+            if config.remote_inputs or not config.host
+            else join(workdir, Path(config.inputs).name)
+        )
+        if ScriptGenerator.uses_input_index(config):
+            result.index_path = get_index_path(result.inputs_path)
 
-    # copy files to the remote host
     if config.host:
-        with get_ssh_client(config) as client:
+        with ExitStack() as stack:
+            if client is None:
+                client = stack.enter_context(get_ssh_client(config, pool))
             with client.open_sftp() as sftp:
-                # create working directory
-                try:
-                    sftp.mkdir(workdir)
-                    if verbose:
-                        print(f"Created working directory: {workdir}")
-                except OSError:
-                    if verbose:
-                        print(f"Working directory already exists: {workdir}")
-
-                # copy inputs file if we have one
-                if config.inputs:
-                    remote_path = join(workdir, Path(config.inputs).name)
-                    with sftp.open(remote_path, "w") as remote_file:
-                        for line in input_lines:
-                            remote_file.write(f"{line}\n".encode("utf-8"))
-                        remote_file.seek(0)
-                        if verbose:
-                            print(f"Uploaded inputs file: {remote_path}")
-
-                # copy job script, or write it if provided in text
-                remote_path = join(workdir, script_name)
-                with sftp.open(remote_path, "w") as remote_file:
-                    if config.file:
-                        with Path(config.file).open("r") as local_file:
-                            for line in local_file.readlines():
-                                remote_file.write(f"{line}\n".encode("utf-8"))
-                    else:
-                        for line in script:
-                            remote_file.write(f"{line}\n".encode("utf-8"))
-                    remote_file.seek(0)
-                    if verbose:
-                        print(f"Uploaded job script: {remote_path}")
-
-            if verbose:
-                print(f"Submitting to {config.host}: {config.name}")
+                input_count, _ = upload_job(sftp, config, script, verbose)
+            upload_staged_files(client, config, verbose)
+            if config.inputs and config.remote_inputs:
+                input_count = prepare_remote_inputs(client, config, verbose)
+            result.input_count = input_count
+            max_array_size = (
+                get_max_array_size(config, client) if config.inputs else None
+            )
+            result.timings["upload"] = time.perf_counter() - start
 
-            stdin, stdout, stderr = client.exec_command(command, get_pty=True)
+            command = " && ".join(
+                get_submit_commands(
+                    config, input_count, max_array_size, parsable=True
+                )
+            )
+            stdin, stdout, stderr = client.exec_command(command)
             stdin.close()
 
-            try:
-                stdout = [line for line in read_stream(stdout, "stdout")]
-                stderr = [line for line in read_stream(stderr, "stderr")]
-            except:
-                if stdout.channel.recv_exit_status() != 0:
-                    raise ExitStatusException(
-                        f"Received non-zero exit status from submission command on {config.host}\n{stdout if stdout is not None else ''}{stderr if stderr is not None else ''}"
-                    )
+            # drain both streams together, so neither can stall the other
+            from slappt.ssh import read_channel
+
+            output, errors = "", ""
+            for name, line in read_channel(stdout.channel):
+                if verbose:
+                    clean = clean_html(line).strip()
+                    print(f"Received {name} from '{config.host}': '{clean}'")
+                if name == "stdout":
+                    output += line
                 else:
-                    raise
+                    errors += line
+            status = stdout.channel.recv_exit_status()
     else:
         if not config.file:
-            with open(script_name, "w") as f:
+            if workdir:
+                Path(workdir).mkdir(parents=True, exist_ok=True)
+            with open(result.script_path, "w") as f:
                 f.write(linesep.join(script))
-            if verbose:
-                print(f"Wrote job script: {script_name}")
+        if config.inputs:
+            result.input_count = (
+                write_index(config.inputs)
+                if result.index_path
+                else count_lines(config.inputs)
+            )
+        for pre_cmd in config.pre if config.pre else []:
+            status, output, errors = run_cmd(*pre_cmd.split(), verbose=verbose)
+            if status != 0:
+                raise ExitStatusException(
+                    f"Received non-zero exit status from pre-command: {output + errors}"
+                )
+        max_array_size = get_max_array_size(config) if config.inputs else None
+        result.timings["upload"] = time.perf_counter() - start
 
-        if verbose:
-            print(f"Submitting: {config.name}")
+        output, errors, status = "", "", 0
+        for command in get_submit_commands(
+            config, result.input_count, max_array_size, parsable=True
+        ):
+            status, stdout, stderr = run_cmd(*command.split(), verbose=verbose)
+            output += stdout
+            errors += stderr
+            if status != 0:
+                break
 
-        def expand(cmd):
-            return [c for c in cmd.split(" ") if c != ""]
+    result.job_ids = parse_job_ids(output)
+    result.timings["submit"] = (
+        time.perf_counter() - start - result.timings["upload"]
+    )
+    result.timings["total"] = time.perf_counter() - start
+    if status != 0:
+        raise ExitStatusException(
+            f"Received non-zero exit status from submission command{f' on {config.host}' if config.host else ''} (submitted: {result.job_ids}): {output + errors}"
+        )
+    if verbose:
+        print(f"Submitted {result.name}: {result.job_ids}")
+    return result
 
-        for pre_cmd in config.pre if config.pre else []:
-            returncode, stdout, stderr = run_cmd(
-                *expand(pre_cmd), verbose=verbose
+
+# how many `sbatch` calls to chain into each remote command
+SUBMIT_BATCH_SIZE = 256
+
+# printed before each `sbatch` call in a batch, to attribute its output
+SUBMIT_MARKER = "slappt:submit"
+
+
+def get_job_name(config: SlapptConfig) -> str:
+    return config.name or Path(get_script_name(config)).stem
+
+
+def parse_batch_output(
+    output: str,
+) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    """
+    Parses the combined output of a batch submission command into job IDs
+    and any other output, each keyed by job name.
+    """
+    job_ids, messages, name = {}, {}, None
+    for line in output.splitlines():
+        line = clean_html(line).strip()
+        if line.startswith(SUBMIT_MARKER):
+            name = line[len(SUBMIT_MARKER) :].strip()
+            job_ids[name] = []
+        elif name is not None and line.startswith("Submitted batch job"):
+            job_ids[name].append(parse_job_id(line))
+        elif name is not None and line:
+            messages[name] = f"{messages.get(name, '')}{line}\n"
+    return job_ids, messages
+
+
+def submit_scripts(
+    jobs: Iterable[Tuple[SlapptConfig, List[str]]],
+    verbose: bool = False,
+    pool: "SSHPool" = None,
+) -> Dict[str, List[str]]:
+    """
+    Submits many job scripts at once. Jobs bound for the same remote host
+    share a single SSH connection and SFTP session, and their `sbatch`
+    calls are chained into as few remote commands as possible. Jobs with
+    no host are submitted locally.
+
+    Args:
+        jobs: Pairs of job configuration and generated script.
+        verbose: Whether to print progress information.
+        pool: A connection pool to borrow connections from.
+    Returns:
+        A dictionary mapping each job's name to its Slurm job ID(s). Jobs
+        split across several arrays have more than one.
+    """
+    job_ids = {}
+    errors = {}
+    commands = {}
+    with ExitStack() as stack:
+        clients, sftps = {}, {}
+        for config, script in jobs:
+            name = get_job_name(config)
+            if name in job_ids or any(name in c for c in commands.values()):
+                raise ValueError(f"Duplicate job name: {name}")
+
+            if not config.host:
+                job_ids[name] = submit(
+                    config, script, validate=False, verbose=verbose
+                ).job_ids
+                continue
+
+            # open one connection and SFTP session per remote host
+            key = (config.host, config.port, config.username)
+            if key not in clients:
+                clients[key] = stack.enter_context(
+                    get_ssh_client(config, pool)
+                )
+                sftps[key] = stack.enter_context(clients[key].open_sftp())
+
+            input_count, _ = upload_job(sftps[key], config, script, verbose)
+            upload_staged_files(clients[key], config, verbose)
+            if config.inputs and config.remote_inputs:
+                input_count = prepare_remote_inputs(
+                    clients[key], config, verbose
+                )
+            max_array_size = (
+                get_max_array_size(config, clients[key])
+                if config.inputs
+                else None
+            )
+            commands.setdefault(key, {})[name] = get_submit_commands(
+                config, input_count, max_array_size
             )
 
-            if returncode != 0:
-                raise ExitStatusException(
-                    f"Received non-zero exit status from pre-command: {stdout + stderr}"
+        for key, host_commands in commands.items():
+            names = list(host_commands.keys())
+            for i in range(0, len(names), SUBMIT_BATCH_SIZE):
+                command = "; ".join(
+                    f"echo {SUBMIT_MARKER} {quote(n)}; "
+                    + "; ".join(f"{c} 2>&1" for c in host_commands[n])
+                    for n in names[i : i + SUBMIT_BATCH_SIZE]
                 )
+                if verbose:
+                    print(
+                        f"Submitting {len(names[i : i + SUBMIT_BATCH_SIZE])} job(s) to {key[0]}"
+                    )
+
+                stdin, stdout, stderr = clients[key].exec_command(command)
+                stdin.close()
+                submitted, messages = parse_batch_output(
+                    stdout.read().decode("utf-8", errors="replace")
+                )
+                for n in names[i : i + SUBMIT_BATCH_SIZE]:
+                    ids = submitted.get(n, [])
+                    if len(ids) < len(host_commands[n]):
+                        errors[n] = messages.get(n, "no output")
+                    if ids:
+                        job_ids[n] = ids
+                        if verbose:
+                            print(f"Submitted {n} to {key[0]}: {ids}")
+
+    if errors:
+        raise ExitStatusException(
+            f"Failed to submit {len(errors)} job(s) (submitted: {job_ids})\n"
+            + "\n".join(f"{n}: {e}" for n, e in errors.items())
+        )
 
-        returncode, stdout, stderr = run_cmd(*expand(command), verbose=verbose)
+    return job_ids
 
-        if returncode != 0:
-            raise ExitStatusException(
-                f"Received non-zero exit status from submission command: {stdout + stderr}"
+
+def wait_for_jobs(
+    jobs: Iterable[Tuple[SlapptConfig, List[str]]],
+    verbose: bool = False,
+    pool: "SSHPool" = None,
+    timeout: Optional[float] = None,
+    **kwargs,
+) -> Tuple[int, Dict[str, int]]:
+    """
+    Blocks until the given jobs are all complete. Jobs on the same host are
+    monitored together, with one `sacct` call per polling cycle.
+
+    Args:
+        jobs: Pairs of job configuration and Slurm job ID(s).
+        verbose: Whether to print each state transition.
+        pool: A connection pool to borrow connections from.
+        timeout: How long to wait for all of the jobs, in seconds.
+        kwargs: Passed on to each `JobMonitor`.
+    Returns:
+        An exit status (0 if every job succeeded, otherwise 1) and the
+        number of jobs (or array tasks) in each state category.
+    Raises:
+        TimeoutError: If the timeout elapses first.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def report(transition: Transition):
+        if verbose:
+            print(
+                f"{transition.job_id}: {transition.previous or 'NEW'} -> {transition.state}"
             )
 
+    hosts = {}
+    for config, job_ids in jobs:
+        key = (config.host, config.port, config.username)
+        hosts.setdefault(key, (config, []))[1].extend(job_ids)
+
+    status, summary = 0, Counter()
+    for config, job_ids in hosts.values():
+        with ExitStack() as stack:
+            client = (
+                stack.enter_context(get_ssh_client(config, pool))
+                if config.host
+                else None
+            )
+            monitor = JobMonitor(job_ids, client, **kwargs)
+            monitor.wait(
+                report,
+                (
+                    max(0, deadline - time.monotonic())
+                    if deadline is not None
+                    else None
+                ),
+            )
+        status = max(status, monitor.exit_status())
+        summary.update(monitor.summary())
+    return status, dict(summary)
+
+
+def fetch_job_outputs(
+    configs: Iterable[SlapptConfig],
+    dest=".",
+    verbose: bool = False,
+    pool: "SSHPool" = None,
+    job_ids: Optional[Dict[str, List[str]]] = None,
+) -> Dict[str, List[TransferStats]]:
+    """
+    Fetches the output and error files of the given jobs (see
+    `slappt.fetch.fetch_outputs`). Jobs on the same host share a connection.
+    Jobs run locally already have their outputs in their working directory.
+
+    Args:
+        configs: The jobs' configurations.
+        dest: The local directory to fetch files into.
+        verbose: Whether to print progress information.
+        pool: A connection pool to borrow connections from.
+        job_ids: Slurm job ID(s) by job name. If given, only those runs'
+            files are fetched, otherwise every run's.
+    Returns:
+        Stats for each file fetched, by job name.
+    """
+    from slappt.fetch import fetch_outputs
+
+    fetched = {}
+    with ExitStack() as stack:
+        clients = {}
+        for config in configs:
+            if not config.host:
+                continue
+            key = (config.host, config.port, config.username)
+            if key not in clients:
+                clients[key] = stack.enter_context(
+                    get_ssh_client(config, pool)
+                )
+            name = get_job_name(config)
+            fetched[name] = fetch_outputs(
+                clients[key],
+                name,
+                config.workdir,
+                dest,
+                progress=verbose,
+                job_ids=job_ids.get(name, []) if job_ids is not None else None,
+            )
+            if verbose:
+                print(f"Fetched {len(fetched[name])} new file(s) for {name}")
+    return fetched
+
+
+def follow_job_logs(
+    configs: Iterable[SlapptConfig],
+    follow: bool = False,
+    job_ids: Optional[Dict[str, List[str]]] = None,
+    pool: "SSHPool" = None,
+    **kwargs,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Reads the output and error files of the given jobs (see
+    `slappt.fetch.LogFollower`), yielding each line as `(file name, line)`.
+    Jobs on the same host share a connection and a single SFTP session,
+    however many files they write. Jobs run locally are skipped.
+
+    Args:
+        configs: The jobs' configurations.
+        follow: Whether to keep reading lines as they are written, rather
+            than stopping at the end of each file.
+        job_ids: Slurm job ID(s) by job name. If given, following stops
+            once they are all complete, otherwise it continues until
+            interrupted.
+        pool: A connection pool to borrow connections from.
+        kwargs: Passed on to `slappt.fetch.follow_logs`.
+    """
+    from slappt.fetch import LogFollower, follow_logs
+
+    with ExitStack() as stack:
+        hosts, followers, ids = {}, {}, {}
+        for config in configs:
+            if not config.host:
+                continue
+            key = (config.host, config.port, config.username)
+            if key not in hosts:
+                client = stack.enter_context(get_ssh_client(config, pool))
+                hosts[key] = (client, stack.enter_context(client.open_sftp()))
+            name = get_job_name(config)
+            followers.setdefault((key, config.workdir), []).append(name)
+            ids.setdefault(key, []).extend((job_ids or {}).get(name, []))
+        followers = [
+            stack.enter_context(LogFollower(hosts[key][1], names, workdir))
+            for (key, workdir), names in followers.items()
+        ]
+
+        monitors = [
+            JobMonitor(ids[key], client) for key, (client, _) in hosts.items()
+        ]
+
+        def jobs_complete():
+            for monitor in monitors:
+                monitor.poll()
+            return all(m.complete for m in monitors)
+
+        until = jobs_complete if job_ids is not None else None
+        if not follow:
+            for follower in followers:
+                yield from follower.poll()
+                yield from follower.flush()
+            return
+        yield from follow_logs(followers, until, **kwargs)
+
+
+def print_summary(status: int, summary: Dict[str, int]):
+    counts = ", ".join(f"{n} {c}" for c, n in sorted(summary.items()))
+    click.echo(f"{'Succeeded' if status == 0 else 'Failed'}: {counts}")
+
+
+def print_logs(lines: Iterable[Tuple[str, str]]):
+    try:
+        for name, line in lines:
+            click.echo(f"[{name[len('slappt.'):]}] {line}")
+    except KeyboardInterrupt:
+        pass  # stop following
+
 
 @click.command()
-@click.argument("file", required=False)
-@click.version_option(slappt.__version__)
-@click.option(
-    "--version",
-    "-v",
-    required=False,
-    is_flag=True,
-    help="Show the version and exit.",
-)
+@click.argument("files", required=False, nargs=-1)
+@click.version_option(None, "--version", "-v", package_name="slappt")
 @click.option("--image", required=False)
 @click.option("--partition", required=False)
 @click.option("--entrypoint", required=False)
@@ -186,11 +911,14 @@ def submit_script(config, script, verbose: bool = False):
     type=click.Choice(["bash", "sh"], case_sensitive=False),
 )
 @click.option("--inputs", required=False)
-# @click.option(
-#     "--parallelism",
-#     required=False,
-#     type=click.Choice(["jobarray", "launcher"], case_sensitive=False),
-# )
+@click.option("--input_index", required=False, type=bool, default=None)
+@click.option("--remote_inputs", is_flag=True, default=False)
+@click.option(
+    "--parallelism",
+    required=False,
+    type=click.Choice(["jobarray", "launcher"], case_sensitive=False),
+)
+@click.option("--chunk_size", required=False, type=int, default=1)
 @click.option("--environment", required=False, multiple=True)
 @click.option("--bind_mounts", required=False)
 @click.option("--no_cache", required=False, default=False)
@@ -203,7 +931,13 @@ def submit_script(config, script, verbose: bool = False):
 @click.option("--tasks", required=False, type=int, default=1)
 @click.option("--header_skip", required=False)
 @click.option("--singularity", is_flag=True, default=False)
-@click.option("--submit", is_flag=True, default=False)
+@click.option("--submit", "do_submit", is_flag=True, default=False)
+@click.option("--wait", is_flag=True, default=False)
+@click.option("--wait_timeout", required=False, type=float)
+@click.option("--fetch", is_flag=True, default=False)
+@click.option("--fetch_dir", required=False, type=str, default=".")
+@click.option("--logs", is_flag=True, default=False)
+@click.option("--follow", is_flag=True, default=False)
 @click.option("--host", required=False, type=str)
 @click.option("--port", required=False, type=int, default=22)
 @click.option("--username", required=False, type=str)
@@ -211,9 +945,21 @@ def submit_script(config, script, verbose: bool = False):
 @click.option("--pkey", required=False, type=str, default="~/.ssh/id_rsa")
 @click.option("--allow_stderr", required=False, type=bool, default=False)
 @click.option("--timeout", required=False, type=int, default=15)
+@click.option("--upload_block_size", required=False, type=int, default=1048576)
+@click.option("--remote_cache", required=False, type=str)
+@click.option(
+    "--remote_cache_ttl",
+    required=False,
+    type=int,
+    default=DEFAULT_REMOTE_CACHE_TTL,
+)
+@click.option("--sif_cache", required=False, type=str)
+@click.option("--node_local", is_flag=True, default=False)
+@click.option("--pin_digest", is_flag=True, default=False)
+@click.option("--no_image_cache", is_flag=True, default=False)
 @click.option("--verbose", is_flag=True, default=False)
 def cli(
-    file,
+    files,
     image,
     partition,
     entrypoint,
@@ -222,7 +968,10 @@ def cli(
     name,
     shell,
     inputs,
-    # parallelism,
+    input_index,
+    remote_inputs,
+    parallelism,
+    chunk_size,
     environment,
     bind_mounts,
     no_cache,
@@ -235,7 +984,13 @@ def cli(
     tasks,
     header_skip,
     singularity,
-    submit,
+    do_submit,
+    wait,
+    wait_timeout,
+    fetch,
+    fetch_dir,
+    logs,
+    follow,
     host,
     port,
     username,
@@ -243,14 +998,88 @@ def cli(
     pkey,
     allow_stderr,
     timeout,
+    upload_block_size,
+    remote_cache,
+    remote_cache_ttl,
+    sif_cache,
+    node_local,
+    pin_digest,
+    no_image_cache,
     verbose,
 ):
-    # if version:
-    #     click.echo(slappt.__version__)
-    #     return
+    if wait and not do_submit:
+        raise click.UsageError("--wait requires --submit")
+    if wait_timeout is not None and not wait:
+        raise click.UsageError("--wait_timeout requires --wait")
+    if fetch and do_submit and not wait:
+        # fetching right after submitting would find nothing yet
+        raise click.UsageError(
+            "--fetch with --submit requires --wait (or drop --submit to "
+            "fetch a previous run's outputs)"
+        )
+
+    paths = expand_config_paths(files)
+    sweeps = [ConfigMatrix.from_yaml(path) for path in paths]
+    if (
+        len(paths) > 1
+        or (files and any(Path(f).is_dir() for f in files))
+        or any(s.matrix for s in sweeps)
+    ):
+        # configs are expanded lazily, once to validate and once to submit
+        def configs():
+            return chain.from_iterable(sweeps)
+
+        if fetch and not do_submit:
+            fetch_job_outputs(configs(), fetch_dir, verbose)
+            return
+        if logs and not do_submit:
+            print_logs(follow_job_logs(configs(), follow))
+            return
+
+        invalid = [
+            f"{config.name}: {errors}"
+            for config, errors in ScriptGenerator.iter_validated(
+                configs(), use_cache=not no_image_cache
+            )
+            if errors
+        ]
+        if invalid:
+            raise ValueError(f"Invalid config(s): {invalid}")
+
+        jobs = (
+            (
+                c,
+                ScriptGenerator(
+                    c, validate=False, use_cache=not no_image_cache
+                ).get_job_script(),
+            )
+            for c in configs()
+        )
+        if not do_submit:
+            for i, (_, script) in enumerate(jobs):
+                click.echo((linesep if i else "") + linesep.join(script))
+        else:
+            submitted = submit_scripts(jobs, verbose)
+            for name, job_ids in submitted.items():
+                click.echo(f"{name}: {','.join(job_ids)}")
+            if logs:
+                print_logs(follow_job_logs(configs(), True, submitted))
+            if wait:
+                status, summary = wait_for_jobs(
+                    [(c, submitted[get_job_name(c)]) for c in configs()],
+                    verbose,
+                    timeout=wait_timeout,
+                )
+                print_summary(status, summary)
+                if fetch:
+                    fetch_job_outputs(
+                        configs(), fetch_dir, verbose, job_ids=submitted
+                    )
+                sys.exit(status)
+        return
 
-    if file:
-        config = SlapptConfig.from_yaml(file)
+    if paths:
+        config = next(iter(sweeps[0]))
     else:
         config = SlapptConfig(
             image=image,
@@ -259,11 +1088,16 @@ def cli(
             workdir=workdir,
             email=email,
             name=name if name else str(uuid.uuid4()),
-            shell=Shell(shell),
+            shell=Shell(shell.lower()) if shell else Shell.BASH,
             inputs=inputs,
-            # parallelism=Parallelism[parallelism.lower()]
-            # if parallelism
-            # else Parallelism.JOBARRAY,
+            input_index=input_index,
+            remote_inputs=remote_inputs,
+            parallelism=(
+                Parallelism(parallelism.lower())
+                if parallelism
+                else Parallelism.JOBARRAY
+            ),
+            chunk_size=chunk_size,
             environment=environment,
             bind_mounts=bind_mounts,
             no_cache=no_cache,
@@ -283,12 +1117,45 @@ def cli(
             pkey=pkey,
             allow_stderr=allow_stderr,
             timeout=timeout,
+            upload_block_size=upload_block_size,
+            remote_cache=remote_cache,
+            remote_cache_ttl=remote_cache_ttl,
+            sif_cache=sif_cache,
+            node_local=node_local,
+            pin_digest=pin_digest,
         )
 
-    generator = ScriptGenerator(config)
+    if fetch and not do_submit:
+        fetch_job_outputs([config], fetch_dir, verbose)
+        return
+    if logs and not do_submit:
+        print_logs(follow_job_logs([config], follow))
+        return
+
+    generator = ScriptGenerator(config, use_cache=not no_image_cache)
     script = generator.get_job_script()
 
-    if not submit:
+    if not do_submit:
         click.echo(linesep.join(script))
     else:
-        submit_script(config, script, verbose)
+        result = submit(config, script, validate=False, verbose=verbose)
+        click.echo(f"Submitted: {','.join(result.job_ids)}")
+        if logs:
+            print_logs(
+                follow_job_logs(
+                    [config], True, {get_job_name(config): result.job_ids}
+                )
+            )
+        if wait:
+            status, summary = wait_for_jobs(
+                [(config, result.job_ids)], verbose, timeout=wait_timeout
+            )
+            print_summary(status, summary)
+            if fetch:
+                fetch_job_outputs(
+                    [config],
+                    fetch_dir,
+                    verbose,
+                    job_ids={get_job_name(config): result.job_ids},
+                )
+            sys.exit(status)
@@ -1,53 +1,83 @@
-SLURM_RUNNING_STATES = [
-    "CF",
-    "CONFIGURING",
-    "PD",
-    "PENDING",
-    "R",
-    "RUNNING",
-    "RD",
-    "RESV_DEL_HOLD",
-    "RF",
-    "REQUEUE_FED",
-    "RH",
-    "REQUEUE_HOLD",
-    "RQ",
-    "REQUEUED",
-    "RS",
-    "RESIZING",
-    "SI",
-    "SIGNALING",
-    "SO",
-    "STAGE_OUT",
-    "S",
-    "SUSPENDED",
-    "ST",
-    "STOPPED",
-]
-
-SLURM_SUCCESS_STATES = [
-    "CG",
-    "COMPLETING",
-    "CD",
-    "COMPLETED",
-]
-
-SLURM_CANCELLED_STATES = ["CA", "CANCELLED", "RV", "REVOKED"]
-
-SLURM_TIMEOUT_STATES = ["DL", "DEADLINE", "TO", "TIMEOUT"]
-
-SLURM_FAILURE_STATES = [
-    "BF",
-    "BOOT_FAIL",
-    "F",
-    "FAILED",
-    "NF",
-    "NODE_FAIL",
-    "OOM",
-    "OUT_OF_MEMORY",
-    "PR",
-    "PREEMPTED",
-]
+import re
+from typing import Optional
+
+# Slurm's default MaxArraySize. array task IDs must be below this
+DEFAULT_MAX_ARRAY_SIZE = 1001
+
+SLURM_RUNNING_STATES = frozenset(
+    [
+        "CF",
+        "CONFIGURING",
+        "PD",
+        "PENDING",
+        "R",
+        "RUNNING",
+        "RD",
+        "RESV_DEL_HOLD",
+        "RF",
+        "REQUEUE_FED",
+        "RH",
+        "REQUEUE_HOLD",
+        "RQ",
+        "REQUEUED",
+        "RS",
+        "RESIZING",
+        "SI",
+        "SIGNALING",
+        "SO",
+        "STAGE_OUT",
+        "S",
+        "SUSPENDED",
+        "ST",
+        "STOPPED",
+    ]
+)
+
+SLURM_SUCCESS_STATES = frozenset(
+    [
+        "CG",
+        "COMPLETING",
+        "CD",
+        "COMPLETED",
+    ]
+)
+
+SLURM_CANCELLED_STATES = frozenset(["CA", "CANCELLED", "RV", "REVOKED"])
+
+SLURM_TIMEOUT_STATES = frozenset(["DL", "DEADLINE", "TO", "TIMEOUT"])
+
+SLURM_FAILURE_STATES = frozenset(
+    [
+        "BF",
+        "BOOT_FAIL",
+        "F",
+        "FAILED",
+        "NF",
+        "NODE_FAIL",
+        "OOM",
+        "OUT_OF_MEMORY",
+        "PR",
+        "PREEMPTED",
+    ]
+)
+
+
+# state categories, keyed by both short and long state codes
+SLURM_STATE_CATEGORIES = {
+    **{s: "running" for s in SLURM_RUNNING_STATES},
+    **{s: "success" for s in SLURM_SUCCESS_STATES},
+    **{s: "cancelled" for s in SLURM_CANCELLED_STATES},
+    **{s: "timeout" for s in SLURM_TIMEOUT_STATES},
+    **{s: "failure" for s in SLURM_FAILURE_STATES},
+}
+
+
+def get_category(status) -> Optional[str]:
+    """
+    Returns the category ("running", "success", "cancelled", "timeout" or
+    "failure") of the given state code, or None if it is not recognized.
+    """
+    return SLURM_STATE_CATEGORIES.get(status, None)
 
 
 def is_success(status):
@@ -67,9 +97,16 @@ def is_cancelled(status):
 
 
 def is_complete(status):
-    return (
-        is_success(status)
-        or is_failure(status)
-        or is_timeout(status)
-        or is_cancelled(status)
-    )
+    category = SLURM_STATE_CATEGORIES.get(status, None)
+    return category is not None and category != "running"
+
+
+def parse_max_array_size(
+    config: str, default: Optional[int] = DEFAULT_MAX_ARRAY_SIZE
+) -> Optional[int]:
+    """
+    Reads `MaxArraySize` from the output of `scontrol show config`, or
+    returns the default if it's missing.
+    """
+    match = re.search(r"^\s*MaxArraySize\s*=\s*(\d+)", config, re.MULTILINE)
+    return int(match.group(1)) if match else default
@@ -1,9 +1,15 @@
+import atexit
+import codecs
 import logging
 import os
 import platform
-import re
+import select
+import threading
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from socket import IPPROTO_TCP, TCP_NODELAY
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import paramiko
 from paramiko.ssh_exception import (
@@ -19,9 +25,14 @@ from tenacity import (
     wait_exponential,
 )
 
+from slappt.utils import clean_html
+
 _system = platform.system()
 _logger = logging.getLogger(__name__)
 
+# the most bytes taken from a channel's buffer per read
+CHANNEL_READ_SIZE = 1024 * 1024
+
 
 def default_known_hosts_path():
     if _system == "Windows":
@@ -35,10 +46,25 @@ def default_known_hosts_path():
         return Path.home() / ".ssh" / "known_hosts"
 
 
+def disable_nagle(client: paramiko.SSHClient):
+    """
+    Sends small packets (e.g. command requests) immediately, rather than
+    holding them back until the previous ones are acknowledged, which can
+    otherwise stall each short command by tens of milliseconds.
+    """
+    transport = client.get_transport()
+    sock = transport.sock if transport is not None else None
+    # a channel through a jump host isn't a socket
+    if hasattr(sock, "setsockopt"):
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
 class SSH:
     """
     Wraps a Paramiko client with password or SSH keypair authentication.
     Supports proxy-jump pattern and preserves context manager usability.
+    If a pool is given, the connection is borrowed from (and returned to)
+    the pool instead of being opened and closed by the context manager.
     """
 
     def __init__(
@@ -53,8 +79,10 @@ class SSH:
         known_hosts: str = None,
         require_host_key: bool = False,
         timeout: int = 10,
+        pool: "SSHPool" = None,
     ):
         self.client = None
+        self.jump_client = None
         self.host = host
         self.port = port
         self.username = username
@@ -64,6 +92,8 @@ class SSH:
         self.jump_port = jump_port
         self.require_host_key = require_host_key
         self.timeout = timeout
+        self.pool = pool
+        self.pooled: Optional["_PooledConnection"] = None
         self.logger = logging.getLogger(__name__)
 
         if known_hosts:
@@ -75,7 +105,14 @@ class SSH:
         else:
             self.known_hosts = None
 
-    def __enter__(self):
+    def connect(self) -> Tuple[paramiko.SSHClient, paramiko.SSHClient]:
+        """
+        Opens a new authenticated connection.
+
+        Returns:
+            The connected client, and the jump host client (which must be
+            closed along with it).
+        """
         client = paramiko.SSHClient()
         jump_client = paramiko.SSHClient()
 
@@ -159,17 +196,232 @@ class SSH:
         else:
             raise ValueError(f"No authentication strategy provided")
 
-        self.client = client
+        for connected in (client, jump_client):
+            disable_nagle(connected)
+        return client, jump_client
+
+    def __enter__(self):
+        if self.pool is not None:
+            self.pooled = self.pool.acquire(self)
+            self.client = self.pooled.client
+        else:
+            self.client, self.jump_client = self.connect()
         return self.client
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None:
+            self.pool.release(self.pooled)
+            self.pooled = None
+        else:
+            self.client.close()
+            self.jump_client.close()
+
+
+@dataclass
+class _PooledConnection:
+    client: paramiko.SSHClient
+    jump_client: paramiko.SSHClient
+    users: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+    def close(self):
         self.client.close()
+        self.jump_client.close()
+
+
+class SSHPool:
+    """
+    Keeps authenticated connections open for reuse, keyed by host, port,
+    username and jump host. Connections send keepalives, are health-checked
+    before being handed out, and are closed once idle for `idle_timeout`
+    seconds. A connection may be borrowed by many threads at once, each
+    opening its own channels on the shared transport.
+    """
+
+    def __init__(self, keepalive: int = 30, idle_timeout: int = 300):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._key_locks: Dict[tuple, threading.Lock] = {}
+        self._connections: Dict[tuple, _PooledConnection] = {}
+
+    @staticmethod
+    def key(ssh: SSH) -> tuple:
+        return ssh.host, ssh.port, ssh.username, ssh.jump_host, ssh.jump_port
+
+    @staticmethod
+    def is_healthy(connection: _PooledConnection) -> bool:
+        transport = connection.client.get_transport()
+        if (
+            transport is None
+            or not transport.is_active()
+            or not transport.is_authenticated()
+        ):
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except (EOFError, OSError, SSHException):
+            return False
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                k
+                for k, c in self._connections.items()
+                if c.users == 0 and now - c.last_used > self.idle_timeout
+            ]
+            evicted = [(k, self._connections.pop(k)) for k in idle]
+        for key, connection in evicted:
+            _logger.debug(f"Closing idle connection to '{key[0]}'")
+            connection.close()
+
+    def acquire(self, ssh: SSH) -> _PooledConnection:
+        """
+        Borrows a connection for the given client's host, opening one if
+        there is none (or it has gone stale). Hand the returned connection
+        back with `release`.
+        """
+        self.evict_idle()
+        key = SSHPool.key(ssh)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # connect outside the pool lock, so other hosts aren't held up
+        with key_lock:
+            with self._lock:
+                connection = self._connections.get(key, None)
+            if connection is not None and not SSHPool.is_healthy(connection):
+                _logger.info(f"Replacing stale connection to '{ssh.host}'")
+                with self._lock:
+                    self._connections.pop(key, None)
+                connection.close()
+                connection = None
+            if connection is None:
+                client, jump_client = ssh.connect()
+                client.get_transport().set_keepalive(self.keepalive)
+                connection = _PooledConnection(client, jump_client)
+                with self._lock:
+                    self._connections[key] = connection
+
+            with self._lock:
+                connection.users += 1
+                connection.last_used = time.monotonic()
+            return connection
+
+    def release(self, connection: _PooledConnection):
+        # the connection borrowed, even if it has since been replaced
+        with self._lock:
+            connection.users = max(0, connection.users - 1)
+            connection.last_used = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+
+    def __len__(self):
+        return len(self._connections)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SSHPool:
+    """
+    Returns the process-wide connection pool, which is closed on exit.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SSHPool()
+            atexit.register(_pool.close)
+        return _pool
+
 
+def read_channel(
+    channel: paramiko.Channel, timeout: float = 1
+) -> Iterator[Tuple[str, str]]:
+    """
+    Reads a command's stdout and stderr concurrently, as data arrives on
+    either, so a command writing a lot to one never stalls waiting for the
+    other to be read. Data is taken from the channel in large chunks and
+    split into lines.
+
+    Args:
+        channel: The command's channel.
+        timeout: How long to wait for data before checking again whether
+            the command has finished.
+    Returns:
+        A generator of `("stdout" | "stderr", line)` pairs, in the order
+        received on each stream, with line endings kept.
+    """
+    streams = {
+        "stdout": (channel.recv_ready, channel.recv),
+        "stderr": (channel.recv_stderr_ready, channel.recv_stderr),
+    }
+    decoders = {
+        name: codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for name in streams
+    }
+    # the pieces of each stream's unfinished line, joined once it ends, so
+    # output without newlines (e.g. progress bars) isn't copied per read
+    partial = {name: [] for name in streams}
+    while True:
+        received = False
+        for name, (ready, recv) in streams.items():
+            if not ready():
+                continue
+            data = recv(CHANNEL_READ_SIZE)
+            if not data:
+                continue
+            received = True
+            lines = decoders[name].decode(data).split("\n")
+            rest = lines.pop()
+            if lines:
+                lines[0] = "".join(partial[name]) + lines[0]
+                partial[name].clear()
+            if rest:
+                partial[name].append(rest)
+            for line in lines:
+                yield name, f"{line}\n"
+        if received:
+            continue
+        if channel.eof_received or channel.closed:
+            # nothing left buffered on either stream
+            if not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            continue
+        # woken by data on either stream (or EOF)
+        select.select([channel], [], [], timeout)
+
+    for name in streams:
+        rest = "".join(partial[name]) + decoders[name].decode(b"", final=True)
+        if rest:
+            yield name, rest
+
+
+def read_command_output(
+    ssh: SSH, channel: paramiko.Channel, allow_stderr: bool
+) -> Iterator[str]:
+    errors = []
+    for name, line in read_channel(channel):
+        clean = clean_html(line)
+        if name == "stderr":
+            _logger.warning(f"Received stderr from '{ssh.host}': '{clean}'")
+            errors.append(clean)
+        else:
+            _logger.debug(f"Received stdout from '{ssh.host}': '{clean}'")
+        yield clean
 
-def clean_html(raw_html: str) -> str:
-    expr = re.compile("<.*?>")
-    text = re.sub(expr, "", raw_html)
-    return text
+    if channel.recv_exit_status() != 0:
+        raise Exception(f"Received non-zero exit status from '{ssh.host}'")
+    elif not allow_stderr and len(errors) > 0:
+        raise Exception(f"Received stderr: {errors}")
 
 
 @retry(
@@ -217,21 +469,7 @@ def execute_interactive_command(
         stdin.flush()
     stdin.close()
 
-    for line in iter(lambda: stdout.readline(2048), ""):
-        clean = clean_html(line)
-        _logger.debug(f"Received stdout from '{ssh.host}': '{clean}'")
-        yield clean
-
-    errors = []
-    for line in iter(lambda: stderr.readline(2048), ""):
-        clean = clean_html(line)
-        _logger.warning(f"Received stderr from '{ssh.host}': '{clean}'")
-        yield clean
-
-    if stdout.channel.recv_exit_status() != 0:
-        raise Exception(f"Received non-zero exit status from '{ssh.host}'")
-    elif not allow_stderr and len(errors) > 0:
-        raise Exception(f"Received stderr: {errors}")
+    yield from read_command_output(ssh, stdout.channel, allow_stderr)
 
 
 @retry(
@@ -270,23 +508,10 @@ def execute_command(
         full_command = f"cd {directory} && {full_command}"
 
     _logger.info(f"Executing command on '{ssh.host}': {full_command}")
+    # no pty, which would merge stderr into stdout
     stdin, stdout, stderr = ssh.client.exec_command(
-        f"bash --login -c '{full_command}'", get_pty=True
+        f"bash --login -c '{full_command}'"
     )
     stdin.close()
 
-    for line in iter(lambda: stdout.readline(2048), ""):
-        clean = clean_html(line)
-        _logger.debug(f"Received stdout from '{ssh.host}': '{clean}'")
-        yield clean
-
-    errors = []
-    for line in iter(lambda: stderr.readline(2048), ""):
-        clean = clean_html(line)
-        _logger.warning(f"Received stderr from '{ssh.host}': '{clean}'")
-        yield clean
-
-    if stdout.channel.recv_exit_status() != 0:
-        raise Exception(f"Received non-zero exit status from '{ssh.host}'")
-    elif not allow_stderr and len(errors) > 0:
-        raise Exception(f"Received stderr: {errors}")
+    yield from read_command_output(ssh, stdout.channel, allow_stderr)
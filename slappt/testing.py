@@ -0,0 +1,714 @@
+"""
+A stand-in Slurm cluster for testing and load testing submissions without a
+real one: an in-process SSH server (with SFTP) whose commands run locally in
+a given directory, and `sbatch`, `squeue`, `sacct`, `scancel` and `scontrol`
+shims which keep job state in memory.
+
+    with FakeCluster(tmp_path) as cluster:
+        submit(cluster.config(image="alpine", ...))
+        assert cluster.slurm.jobs
+
+The shims are small bash scripts (bash 4+) which forward their arguments
+over a local socket, so any shell command can call them as usual.
+"""
+
+import logging
+import os
+import re
+import shutil
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import paramiko
+from paramiko import (
+    AUTH_FAILED,
+    AUTH_SUCCESSFUL,
+    OPEN_SUCCEEDED,
+    SFTP_OK,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+from slappt.models import SlapptConfig
+from slappt.slurm import DEFAULT_MAX_ARRAY_SIZE
+
+_logger = logging.getLogger(__name__)
+
+SLURM_COMMANDS = ["sbatch", "squeue", "sacct", "scancel", "scontrol"]
+
+# forwards the command's name, working directory and arguments to the
+# stand-in, then replays its exit status and output
+SHIM = """\
+#!/bin/bash
+exec 3<>/dev/tcp/127.0.0.1/{port} || exit 1
+printf '%s\\n%s\\n%s\\n' "${{0##*/}}" "$PWD" "$#" >&3
+[ $# -gt 0 ] && printf '%s\\0' "$@" >&3
+IFS=' ' read -r status nout nerr <&3
+LC_ALL=C
+if [ "$nout" -gt 0 ]; then IFS= read -r -d '' -N "$nout" out <&3; printf '%s' "$out"; fi
+if [ "$nerr" -gt 0 ]; then IFS= read -r -d '' -N "$nerr" err <&3; printf '%s' "$err" >&2; fi
+exit "$status"
+"""
+
+
+@dataclass
+class FakeJob:
+    job_id: int
+    name: str
+    script: str
+    submitted: float
+    tasks: Optional[List[int]] = None
+    # states set explicitly (e.g. by `scancel`), by task ID (None for the
+    # whole job), overriding the simulated state
+    states: Dict[Optional[int], str] = field(default_factory=dict)
+    # the job IDs of array tasks after the first, as allocated when sacct
+    # first reports them
+    raw_ids: Dict[int, int] = field(default_factory=dict)
+
+
+def parse_array_spec(spec: str) -> List[int]:
+    """
+    Parses a `--array` specification, e.g. `1-10`, `1,3,5`, `0-20:4%2`.
+    """
+    tasks = []
+    for part in spec.split("%")[0].split(","):
+        bounds, _, step = part.partition(":")
+        first, _, last = bounds.partition("-")
+        tasks.extend(range(int(first), int(last or first) + 1, int(step or 1)))
+    return tasks
+
+
+class FakeSlurm:
+    """
+    Keeps jobs in memory and answers Slurm commands about them. Each job
+    is pending for `pending_time` seconds after submission, then running
+    for `run_time` seconds, then in `final_state`, unless its state is set
+    with `set_state` (or it is cancelled). Each command takes `latency`
+    seconds to answer, either overall or per command name.
+    """
+
+    def __init__(
+        self,
+        pending_time: float = 0,
+        run_time: float = 0,
+        final_state: str = "COMPLETED",
+        latency: Union[float, Dict[str, float]] = 0,
+        max_array_size: int = DEFAULT_MAX_ARRAY_SIZE,
+    ):
+        self.pending_time = pending_time
+        self.run_time = run_time
+        self.final_state = final_state
+        self.latency = latency
+        self.max_array_size = max_array_size
+        self.jobs: Dict[int, FakeJob] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def get_state(self, job: FakeJob, task: Optional[int] = None) -> str:
+        state = job.states.get(task, None) or job.states.get(None, None)
+        if state is not None:
+            return state
+        elapsed = time.monotonic() - job.submitted
+        if elapsed < self.pending_time:
+            return "PENDING"
+        if elapsed < self.pending_time + self.run_time:
+            return "RUNNING"
+        return self.final_state
+
+    def get_raw_id(self, job: FakeJob, task: Optional[int] = None) -> int:
+        """
+        Returns the job ID of the given array task (as used for `%j` in
+        its output file names): the array's own for its first task, a new
+        one for each of the others.
+        """
+        if task is None or not job.tasks or task == job.tasks[0]:
+            return job.job_id
+        with self._lock:
+            if task not in job.raw_ids:
+                job.raw_ids[task] = self._next_id
+                self._next_id += 1
+            return job.raw_ids[task]
+
+    def set_state(self, job_id: str, state: str):
+        """
+        Sets the state of the given job, or array task (e.g. `12_3`).
+        """
+        base, _, task = str(job_id).partition("_")
+        with self._lock:
+            job = self.jobs[int(base)]
+            job.states[int(task) if task else None] = state
+
+    def run(
+        self, name: str, cwd: str, args: List[str]
+    ) -> Tuple[int, str, str]:
+        """
+        Runs the given Slurm command. Returns its exit status and output.
+        """
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        latency = (
+            self.latency.get(name, 0)
+            if isinstance(self.latency, dict)
+            else self.latency
+        )
+        if latency:
+            time.sleep(latency)
+        handler = getattr(self, name, None)
+        if name not in SLURM_COMMANDS or handler is None:
+            return 127, "", f"{name}: command not found\n"
+        try:
+            return handler(cwd, args)
+        except (ValueError, IndexError) as e:
+            return 1, "", f"{name}: error: {e}\n"
+
+    def sbatch(self, cwd: str, args: List[str]) -> Tuple[int, str, str]:
+        parsable, spec, name, script = False, None, None, None
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg == "--parsable":
+                parsable = True
+            elif arg.startswith("--array="):
+                spec = arg.split("=", 1)[1]
+            elif arg in ("-a", "--array"):
+                spec = args.pop(0)
+            elif arg.startswith("--job-name="):
+                name = arg.split("=", 1)[1]
+            elif arg in ("-J", "--job-name"):
+                name = args.pop(0)
+            elif not arg.startswith("-"):
+                script = arg
+                break
+
+        path = Path(cwd) / script if script else None
+        if path is None or not path.is_file():
+            return 1, "", f"sbatch: error: Unable to open file {script}\n"
+        if name is None:
+            match = re.search(
+                r"^#SBATCH\s+(?:--job-name=|-J\s*)(\S+)",
+                path.read_text(),
+                re.MULTILINE,
+            )
+            name = match.group(1) if match else path.name
+        tasks = parse_array_spec(spec) if spec else None
+        if tasks and max(tasks) >= self.max_array_size:
+            return (
+                1,
+                "",
+                "sbatch: error: Batch job submission failed: Invalid job array specification\n",
+            )
+
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+            self.jobs[job_id] = FakeJob(
+                job_id, name, str(path), time.monotonic(), tasks
+            )
+        if parsable:
+            return 0, f"{job_id}\n", ""
+        return 0, f"Submitted batch job {job_id}\n", ""
+
+    def _select(
+        self, ids: Optional[str]
+    ) -> List[Tuple[FakeJob, Optional[int]]]:
+        """
+        Returns the (job, task) pairs named by a comma-separated list of
+        job and array task IDs (all jobs if none), expanding array jobs.
+        """
+        with self._lock:
+            jobs = dict(self.jobs)
+        selected = []
+        for id in ids.split(",") if ids else [str(i) for i in jobs]:
+            base, _, task = id.partition("_")
+            job = jobs.get(int(base), None) if base.isdigit() else None
+            if job is None:
+                continue
+            if task:
+                selected.append((job, int(task)))
+            else:
+                selected += [(job, t) for t in job.tasks or [None]]
+        return selected
+
+    @staticmethod
+    def _option(args: List[str], *names) -> Optional[str]:
+        for i, arg in enumerate(args):
+            for name in names:
+                if arg == name and i + 1 < len(args):
+                    return args[i + 1]
+                if name.startswith("--") and arg.startswith(f"{name}="):
+                    return arg.split("=", 1)[1]
+        return None
+
+    def squeue(self, cwd: str, args: List[str]) -> Tuple[int, str, str]:
+        ids = self._option(args, "-j", "--jobs")
+        fmt = self._option(args, "-o", "--format") or "%i %j %T"
+        fields = re.findall(r"%\.?\d*([a-zA-Z])", fmt)
+        lines = []
+        if not ({"-h", "--noheader"} & set(args)):
+            headers = {"i": "JOBID", "j": "NAME", "T": "STATE", "t": "ST"}
+            lines.append(" ".join(headers.get(f, f) for f in fields))
+        for job, task in self._select(ids):
+            state = self.get_state(job, task)
+            if state not in ("PENDING", "RUNNING"):
+                continue
+            values = {
+                "i": (
+                    f"{job.job_id}_{task}"
+                    if task is not None
+                    else str(job.job_id)
+                ),
+                "j": job.name,
+                "T": state,
+                "t": state[:2] if state != "RUNNING" else "R",
+            }
+            lines.append(" ".join(values.get(f, "") for f in fields))
+        return 0, "".join(f"{line}\n" for line in lines), ""
+
+    def sacct(self, cwd: str, args: List[str]) -> Tuple[int, str, str]:
+        ids = self._option(args, "-j", "--jobs")
+        fmt = self._option(args, "-o", "--format") or "JobID,JobName,State"
+        fields = [f.split("%")[0].lower() for f in fmt.split(",")]
+        sep = "|" if {"-P", "--parsable2"} & set(args) else " "
+        lines = []
+        if not ({"-n", "--noheader"} & set(args)):
+            lines.append(sep.join(f.capitalize() for f in fields))
+        for job, task in self._select(ids):
+            state = self.get_state(job, task)
+            values = {
+                "jobid": (
+                    f"{job.job_id}_{task}"
+                    if task is not None
+                    else str(job.job_id)
+                ),
+                "jobidraw": (
+                    str(self.get_raw_id(job, task))
+                    if "jobidraw" in fields
+                    else ""
+                ),
+                "jobname": job.name,
+                "state": state,
+                "exitcode": "0:0" if state == "COMPLETED" else "1:0",
+            }
+            lines.append(sep.join(values.get(f, "") for f in fields))
+        return 0, "".join(f"{line}\n" for line in lines), ""
+
+    def scancel(self, cwd: str, args: List[str]) -> Tuple[int, str, str]:
+        errors = ""
+        for id in [a for a in args if not a.startswith("-")]:
+            if not self._select(id):
+                errors += f"scancel: error: Kill job error on job id {id}: Invalid job id specified\n"
+                continue
+            self.set_state(id, "CANCELLED")
+        return (1 if errors else 0), "", errors
+
+    def scontrol(self, cwd: str, args: List[str]) -> Tuple[int, str, str]:
+        if args[:2] == ["show", "config"]:
+            return 0, f"MaxArraySize            = {self.max_array_size}\n", ""
+        if args[:2] == ["show", "job"]:
+            lines = [
+                f"JobId={job.job_id} JobName={job.name} JobState={self.get_state(job, task)}"
+                for job, task in self._select(
+                    args[2] if len(args) > 2 else None
+                )
+            ]
+            return 0, "".join(f"{line}\n" for line in lines), ""
+        return 1, "", f"scontrol: error: Invalid command: {' '.join(args)}\n"
+
+
+class _ShimHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        name = self.rfile.readline().decode().strip()
+        cwd = self.rfile.readline().decode().strip()
+        count = int(self.rfile.readline().decode().strip() or 0)
+        args = []
+        for _ in range(count):
+            arg = b""
+            while not arg.endswith(b"\0"):
+                byte = self.rfile.read(1)
+                if not byte:
+                    break
+                arg += byte
+            args.append(arg.rstrip(b"\0").decode())
+        status, out, err = self.server.slurm.run(name, cwd, args)
+        out, err = out.encode(), err.encode()
+        header = f"{status} {len(out)} {len(err)}\n".encode()
+        self.wfile.write(header + out + err)
+
+
+class _ShimServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, slurm: FakeSlurm):
+        super().__init__(("127.0.0.1", 0), _ShimHandler)
+        self.slurm = slurm
+
+
+class _SFTPHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _SFTPInterface(SFTPServerInterface):
+    """
+    Serves the local filesystem, resolving relative paths against the
+    cluster's root (its home directory).
+    """
+
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = str(root)
+
+    def _path(self, path) -> str:
+        return os.path.join(self.root, path)
+
+    def canonicalize(self, path):
+        return os.path.normpath(self._path(path))
+
+    def list_folder(self, path):
+        path = self._path(path)
+        try:
+            entries = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(path, name))
+                )
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self._path(path)
+        try:
+            mode = getattr(attr, "st_mode", None) or 0o666
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if (flags & os.O_CREAT) and attr is not None:
+            attr._flags &= ~attr.FLAG_PERMISSIONS
+            SFTPServer.set_file_attr(path, attr)
+        if flags & os.O_WRONLY:
+            fmode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fmode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fmode = "rb"
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, fmode)
+        return handle
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        return self._call(os.remove, self._path(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self._path(oldpath), self._path(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._path(oldpath), self._path(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._path(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._path(path))
+
+    def chattr(self, path, attr):
+        return self._call(SFTPServer.set_file_attr, self._path(path), attr)
+
+    def symlink(self, target_path, path):
+        return self._call(os.symlink, target_path, self._path(path))
+
+    def readlink(self, path):
+        try:
+            return os.readlink(self._path(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, cluster: "FakeCluster"):
+        self.cluster = cluster
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        if (
+            username == self.cluster.username
+            and password == self.cluster.password
+        ):
+            return AUTH_SUCCESSFUL
+        return AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        keys = self.cluster.authorized_keys
+        if username == self.cluster.username and (
+            keys is None or any(k == key for k in keys)
+        ):
+            return AUTH_SUCCESSFUL
+        return AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self.cluster.execute,
+            args=(channel, command.decode()),
+            daemon=True,
+        ).start()
+        return True
+
+
+class FakeCluster:
+    """
+    Serves SSH and SFTP on localhost, running commands with bash in `root`
+    with the Slurm shims on the path. Accepts the given username with the
+    given password, or any of the given public keys (any key at all if
+    none are given). The shims are kept in `shim_dir` (put it on the path
+    to run local submissions against the same jobs), and `connections`
+    counts the connections accepted.
+    """
+
+    def __init__(
+        self,
+        root,
+        slurm: Optional[FakeSlurm] = None,
+        username: str = "slappt",
+        password: str = "slappt",
+        authorized_keys: Optional[List[paramiko.PKey]] = None,
+    ):
+        self.root = Path(root)
+        self.slurm = slurm if slurm is not None else FakeSlurm()
+        self.username = username
+        self.password = password
+        self.authorized_keys = authorized_keys
+        self.host = "127.0.0.1"
+        self.port = None
+        self.host_key = paramiko.ECDSAKey.generate()
+        self.commands: List[str] = []
+        self.connections = 0
+        self.shim_dir = None
+        self._socket = None
+        self._shim_server = None
+        self._transports: List[paramiko.Transport] = []
+        self._closed = threading.Event()
+
+    def start(self) -> "FakeCluster":
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._shim_server = _ShimServer(self.slurm)
+        threading.Thread(
+            target=self._shim_server.serve_forever, daemon=True
+        ).start()
+
+        self.shim_dir = tempfile.mkdtemp(prefix="slappt-shims-")
+        shim = SHIM.format(port=self._shim_server.server_address[1])
+        for name in SLURM_COMMANDS:
+            path = Path(self.shim_dir) / name
+            path.write_text(shim)
+            path.chmod(0o755)
+        # login shells (e.g. `bash --login -c`) may reset the path
+        (self.root / ".bash_profile").write_text(
+            f'export PATH="{self.shim_dir}:$PATH"\n'
+        )
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                sock, _ = self._socket.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", SFTPServer, _SFTPInterface, self.root
+            )
+            # forget connections since closed, so load tests opening many
+            # don't hold on to them all
+            self._transports = [t for t in self._transports if t.is_active()]
+            self._transports.append(transport)
+            self.connections += 1
+            try:
+                transport.start_server(
+                    event=threading.Event(), server=_Server(self)
+                )
+            except paramiko.SSHException:
+                _logger.debug("Failed to start SSH session", exc_info=True)
+
+    def execute(self, channel: paramiko.Channel, command: str):
+        self.commands.append(command)
+        env = {
+            **os.environ,
+            "HOME": str(self.root),
+            "PATH": f"{self.shim_dir}:{os.environ.get('PATH', '')}",
+        }
+        proc = subprocess.Popen(
+            ["bash", "-c", command],
+            cwd=self.root,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        # the client may hang up at any point, so keep draining the
+        # command's output (so it can finish) and ignore failed sends
+        errors = (OSError, EOFError, paramiko.SSHException)
+
+        def pump(source, send):
+            for chunk in iter(lambda: source.read1(32768), b""):
+                try:
+                    send(chunk)
+                except errors:
+                    pass
+
+        def feed():
+            try:
+                for chunk in iter(lambda: channel.recv(32768), b""):
+                    proc.stdin.write(chunk)
+                    proc.stdin.flush()
+            except errors:
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass  # the command exited without reading it all
+
+        threads = [
+            threading.Thread(target=feed, daemon=True),
+            threading.Thread(target=pump, args=(proc.stdout, channel.sendall)),
+            threading.Thread(
+                target=pump, args=(proc.stderr, channel.sendall_stderr)
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        status = proc.wait()
+        try:
+            channel.send_exit_status(status)
+            channel.close()
+        except errors:
+            pass
+
+    def stop(self):
+        self._closed.set()
+        if self._socket is not None:
+            self._socket.close()
+        for transport in list(self._transports):
+            transport.close()
+        if self._shim_server is not None:
+            self._shim_server.shutdown()
+            self._shim_server.server_close()
+        if self.shim_dir is not None:
+            shutil.rmtree(self.shim_dir, ignore_errors=True)
+
+    def write_known_hosts(self, path) -> str:
+        """
+        Writes a known hosts file trusting this cluster's host key.
+        """
+        host = f"[{self.host}]:{self.port}"
+        Path(path).write_text(
+            f"{host} {self.host_key.get_name()} {self.host_key.get_base64()}\n"
+        )
+        return str(path)
+
+    def connect(self) -> paramiko.SSHClient:
+        """
+        Returns a client connected to this cluster with password
+        authentication, trusting its host key.
+        """
+        client = paramiko.SSHClient()
+        client.get_host_keys().add(
+            f"[{self.host}]:{self.port}",
+            self.host_key.get_name(),
+            self.host_key,
+        )
+        client.connect(
+            self.host,
+            self.port,
+            username=self.username,
+            password=self.password,
+            look_for_keys=False,
+            allow_agent=False,
+        )
+        return client
+
+    def config(self, **kwargs) -> SlapptConfig:
+        """
+        Returns a config for submitting to this cluster with password
+        authentication, with any other given fields.
+        """
+        return SlapptConfig(
+            **{
+                "host": self.host,
+                "port": self.port,
+                "username": self.username,
+                "password": self.password,
+                **kwargs,
+            }
+        )
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
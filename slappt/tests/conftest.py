@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from slappt.testing import FakeCluster, FakeSlurm
+
+STUB_IMAGES = {"library/alpine": ["latest"], "owner/tool": ["1.0"]}
+STUB_TOKEN = "stub-token"
+
+
+def stub_digest(repo: str, tag: str) -> str:
+    return f"sha256:{hashlib.sha256(f'{repo}:{tag}'.encode()).hexdigest()}"
+
+
+@pytest.fixture
+def stub_registry():
+    """
+    Serves the OCI distribution manifest endpoint for `STUB_IMAGES` on
+    localhost, demanding an anonymous bearer token like Docker Hub does.
+    Yields the registry host and a list of the requests received.
+    """
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_GET(self):
+            requested.append((self.command, self.path))
+            if self.headers.get("Authorization", "").startswith("Basic"):
+                # credentials the stub doesn't know
+                self.respond(403, b"{}")
+                return
+            body = json.dumps({"token": STUB_TOKEN, "expires_in": 300})
+            self.respond(200, body.encode())
+
+        def do_HEAD(self):
+            requested.append((self.command, self.path))
+            if self.headers.get("Authorization") != f"Bearer {STUB_TOKEN}":
+                realm = f"http://{self.headers['Host']}/token"
+                challenge = f'Bearer realm="{realm}",service="stub"'
+                self.respond(401, headers={"WWW-Authenticate": challenge})
+                return
+            repo, _, tag = self.path[len("/v2/") :].partition("/manifests/")
+            if tag in STUB_IMAGES.get(repo, []):
+                digest = stub_digest(repo, tag)
+                self.respond(200, headers={"Docker-Content-Digest": digest})
+            else:
+                self.respond(404)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_port}", requested
+    server.shutdown()
+
+
+@pytest.fixture
+def slurm_cluster(tmp_path, monkeypatch):
+    """
+    Serves a stand-in cluster over SSH and SFTP on localhost, with its home
+    directory at `tmp_path / "cluster"` and Slurm jobs kept in memory (see
+    `slappt.testing`). The cluster's host key is trusted via a known hosts
+    file in a temporary home directory.
+    """
+    home = tmp_path / "home"
+    (home / ".ssh").mkdir(parents=True)
+    monkeypatch.setenv("HOME", str(home))
+    with FakeCluster(tmp_path / "cluster", FakeSlurm()) as cluster:
+        cluster.write_known_hosts(home / ".ssh" / "known_hosts")
+        yield cluster
@@ -0,0 +1,275 @@
+import asyncio
+import subprocess
+from os import environ
+
+import pytest
+
+from slappt import aio
+from slappt.exceptions import ExitStatusException
+from slappt.models import SlapptConfig
+
+FAKE_SBATCH = """\
+#!/bin/bash
+# concurrent submissions take turns numbering their jobs
+exec 9>> "$(dirname "$0")/submitted"
+flock 9
+echo "$*" >> "$(dirname "$0")/submitted"
+wc -l < "$(dirname "$0")/submitted"
+"""
+
+
+@pytest.fixture
+def fake_sbatch(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sbatch").write_text(FAKE_SBATCH)
+    (bin_dir / "sbatch").chmod(0o755)
+    (tmp_path / "image.sif").touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}:{environ['PATH']}")
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    return bin_dir
+
+
+def make_config(name, **kwargs):
+    return SlapptConfig(
+        name=name,
+        image="image.sif",
+        partition="batch",
+        entrypoint="echo hello",
+        workdir="work",
+        **kwargs,
+    )
+
+
+def test_submit_many_local(fake_sbatch, tmp_path):
+    configs = [make_config(f"job{i}") for i in range(5)]
+    job_ids = asyncio.run(aio.submit_many(configs, concurrency=2))
+
+    assert sorted(job_ids) == [f"job{i}" for i in range(5)]
+    assert sorted(i for ids in job_ids.values() for i in ids) == list("12345")
+    script = (tmp_path / "work" / "job0.sh").read_bytes()
+    assert script.startswith(b"#!/bin/")
+    assert script.endswith(b"\n") and b"\r" not in script
+
+
+def test_submit_many_reports_failures(fake_sbatch, tmp_path):
+    (fake_sbatch / "sbatch").write_text("#!/bin/bash\nexit 1\n")
+    with pytest.raises(ExitStatusException, match="Failed to submit 2"):
+        asyncio.run(aio.submit_many([make_config("a"), make_config("b")]))
+
+
+def test_submit_invalid_config(fake_sbatch):
+    config = make_config("job")
+    config.image = "missing.sif"
+    with pytest.raises(ValueError, match="missing.sif not found"):
+        asyncio.run(aio.submit(config))
+
+
+def test_submit_remote_cache_unsupported(fake_sbatch):
+    # rejected before connecting, rather than uploading without the cache
+    config = make_config("job", host="cluster", remote_cache=".slappt/cache")
+    with pytest.raises(ValueError, match="remote_cache is not supported"):
+        asyncio.run(aio.submit_many([config], validate=False))
+    with pytest.raises(ValueError, match="remote_cache is not supported"):
+        asyncio.run(aio.submit(config, validate=False))
+
+
+def test_submit_many_cancellation(fake_sbatch):
+    (fake_sbatch / "sbatch").write_text("#!/bin/bash\nsleep 10\n")
+
+    async def main():
+        task = asyncio.ensure_future(
+            aio.submit_many([make_config(f"job{i}") for i in range(3)])
+        )
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main())
+
+
+@pytest.fixture
+def ssh_server(tmp_path, fake_sbatch):
+    """
+    Runs an SSH server on localhost which executes commands with bash in
+    `tmp_path` and serves SFTP from there, and writes a `known_hosts` file
+    trusting it there. Yields the event loop and the server's port.
+    """
+    asyncssh = pytest.importorskip("asyncssh")
+    key = asyncssh.generate_private_key("ssh-ed25519")
+
+    class Server(asyncssh.SSHServer):
+        def begin_auth(self, username):
+            return True
+
+        def password_auth_supported(self):
+            return True
+
+        def validate_password(self, username, password):
+            return password == "secret"
+
+    async def handle(process):
+        proc = await asyncio.create_subprocess_exec(
+            "bash",
+            "-c",
+            process.command,
+            cwd=tmp_path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        process.stdout.write(stdout.decode())
+        process.stderr.write(stderr.decode())
+        process.exit(proc.returncode)
+
+    def run(coro):
+        return loop.run_until_complete(coro)
+
+    loop = asyncio.new_event_loop()
+    server = run(
+        asyncssh.create_server(
+            Server,
+            "127.0.0.1",
+            0,
+            server_host_keys=[key],
+            process_factory=handle,
+            sftp_factory=lambda chan: asyncssh.SFTPServer(
+                chan, chroot=str(tmp_path).encode()
+            ),
+        )
+    )
+    port = server.sockets[0].getsockname()[1]
+    public_key = key.export_public_key().decode().strip()
+    (tmp_path / "known_hosts").write_text(f"[127.0.0.1]:{port} {public_key}\n")
+    yield loop, port
+    server.close()
+    run(server.wait_closed())
+    loop.close()
+
+
+def test_submit_many_remote(ssh_server, fake_sbatch, tmp_path):
+    loop, port = ssh_server
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("a\nb\nc")
+    configs = [
+        make_config(
+            f"job{i}",
+            host="127.0.0.1",
+            port=port,
+            username="user",
+            password="secret",
+            inputs=str(inputs) if i == 0 else None,
+            max_array_size=1001,
+        )
+        for i in range(3)
+    ]
+
+    job_ids = loop.run_until_complete(aio.submit_many(configs))
+    assert sorted(i for ids in job_ids.values() for i in ids) == list("123")
+    assert (tmp_path / "work" / "inputs.txt").read_text() == "a\nb\nc"
+    submitted = (fake_sbatch / "submitted").read_text().splitlines()
+    assert "--parsable --array=1-3 work/job0.sh" in submitted
+
+
+def test_submit_remote_with_upload(ssh_server, fake_sbatch, tmp_path):
+    loop, port = ssh_server
+    data = tmp_path / "data"
+    data.mkdir()
+    for name in ("a.jpg", "b.jpg", "skip.txt"):
+        (data / name).write_text(name)
+    config = make_config(
+        "job",
+        host="127.0.0.1",
+        port=port,
+        username="user",
+        password="secret",
+        # as loaded from YAML
+        upload={
+            "path": str(data),
+            "dest": "images",
+            "exclude_names": ["skip.txt"],
+        },
+    )
+    pool = aio.HostPool(str(tmp_path / "known_hosts"))
+
+    async def submit():
+        async with pool:
+            host = await pool.get(config)
+            await aio.submit_job(config, host)
+            return await aio.upload_staged_files(config, host)
+
+    # the second upload finds every file unchanged
+    assert loop.run_until_complete(submit()) == []
+    staged = tmp_path / "work" / "images"
+    assert sorted(p.name for p in staged.iterdir()) == ["a.jpg", "b.jpg"]
+    assert (staged / "b.jpg").read_text() == "b.jpg"
+    mtimes = [
+        int(p.stat().st_mtime) for p in (staged / "a.jpg", data / "a.jpg")
+    ]
+    assert mtimes[0] == mtimes[1]
+
+
+def test_ssh_host_keys(ssh_server, tmp_path):
+    import asyncssh
+
+    loop, port = ssh_server
+    config = make_config(
+        "job", host="127.0.0.1", port=port, username="user", password="secret"
+    )
+    known_hosts = str(tmp_path / "known_hosts")
+    other = tmp_path / "other_hosts"
+    other_key = asyncssh.generate_private_key("ssh-ed25519")
+    other.write_text(
+        f"[127.0.0.1]:{port} {other_key.export_public_key().decode()}"
+    )
+    empty = tmp_path / "empty_hosts"
+    empty.touch()
+
+    def connect(*args):
+        host = loop.run_until_complete(aio.SSHHost.connect(config, *args))
+        loop.run_until_complete(host.close())
+
+    connect(known_hosts, True)
+    connect(str(empty), False)
+
+    # unknown hosts are refused if host keys are required
+    with pytest.raises(asyncssh.HostKeyNotVerifiable):
+        connect(str(empty), True)
+
+    # changed keys are always refused
+    with pytest.raises(asyncssh.HostKeyNotVerifiable):
+        connect(str(other), False)
+
+    with pytest.raises(FileNotFoundError):
+        connect(str(tmp_path / "missing"), False)
+
+
+def test_prepare_remote_inputs_index_failure(ssh_server, tmp_path):
+    loop, port = ssh_server
+    (tmp_path / "work").mkdir()
+    (tmp_path / "work" / "inputs.txt").write_text("a\nb\nc")
+    (tmp_path / "work" / "inputs.txt.idx").mkdir()  # can't be written
+    config = make_config(
+        "job",
+        host="127.0.0.1",
+        port=port,
+        username="user",
+        password="secret",
+        inputs="work/inputs.txt",
+        remote_inputs=True,
+        input_index=True,
+    )
+
+    async def prepare():
+        host = await aio.SSHHost.connect(config, str(tmp_path / "known_hosts"))
+        try:
+            return await aio.prepare_inputs(config, host)
+        finally:
+            await host.close()
+
+    with pytest.raises(ExitStatusException, match="Failed to index"):
+        loop.run_until_complete(prepare())
+    (tmp_path / "work" / "inputs.txt.idx").rmdir()
+    assert loop.run_until_complete(prepare()) == 3
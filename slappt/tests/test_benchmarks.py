@@ -0,0 +1,211 @@
+"""
+Benchmarks for the hot paths of generating and submitting jobs. They run
+once each as ordinary tests; see DEVELOPER.md for timing them properly and
+comparing against a saved baseline.
+"""
+
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from os import environ
+
+import pytest
+
+from slappt import docker
+from slappt.models import Parallelism, Shell, SlapptConfig
+from slappt.scripts import ScriptGenerator
+from slappt.slappt import submit, submit_scripts
+from slappt.ssh import SSHPool
+
+# submissions per round of the load test (raise to e.g. 5000 locally)
+LOAD_SUBMISSIONS = int(environ.get("SLAPPT_BENCH_SUBMISSIONS", "100"))
+
+CONFIG_YAML = """\
+image: docker://alpine
+shell: sh
+partition: batch
+entrypoint: echo "hello world"
+workdir: /scratch/slappt
+email: someone@example.com
+name: bench
+environment:
+  - key: GREETING
+    value: hello
+bind_mounts:
+  - host_path: /scratch
+    container_path: /scratch
+"""
+
+
+@pytest.fixture
+def config(tmp_path):
+    (tmp_path / "image.sif").touch()
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("".join(f"input{i}.txt\n" for i in range(100)))
+    return SlapptConfig(
+        image=str(tmp_path / "image.sif"),
+        partition="batch",
+        entrypoint="echo $SLAPPT_INPUT",
+        workdir="work",
+        email="someone@example.com",
+        name="bench",
+        inputs=str(inputs),
+        max_array_size=1001,
+    )
+
+
+@pytest.mark.benchmark(group="generate")
+def test_bench_config_from_yaml(benchmark, tmp_path):
+    path = tmp_path / "job.yaml"
+    path.write_text(CONFIG_YAML)
+    config = benchmark(SlapptConfig.from_yaml, path)
+    assert config.name == "bench"
+
+
+@pytest.mark.benchmark(group="generate")
+@pytest.mark.parametrize("parallelism", list(Parallelism))
+def test_bench_get_job_script(benchmark, config, parallelism):
+    config.parallelism = parallelism
+    generator = ScriptGenerator(config, validate=False)
+    script = benchmark(generator.get_job_script)
+    assert script[0] == "#!/bin/bash"
+
+
+@pytest.mark.benchmark(group="startup")
+def test_bench_generate_startup(benchmark, tmp_path):
+    # a cold `slappt job.yaml`, from interpreter start to printed script
+    (tmp_path / "image.sif").touch()
+    (tmp_path / "job.yaml").write_text(
+        "image: image.sif\npartition: batch\nentrypoint: echo hi\n"
+        "workdir: work\nemail: me@example.com\nname: job\n"
+    )
+
+    def generate():
+        return subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from slappt.slappt import cli; cli()",
+                "job.yaml",
+            ],
+            capture_output=True,
+            cwd=tmp_path,
+            env={**environ, "SLAPPT_CACHE_DIR": str(tmp_path / "cache")},
+            text=True,
+        )
+
+    proc = benchmark(generate)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.startswith("#!/bin/bash")
+
+
+@pytest.mark.benchmark(group="generate")
+def test_bench_get_container_invocation(benchmark):
+    invocation = benchmark(
+        ScriptGenerator.get_container_invocation,
+        "docker://alpine",
+        "echo hello",
+        work_dir="/scratch",
+        env=[{"key": "greeting", "value": "hello"}],
+        shell=Shell.BASH,
+    )
+    assert "apptainer exec" in invocation[0]
+
+
+@pytest.mark.benchmark(group="validate")
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_bench_check_image(
+    benchmark, stub_registry, tmp_path, monkeypatch, use_cache
+):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, _ = stub_registry
+    exists = benchmark(
+        docker.check_image,
+        f"docker://{registry}/library/alpine",
+        use_cache=use_cache,
+    )
+    assert exists
+
+
+@pytest.mark.benchmark(group="validate")
+def test_bench_images_exist(benchmark, stub_registry, tmp_path, monkeypatch):
+    # many configs sharing a few images, as when validating a sweep
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, _ = stub_registry
+    images = [
+        f"docker://{registry}/library/alpine",
+        f"docker://{registry}/owner/tool:1.0",
+    ] * 250
+    found = benchmark(docker.images_exist, images, use_cache=False)
+    assert all(found.values())
+
+
+@pytest.mark.benchmark(group="submit")
+def test_bench_submit_scripts(benchmark, slurm_cluster, config):
+    # 20 jobs per round, over one connection
+    jobs = []
+    for i in range(20):
+        job = replace(
+            config,
+            name=f"bench{i}",
+            host=slurm_cluster.host,
+            port=slurm_cluster.port,
+            username=slurm_cluster.username,
+            password=slurm_cluster.password,
+        )
+        jobs.append(
+            (job, ScriptGenerator(job, validate=False).get_job_script())
+        )
+    job_ids = benchmark(submit_scripts, jobs)
+    assert len(job_ids) == 20
+
+
+@pytest.mark.benchmark(group="submit-ssh")
+def test_bench_submit_ssh(benchmark, slurm_cluster, config):
+    # over a real (local) SSH connection, reused from the pool
+    config = replace(
+        config,
+        host=slurm_cluster.host,
+        port=slurm_cluster.port,
+        username=slurm_cluster.username,
+        password=slurm_cluster.password,
+    )
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    pool = SSHPool()
+    result = benchmark(submit, config, script, validate=False, pool=pool)
+    assert result.job_ids
+    pool.close()
+
+
+@pytest.mark.benchmark(group="submit-ssh")
+def test_bench_submit_ssh_load(benchmark, slurm_cluster, config):
+    # many concurrent submissions sharing one pooled connection
+    config = replace(
+        config,
+        host=slurm_cluster.host,
+        port=slurm_cluster.port,
+        username=slurm_cluster.username,
+        password=slurm_cluster.password,
+    )
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    pool = SSHPool()
+
+    def submit_all():
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return list(
+                executor.map(
+                    lambda i: submit(
+                        replace(config, name=f"bench{i}"),
+                        script,
+                        validate=False,
+                        pool=pool,
+                    ),
+                    range(LOAD_SUBMISSIONS),
+                )
+            )
+
+    results = benchmark.pedantic(submit_all, rounds=1)
+    assert len(results) == LOAD_SUBMISSIONS
+    assert len(slurm_cluster.slurm.jobs) == LOAD_SUBMISSIONS
+    pool.close()
@@ -0,0 +1,65 @@
+from multiprocessing import Pool
+
+from slappt.cache import FileCache, get_cache
+
+
+def test_get_set(tmp_path):
+    cache = FileCache(tmp_path / "cache.json")
+    assert cache.get("key") is None
+    assert cache.get("key", default=False) is False
+
+    cache.set("key", True, ttl=60)
+    assert cache.get("key") is True
+    assert "key" in cache
+    assert len(cache) == 1
+
+    # a fresh instance reads the same file
+    assert FileCache(tmp_path / "cache.json").get("key") is True
+
+
+def test_expiry(tmp_path):
+    cache = FileCache(tmp_path / "cache.json")
+    cache.set("stale", True, ttl=-1)
+    cache.set("fresh", False, ttl=60)
+    assert cache.get("stale") is None
+    assert cache.get("fresh") is False
+    assert len(cache) == 1
+
+
+def test_eviction(tmp_path):
+    cache = FileCache(tmp_path / "cache.json", max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.set("c", 3, ttl=60)
+    assert "a" not in cache
+    assert cache.get("b") == 2
+    assert cache.get("c") == 3
+
+
+def test_invalidate_and_clear(tmp_path):
+    cache = FileCache(tmp_path / "cache.json")
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    assert cache.invalidate("a")
+    assert not cache.invalidate("a")
+    assert "a" not in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_get_cache_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    cache = get_cache("test")
+    assert cache.path == tmp_path / "test.json"
+    assert get_cache("test") is cache
+
+
+def _set(path, i):
+    FileCache(path).set(str(i), i, ttl=60)
+
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / "cache.json"
+    with Pool(4) as pool:
+        pool.starmap(_set, [(path, i) for i in range(32)])
+    assert len(FileCache(path)) == 32
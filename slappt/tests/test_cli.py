@@ -28,3 +28,56 @@ def test_submit_slurm():
     runner = CliRunner()
     # result = runner.invoke(cli.submit, [""])
     # todo
+
+
+def test_matrix(slurm_cluster, tmp_path):
+    from slappt.slappt import cli
+
+    for tag in ("a", "b"):
+        (tmp_path / f"{tag}.sif").touch()
+    path = tmp_path / "sweep.yaml"
+    path.write_text(f"""\
+image: {tmp_path}/{{{{ tag }}}}.sif
+entrypoint: echo {{{{ seed }}}}
+workdir: work
+matrix:
+  tag: [a, b]
+  seed: [1, 2, 3]
+""")
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(path)])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("#!/bin/bash") == 6
+    assert f"{tmp_path}/b.sif" in result.output
+
+    # submitted to the stand-in cluster
+    with path.open("a") as f:
+        f.write(
+            f"host: {slurm_cluster.host}\nport: {slurm_cluster.port}\n"
+            f"username: {slurm_cluster.username}\n"
+            f"password: {slurm_cluster.password}\n"
+        )
+    result = runner.invoke(cli, [str(path), "--submit"])
+    assert result.exit_code == 0, result.output
+    jobs = slurm_cluster.slurm.jobs
+    assert [j.name for j in jobs.values()] == [
+        f"sweep-{i}" for i in range(1, 7)
+    ]
+    assert (slurm_cluster.root / "work" / "sweep-6.sh").is_file()
+
+
+@pytest.mark.parametrize(
+    "args,message",
+    [
+        (["--wait"], "--wait requires --submit"),
+        (["--submit", "--wait_timeout", "5"], "--wait_timeout requires"),
+        (["--submit", "--fetch"], "--fetch with --submit requires --wait"),
+    ],
+)
+def test_usage_errors(args, message):
+    from slappt.slappt import cli
+
+    result = CliRunner().invoke(cli, ["--image", "alpine", *args])
+    assert result.exit_code == 2
+    assert message in result.output
@@ -1,25 +1,232 @@
-from slappt.docker import parse_image_components
+import time
+from dataclasses import replace
 
+import pytest
 
-def test_parse_image_components_no_owner_or_tag():
-    image = "alpine"
-    owner, name, tag = parse_image_components(image)
-    assert not owner
-    assert not tag
-    assert name == "alpine"
+from slappt import docker
+from slappt.models import ConfigMatrix, SlapptConfig
+from slappt.scripts import ScriptGenerator
+from slappt.tests.conftest import stub_digest
 
 
-def test_parse_image_components_no_owner():
-    image = "ubuntu:xenial"
-    owner, name, tag = parse_image_components(image)
-    assert not owner
-    assert tag == "xenial"
-    assert name == "ubuntu"
+def test_check_image_cached(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+    image = f"{registry}/library/alpine"
+    missing = f"{registry}/library/missing"
 
+    def heads():
+        return len([r for r in requested if r[0] == "HEAD"])
 
-def test_parse_image_components():
-    image = "computationalplantscience/slappt:latest"
-    owner, name, tag = parse_image_components(image)
-    assert owner == "computationalplantscience"
-    assert name == "slappt"
-    assert tag == "latest"
+    assert docker.check_image(image)
+    assert not docker.check_image(missing)
+    queried = heads()
+    assert docker.check_image(image)
+    assert not docker.check_image(missing)
+    assert heads() == queried
+
+    # bypassing the cache always queries
+    assert docker.check_image(f"docker://{image}:latest", use_cache=False)
+    assert heads() > queried
+
+    # invalidating by any spelling of the reference forces a fresh lookup
+    queried = heads()
+    assert docker.invalidate_image(f"docker://{image}:latest")
+    assert not docker.invalidate_image(f"docker://{image}:latest")
+    assert docker.check_image(image)
+    assert heads() > queried
+
+    queried = heads()
+    docker.clear_image_cache()
+    assert not docker.check_image(missing)
+    assert heads() > queried
+
+
+def test_registry_token_error_is_a_miss(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+
+    # the stub refuses tokens to these credentials, which mustn't be retried
+    monkeypatch.setenv("SLAPPT_REGISTRY_USERNAME", "denied")
+    monkeypatch.setenv("SLAPPT_REGISTRY_PASSWORD", "denied")
+    assert not docker.check_image(
+        f"{registry}/library/alpine", use_cache=False
+    )
+    assert len([r for r in requested if r[0] == "GET"]) == 1
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("alpine", "registry-1.docker.io/library/alpine:latest"),
+        (
+            "docker://ubuntu:xenial",
+            "registry-1.docker.io/library/ubuntu:xenial",
+        ),
+        ("docker.io/owner/name", "registry-1.docker.io/owner/name:latest"),
+        (
+            "computationalplantscience/slappt:latest",
+            "registry-1.docker.io/computationalplantscience/slappt:latest",
+        ),
+        ("ghcr.io/owner/name:1.0", "ghcr.io/owner/name:1.0"),
+        ("localhost:5000/a/b@sha256:abc", "localhost:5000/a/b@sha256:abc"),
+        (
+            "library://owner/collection/name:1",
+            "library://owner/collection/name:1",
+        ),
+        ("/images/name.sif", "/images/name.sif"),
+    ],
+)
+def test_parse_image_reference(value, expected):
+    assert str(docker.parse_image_reference(value)) == expected
+
+
+def test_check_image_local(tmp_path):
+    sif = tmp_path / "image.sif"
+    assert not docker.check_image(str(sif))
+    assert docker.check_image(str(sif), local_paths=False)
+    sif.touch()
+    assert docker.check_image(str(sif))
+    assert docker.check_image("library://owner/collection/name:1")
+    assert docker.check_image("oras://ghcr.io/owner/name:1")
+
+
+def test_images_exist_dedupes(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+    images = [
+        f"docker://{registry}/library/alpine:latest",
+        f"{registry}/library/alpine",
+        f"{registry}/owner/tool:1.0",
+    ]
+    images = images * 50 + [f"{registry}/owner/tool:2.0"]
+
+    found = docker.images_exist(images, use_cache=False)
+    assert found == {
+        images[0]: True,
+        images[1]: True,
+        images[2]: True,
+        images[-1]: False,
+    }
+    heads = [r for r in requested if r[0] == "HEAD"]
+    assert {path for _, path in heads} == {
+        "/v2/library/alpine/manifests/latest",
+        "/v2/owner/tool/manifests/1.0",
+        "/v2/owner/tool/manifests/2.0",
+    }
+    # one token fetch, reused by every authenticated request
+    assert len([r for r in requested if r[0] == "GET"]) == 1
+
+
+def test_validate_configs(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+    configs = [
+        SlapptConfig(
+            image=f"docker://{registry}/library/alpine", entrypoint=str(i)
+        )
+        for i in range(500)
+    ] + [SlapptConfig(image=f"docker://{registry}/owner/missing")]
+
+    results = ScriptGenerator.validate_configs(configs)
+    assert all(valid for valid, _ in results[:-1])
+    assert results[-1] == (
+        False,
+        [f"Image docker://{registry}/owner/missing not found"],
+    )
+    count = len(requested)
+    assert count <= 6
+
+    # the second pass is served entirely from the cache
+    ScriptGenerator.validate_configs(configs)
+    assert len(requested) == count
+
+
+def test_iter_validated(tmp_path, monkeypatch):
+    lookups = []
+
+    def images_exist(images, **kwargs):
+        lookups.append(sorted(images))
+        return {i: not i.endswith("missing") for i in images}
+
+    monkeypatch.setattr(docker, "images_exist", images_exist)
+    matrix = ConfigMatrix(
+        {"image": "docker://owner/{{ image }}", "entrypoint": "{{ seed }}"},
+        {"image": ["tool", "missing"], "seed": list(range(300))},
+    )
+
+    validated = ScriptGenerator.iter_validated(matrix, batch_size=100)
+    invalid = [c.entrypoint for c, errors in validated if errors]
+    assert invalid == list(range(300))
+    # each image is looked up once, as its first batch streams past
+    assert lookups == [["docker://owner/tool"], ["docker://owner/missing"]]
+
+
+def test_resolve_digests(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+    alpine = f"docker://{registry}/library/alpine"
+    pinned = f"docker://{registry}/owner/tool@sha256:abc"
+    missing = f"docker://{registry}/owner/tool:2.0"
+    images = [alpine, f"{alpine}:latest", pinned, missing, "library://a/b/c"]
+
+    digests = docker.resolve_digests(images * 20)
+    assert digests == {
+        alpine: stub_digest("library/alpine", "latest"),
+        f"{alpine}:latest": stub_digest("library/alpine", "latest"),
+        pinned: "sha256:abc",
+        missing: None,
+        "library://a/b/c": None,
+    }
+    heads = [r for r in requested if r[0] == "HEAD"]
+    assert {path for _, path in heads} == {
+        "/v2/library/alpine/manifests/latest",
+        "/v2/owner/tool/manifests/2.0",
+    }
+
+    # digests and existence are both cached
+    count = len(requested)
+    assert docker.resolve_digest(alpine) == digests[alpine]
+    assert docker.check_image(alpine) and not docker.check_image(missing)
+    assert len(requested) == count
+
+    # but the tag's digest only briefly, since the tag may move
+    now = time.time()
+    monkeypatch.setattr(
+        docker.time, "time", lambda: now + docker.DIGEST_CACHE_TTL + 1
+    )
+    assert docker.resolve_digest(alpine) == digests[alpine]
+    assert len(requested) > count
+
+    count = len(requested)
+    assert docker.resolve_digest(alpine, use_cache=False) == digests[alpine]
+    assert len(requested) > count
+
+    assert docker.pin_image(f"{alpine}:3", "sha256:ff") == (
+        f"docker://{registry}/library/alpine@sha256:ff"
+    )
+
+
+def test_pin_digest(stub_registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path))
+    registry, requested = stub_registry
+    config = SlapptConfig(
+        image=f"docker://{registry}/owner/tool:1.0",
+        entrypoint="true",
+        partition="batch",
+        pin_digest=True,
+    )
+    digest = stub_digest("owner/tool", "1.0")
+
+    missing = replace(config, image=f"docker://{registry}/owner/tool:2.0")
+    results = ScriptGenerator.validate_configs([config, missing])
+    assert results[0] == (True, [])
+    assert not results[1][0]
+    count = len(requested)
+
+    script = ScriptGenerator(config).get_job_script()
+    assert script[-1].startswith(
+        f"apptainer exec docker://{registry}/owner/tool@{digest} "
+    )
+    # resolved once, at validation
+    assert len(requested) == count
@@ -0,0 +1,180 @@
+import os
+import shutil
+
+import pytest
+
+from slappt.fetch import (
+    LogFollower,
+    RemoteFile,
+    fetch_outputs,
+    follow_logs,
+    parse_find_output,
+)
+from slappt.slappt import fetch_job_outputs, follow_job_logs
+
+
+def test_parse_find_output():
+    output = "12 1700000000.5 slappt.job.7.out\n0 1700000001.0 slappt.job.7.err\n\nbad\n"
+    assert parse_find_output(output) == [
+        RemoteFile("slappt.job.7.out", 12, 1700000000.5),
+        RemoteFile("slappt.job.7.err", 0, 1700000001.0),
+    ]
+
+
+@pytest.fixture
+def outputs(slurm_cluster):
+    workdir = slurm_cluster.root / "work"
+    workdir.mkdir()
+    expected = {}
+    for task in range(1, 101):
+        for ext in ("out", "err"):
+            name = f"slappt.job.{task}.{ext}"
+            (workdir / name).write_text(f"{ext} {task}\n")
+            expected[name] = f"{ext} {task}\n"
+    (workdir / "slappt.other.1.out").write_text("not this job")
+    (workdir / "job.sh").write_text("nor this")
+    return expected
+
+
+@pytest.mark.parametrize("tar", [False, True])
+def test_fetch_outputs(slurm_cluster, outputs, tmp_path, tar):
+    dest = tmp_path / "outputs"
+    config = slurm_cluster.config(name="job", workdir="work")
+    with slurm_cluster.connect() as client:
+        stats = fetch_outputs(client, "job", "work", dest, tar=tar)
+        assert len(stats) == 200
+        assert {p.name: p.read_text() for p in dest.iterdir()} == outputs
+
+        # only new or changed files are fetched again
+        (slurm_cluster.root / "work" / "slappt.job.101.out").write_text("x")
+        stats = fetch_outputs(client, "job", "work", dest, tar=tar)
+        assert [s.path for s in stats] == [str(dest / "slappt.job.101.out")]
+
+    assert fetch_job_outputs([config], dest) == {"job": []}
+
+
+def test_fetch_outputs_by_job_id(slurm_cluster, tmp_path):
+    workdir = slurm_cluster.root / "work"
+    workdir.mkdir()
+    (workdir / "job.sh").write_text("#SBATCH --job-name=job\n")
+    with slurm_cluster.connect() as client:
+        _, stdout, _ = client.exec_command(
+            "cd work && sbatch --parsable --array=1-3 job.sh"
+        )
+        job_id = stdout.read().decode().strip()
+        slurm = slurm_cluster.slurm
+        job = slurm.jobs[int(job_id)]
+        expected = set()
+        for task in job.tasks:
+            name = f"slappt.job.{slurm.get_raw_id(job, task)}.out"
+            (workdir / name).write_text(name)
+            expected.add(name)
+        # an earlier run's, and a job named with this one's as a prefix
+        (workdir / "slappt.job.999.out").write_text("old")
+        (workdir / f"slappt.job.2.{job_id}.out").write_text("other")
+
+        dest = tmp_path / "outputs"
+        fetch_outputs(client, "job", "work", dest, job_ids=[job_id])
+        assert {p.name for p in dest.iterdir()} == expected
+
+        dest = tmp_path / "all"
+        fetch_outputs(client, "job", "work", dest)
+        assert {p.name for p in dest.iterdir()} == expected | {
+            "slappt.job.999.out"
+        }
+
+
+def test_fetch_tar_file_changed(slurm_cluster, outputs, tmp_path, monkeypatch):
+    # GNU tar exits 1 if a file changed while it was read, e.g. a log still
+    # being written, but the archive is complete
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    (bin / "tar").write_text(
+        f"#!/bin/bash\n{shutil.which('tar')} \"$@\"\n"
+        "echo 'tar: file changed as we read it' >&2\nexit 1\n"
+    )
+    (bin / "tar").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin}:{os.environ['PATH']}")
+
+    dest = tmp_path / "outputs"
+    with slurm_cluster.connect() as client:
+        stats = fetch_outputs(client, "job", "work", dest, tar=True)
+    assert len(stats) == 200
+
+
+def test_log_follower(slurm_cluster):
+    workdir = slurm_cluster.root / "work"
+    workdir.mkdir()
+    out = workdir / "slappt.job.1_1.out"
+    out.write_text("one\ntw")
+    (workdir / "slappt.other.1.out").write_text("not this job\n")
+
+    with slurm_cluster.connect() as client, client.open_sftp() as sftp:
+        follower = LogFollower(sftp, ["job"], "work")
+        assert follower.poll() == [("slappt.job.1_1.out", "one")]
+        assert follower.poll() == []
+
+        # only appended bytes are read, through the same handle
+        handle = follower.handles["slappt.job.1_1.out"]
+        with out.open("a") as f:
+            f.write("o\nthree\n")
+        (workdir / "slappt.job.1_2.err").write_text("oops\n")
+        assert follower.poll() == [
+            ("slappt.job.1_1.out", "two"),
+            ("slappt.job.1_1.out", "three"),
+            ("slappt.job.1_2.err", "oops"),
+        ]
+        assert follower.handles["slappt.job.1_1.out"] is handle
+        assert follower.offsets["slappt.job.1_1.out"] == out.stat().st_size
+
+        # truncated files are read again from the start, without the
+        # incomplete line held back before
+        with out.open("a") as f:
+            f.write("cut")
+        assert follower.poll() == []
+        out.write_text("new\nlast")
+        assert follower.poll() == [("slappt.job.1_1.out", "new")]
+        assert follower.flush() == [("slappt.job.1_1.out", "last")]
+        follower.close()
+        assert not follower.handles
+
+
+def test_follow_logs(slurm_cluster):
+    workdir = slurm_cluster.root / "work"
+    workdir.mkdir()
+    out = workdir / "slappt.job.1.out"
+    out.write_text("")
+    polls = []
+
+    def until():
+        # the job writes a line between polls, then finishes
+        polls.append(len(polls))
+        with out.open("a") as f:
+            f.write(f"line {len(polls)}\n" if len(polls) < 3 else "end")
+        return len(polls) == 3
+
+    with slurm_cluster.connect() as client, client.open_sftp() as sftp:
+        follower = LogFollower(sftp, ["job"], "work")
+        lines = list(follow_logs([follower], until, interval=0.01))
+    assert [line for _, line in lines] == ["line 1", "line 2", "end"]
+
+
+def test_follow_job_logs(slurm_cluster):
+    slurm_cluster.slurm.run_time = 0.2
+    (slurm_cluster.root / "job.sh").write_text("#SBATCH --job-name=job\n")
+    with slurm_cluster.connect() as client:
+        _, stdout, _ = client.exec_command("sbatch --parsable job.sh")
+        job_id = stdout.read().decode().strip()
+    (slurm_cluster.root / f"slappt.job.{job_id}.out").write_text("hello\n")
+
+    config = slurm_cluster.config(name="job")
+    assert list(follow_job_logs([config])) == [
+        (f"slappt.job.{job_id}.out", "hello")
+    ]
+    # following stops once the job is complete
+    lines = follow_job_logs([config], True, {"job": [job_id]}, interval=0.05)
+    assert list(lines) == [(f"slappt.job.{job_id}.out", "hello")]
+    assert (
+        slurm_cluster.slurm.get_state(slurm_cluster.slurm.jobs[int(job_id)])
+        == "COMPLETED"
+    )
@@ -0,0 +1,67 @@
+import json
+import subprocess
+import sys
+
+from slappt.cache import FileCache
+
+# modules only needed to submit jobs or query registries, which generating
+# a script (for a local or cached image) must not import
+HEAVY_MODULES = [
+    "asyncio",
+    "cryptography",
+    "filelock",
+    "httpx",
+    "multiprocessing.pool",
+    "paramiko",
+    "requests",
+    "tenacity",
+]
+
+# generates a script in a fresh interpreter, then reports which heavy
+# modules it imported. how long that takes is left to the benchmarks (see
+# test_benchmarks.py), since shared CI runners vary too much to assert on
+GENERATE = """\
+import json, sys
+from slappt.slappt import cli
+cli(sys.argv[1:], standalone_mode=False)
+heavy = [m for m in {heavy} if m in sys.modules]
+print(json.dumps({{"heavy": heavy}}), file=sys.stderr)
+"""
+
+
+def generate(tmp_path, *args):
+    proc = subprocess.run(
+        [sys.executable, "-c", GENERATE.format(heavy=HEAVY_MODULES), *args],
+        capture_output=True,
+        cwd=tmp_path,
+        env={"SLAPPT_CACHE_DIR": str(tmp_path / "cache"), "PATH": ""},
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.startswith("#!/bin/bash")
+    return json.loads(proc.stderr.strip().splitlines()[-1])
+
+
+def test_generate_startup(tmp_path):
+    (tmp_path / "image.sif").touch()
+    config = tmp_path / "job.yaml"
+    config.write_text(
+        "image: image.sif\npartition: batch\nentrypoint: echo hi\n"
+        "workdir: work\nemail: me@example.com\nname: job\n"
+    )
+
+    result = generate(tmp_path, str(config))
+    assert result["heavy"] == []
+
+
+def test_generate_cached_image_startup(tmp_path):
+    image = "registry-1.docker.io/library/alpine:latest"
+    FileCache(tmp_path / "cache" / "images.json").set(image, True, ttl=60)
+
+    result = generate(
+        tmp_path,
+        *["--image", "alpine", "--partition", "batch"],
+        *["--entrypoint", "echo hi", "--workdir", "work"],
+        *["--email", "me@example.com", "--name", "job"],
+    )
+    assert result["heavy"] == []
@@ -0,0 +1,119 @@
+import io
+import subprocess
+
+import pytest
+
+from slappt.inputs import (
+    INDEX_RECORD_SIZE,
+    INDEX_THRESHOLD,
+    count_lines,
+    get_remote_count_command,
+    get_remote_index_command,
+    iter_index,
+    upload_inputs,
+    write_index,
+)
+from slappt.models import SlapptConfig
+from slappt.scripts import ScriptGenerator
+
+
+@pytest.mark.parametrize(
+    "data,expected",
+    [(b"", 0), (b"a", 1), (b"a\n", 1), (b"a\nb", 2), (b"a\n\nb\n", 3)],
+)
+def test_count_lines(tmp_path, data, expected):
+    path = tmp_path / "inputs.txt"
+    path.write_bytes(data)
+    assert count_lines(path, block_size=2) == expected
+
+
+def test_iter_index():
+    data = b"one\ntwo\n\nfour"
+    for block_size in (1, 3, 64):
+        index = b"".join(iter_index(io.BytesIO(data), block_size))
+        offsets = [int(r) for r in index.split(b"\n") if r]
+        assert offsets == [0, 4, 8, 9]
+        assert len(index) == 4 * INDEX_RECORD_SIZE
+
+
+def test_uses_input_index(tmp_path):
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("\n".join(str(i) for i in range(INDEX_THRESHOLD)))
+    config = SlapptConfig(inputs=str(inputs))
+    assert not ScriptGenerator.uses_input_index(config)
+    config.input_index = True
+    assert ScriptGenerator.uses_input_index(config)
+
+    inputs.write_text("\n".join(str(i) for i in range(INDEX_THRESHOLD + 1)))
+    config.input_index = None
+    assert ScriptGenerator.uses_input_index(config)
+    config.input_index = False
+    assert not ScriptGenerator.uses_input_index(config)
+
+
+def test_indexed_lookup(tmp_path):
+    inputs = tmp_path / "inputs.txt"
+    lines = [f"input {i} with spaces" for i in range(1, 2001)]
+    inputs.write_text("\n".join(lines))
+    assert write_index(inputs) == len(lines)
+
+    config = SlapptConfig(
+        image="alpine", entrypoint="echo", inputs=str(inputs)
+    )
+    generator = ScriptGenerator(config, validate=False)
+    lookup = [
+        c for c in generator.get_job_command() if c.startswith("SLAPPT_")
+    ]
+    assert lookup[1].startswith("SLAPPT_OFFSET=")
+
+    for task, offset in [(1, 0), (2, 0), (1000, 0), (1, 999), (1000, 1000)]:
+        output = subprocess.run(
+            ["bash", "-c", "\n".join(lookup + ['echo "$SLAPPT_INPUT"'])],
+            env={
+                "SLURM_ARRAY_TASK_ID": str(task),
+                "SLAPPT_TASK_OFFSET": str(offset),
+                "PATH": "/usr/bin:/bin",
+            },
+            capture_output=True,
+            text=True,
+        ).stdout
+        assert output == f"{lines[task + offset - 1]}\n"
+
+
+def test_upload_inputs(tmp_path):
+    from slappt.tests.test_transfer import RecordingSFTP
+
+    local = tmp_path / "inputs.txt"
+    data = b"".join(f"input {i}\n".encode() for i in range(50000)) + b"last"
+    local.write_bytes(data)
+
+    sftp = RecordingSFTP()
+    count, stats = upload_inputs(
+        sftp, local, "inputs.txt", "inputs.txt.idx", block_size=4096
+    )
+    assert count == 50001
+    assert sftp.files["inputs.txt"].contents == data
+    index = sftp.files["inputs.txt.idx"].contents
+    assert len(index) == count * INDEX_RECORD_SIZE
+    with local.open("rb") as f:
+        assert index == b"".join(iter_index(f))
+    assert [s.path for s in stats] == ["inputs.txt", "inputs.txt.idx"]
+
+    count, stats = upload_inputs(sftp, local, "again.txt", block_size=4096)
+    assert count == 50001
+    assert len(stats) == 1
+
+
+def test_remote_inputs_commands(tmp_path):
+    inputs = tmp_path / "remote inputs.txt"
+    lines = ["a", "bb", "", "ccc ✓"]
+    inputs.write_text("\n".join(lines))
+    run = lambda cmd: subprocess.run(
+        ["bash", "-c", cmd], capture_output=True, text=True
+    ).stdout
+
+    assert run(get_remote_count_command(str(inputs))).strip() == "4"
+    run(get_remote_index_command(str(inputs)))
+    with inputs.open("rb") as f:
+        expected = b"".join(iter_index(f))
+    assert (tmp_path / "remote inputs.txt.idx").read_bytes() == expected
@@ -0,0 +1,70 @@
+import pytest
+
+from slappt.models import ConfigMatrix, SlapptConfig
+
+SWEEP_YAML = """\
+name: sweep
+image: docker://owner/tool:{{ tag }}
+entrypoint: python train.py --lr {{ lr }}
+gpus: "{{ gpus }}"
+environment:
+  - key: LR
+    value: "{{ lr }}"
+matrix:
+  tag: ["1.0", "1.1"]
+  lr: [0.1, 0.01]
+  gpus: 1
+  mem: [1GB, 2GB]
+"""
+
+
+def test_config_matrix(tmp_path):
+    path = tmp_path / "sweep.yaml"
+    path.write_text(SWEEP_YAML)
+    matrix = ConfigMatrix.from_yaml(path)
+    assert len(matrix) == 8
+
+    configs = iter(matrix)
+    first = next(configs)
+    assert first.name == "sweep-1"
+    assert first.image == "docker://owner/tool:1.0"
+    assert first.entrypoint == "python train.py --lr 0.1"
+    assert first.environment == [{"key": "LR", "value": 0.1}]
+    assert first.gpus == 1
+    assert first.mem == "1GB"
+
+    rest = list(configs)
+    assert [c.name for c in rest] == [f"sweep-{i}" for i in range(2, 9)]
+    assert {(c.image, c.entrypoint, c.mem) for c in [first] + rest} == {
+        (f"docker://owner/tool:{t}", f"python train.py --lr {lr}", mem)
+        for t in ("1.0", "1.1")
+        for lr in (0.1, 0.01)
+        for mem in ("1GB", "2GB")
+    }
+
+    with pytest.raises(ValueError, match="defines a matrix"):
+        SlapptConfig.from_yaml(path)
+
+
+def test_config_matrix_names_and_errors():
+    matrix = ConfigMatrix({"name": "run-{{ seed }}"}, {"seed": [1, 2]})
+    assert [c.name for c in matrix] == ["run-1", "run-2"]
+
+    # no matrix, one config as is
+    assert [c.name for c in ConfigMatrix({"name": "job"})] == ["job"]
+
+    with pytest.raises(ValueError, match="Unknown matrix keys"):
+        ConfigMatrix({"entrypoint": "{{ missing }}"}, {"seed": [1]})
+    with pytest.raises(ValueError, match="neither referenced"):
+        ConfigMatrix({"name": "job"}, {"seed": [1]})
+    with pytest.raises(ValueError, match="no values"):
+        ConfigMatrix({"name": "job"}, {"mem": []})
+
+
+def test_config_matrix_without_matrix(tmp_path):
+    # braces in a plain config are left alone, e.g. for a templating tool
+    path = tmp_path / "job.yaml"
+    path.write_text("name: job\nentrypoint: echo '{{ word }}'\n")
+    (config,) = list(ConfigMatrix.from_yaml(path))
+    assert config.entrypoint == "echo '{{ word }}'"
+    assert config == SlapptConfig.from_yaml(path)
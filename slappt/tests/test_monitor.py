@@ -0,0 +1,102 @@
+import io
+
+import pytest
+
+import slappt.monitor
+from slappt.monitor import JobMonitor, get_sacct_command, parse_sacct_output
+
+
+class ScriptedClient:
+    """
+    Answers each `sacct` call with the next of the given outputs.
+    """
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.commands = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        output = (
+            self.outputs.pop(0) if len(self.outputs) > 1 else self.outputs[0]
+        )
+        return io.BytesIO(), io.BytesIO(output.encode()), io.BytesIO()
+
+
+def test_parse_sacct_output():
+    states = parse_sacct_output(
+        "12_1|COMPLETED|0:0\n12_[2-5]|PENDING|0:0\n13|CANCELLED by 1000|0:15\n\n"
+    )
+    assert [(s.job_id, s.state) for s in states] == [
+        ("12_1", "COMPLETED"),
+        ("12_[2-5]", "PENDING"),
+        ("13", "CANCELLED"),
+    ]
+    assert states[0].complete and not states[1].complete
+    assert states[2].category == "cancelled"
+
+
+def test_monitor_array_transitions(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(slappt.monitor.time, "sleep", sleeps.append)
+    client = ScriptedClient(
+        "",
+        "12_[1-2]|PENDING|0:0\n",
+        "12_[1-2]|PENDING|0:0\n",
+        "12_1|RUNNING|0:0\n12_2|RUNNING|0:0\n",
+        "12_1|COMPLETED|0:0\n12_2|FAILED|1:0\n",
+    )
+    monitor = JobMonitor(["12"], client, interval=1, backoff=2)
+    transitions = [(t.job_id, t.previous, t.state) for t in monitor.watch()]
+
+    # a single query per cycle, whatever the number of tasks
+    assert len(client.commands) == 5
+    assert client.commands[0] == get_sacct_command(["12"])
+    assert transitions == [
+        ("12_[1-2]", None, "PENDING"),
+        ("12_1", None, "RUNNING"),
+        ("12_2", None, "RUNNING"),
+        ("12_1", "RUNNING", "COMPLETED"),
+        ("12_2", "RUNNING", "FAILED"),
+    ]
+    # the interval backs off while nothing changes and resets on changes
+    assert sleeps == [2, 1, 2, 1]
+    assert monitor.summary() == {"success": 1, "failure": 1}
+    assert monitor.exit_status() == 1
+
+
+def test_monitor_waits_for_every_job(monkeypatch):
+    monkeypatch.setattr(slappt.monitor.time, "sleep", lambda s: None)
+    client = ScriptedClient(
+        "1|COMPLETED|0:0\n",
+        "1|COMPLETED|0:0\n2|COMPLETED|0:0\n",
+    )
+    seen = []
+    states = JobMonitor(["1", "2"], client).wait(seen.append)
+    assert [t.job_id for t in seen] == ["1", "2"]
+    assert set(states) == {"1", "2"}
+
+
+def test_monitor_unknown_and_missing_jobs(monkeypatch):
+    monkeypatch.setattr(slappt.monitor.time, "sleep", lambda s: None)
+    client = ScriptedClient("1|SOMETHING_NEW|0:0\n")
+    monitor = JobMonitor(["1", "2"], client, missing_polls=3)
+    transitions = [(t.job_id, t.state) for t in monitor.watch()]
+
+    # neither is waited on forever, and both count as failed
+    assert transitions == [("1", "SOMETHING_NEW"), ("2", "MISSING")]
+    assert len(client.commands) == 3
+    assert monitor.summary() == {"unknown": 2}
+    assert monitor.exit_status() == 1
+
+
+def test_monitor_wait_timeout(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(slappt.monitor.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(
+        slappt.monitor.time, "sleep", lambda s: now.__setitem__(0, now[0] + s)
+    )
+    monitor = JobMonitor(["1"], ScriptedClient("1|RUNNING|0:0\n"))
+    with pytest.raises(TimeoutError, match="incomplete after 30"):
+        monitor.wait(timeout=30)
+    assert now[0] == 30
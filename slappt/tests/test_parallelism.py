@@ -0,0 +1,230 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import pytest
+
+from slappt.models import Parallelism, SlapptConfig
+from slappt.scripts import ScriptGenerator, quote_path
+from slappt.tests.conftest import stub_digest
+
+# stands in for apptainer: instances are no-ops, pulls (slowly) write the
+# image name to the given file and exec runs the command
+FAKE_APPTAINER = """\
+#!/bin/bash
+if [ "$1" = "instance" ]; then echo "$1 $2" >> "$(dirname "$0")/calls"; exit 0; fi
+if [ "$1" = "pull" ]; then echo "$1 $3" >> "$(dirname "$0")/calls"; sleep 0.2; echo "$3" > "$2"; exit 0; fi
+shift 2
+exec "$@"
+"""
+
+
+@pytest.fixture
+def fake_apptainer(tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    apptainer = bin_dir / "apptainer"
+    apptainer.write_text(FAKE_APPTAINER)
+    apptainer.chmod(0o755)
+    return bin_dir
+
+
+def run_task(script, task, bin_dir, cwd, **env):
+    return subprocess.run(
+        ["bash", "-c", "\n".join(script)],
+        cwd=cwd,
+        env={
+            "PATH": f"{bin_dir}:{environ['PATH']}",
+            "SLURM_ARRAY_TASK_ID": str(task),
+            "SLURM_JOB_ID": str(100 + task),
+            **env,
+        },
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_get_array_size():
+    config = SlapptConfig(chunk_size=10)
+    assert ScriptGenerator.get_array_size(config, 95) == 95
+    config.parallelism = Parallelism.LAUNCHER
+    assert ScriptGenerator.get_array_size(config, 95) == 10
+    config.parallelism = "launcher"
+    assert ScriptGenerator.get_array_size(config, 100) == 10
+
+
+@pytest.mark.parametrize("input_index", [False, True])
+def test_launcher_chunks(tmp_path, fake_apptainer, input_index):
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("\n".join(str(i) for i in range(1, 26)))
+    config = SlapptConfig(
+        image="docker://alpine",
+        entrypoint="test $SLAPPT_INPUT -ne 13",
+        inputs=str(inputs),
+        input_index=input_index,
+        parallelism=Parallelism.LAUNCHER,
+        chunk_size=10,
+        cores=4,
+    )
+    if input_index:
+        from slappt.inputs import write_index
+
+        write_index(inputs)
+
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    assert (
+        sum(line.startswith("apptainer instance start") for line in script)
+        == 1
+    )
+
+    results = [
+        run_task(script, t, fake_apptainer, tmp_path) for t in (1, 2, 3)
+    ]
+    statuses = [
+        line
+        for result in results
+        for line in result.stdout.splitlines()
+        if line.startswith("slappt: input")
+    ]
+    assert len(statuses) == 25
+    assert "slappt: input '13' exited with status 1" in statuses
+    assert "slappt: input '12' exited with status 0" in statuses
+    assert [r.returncode for r in results] == [0, 1, 0]
+    assert "slappt: 1 input(s) failed" in results[1].stdout
+
+    calls = (fake_apptainer / "calls").read_text().splitlines()
+    assert calls == ["instance start", "instance stop"] * 3
+
+
+def test_sif_name():
+    name = ScriptGenerator.get_sif_name("docker://ghcr.io/owner/tool:1.0")
+    assert name.startswith("owner_tool_1.0-") and name.endswith(".sif")
+    assert name != ScriptGenerator.get_sif_name("docker://owner/tool:1.0")
+    assert "sha256_abc" in ScriptGenerator.get_sif_name(
+        "docker://owner/tool@sha256:abc"
+    )
+    assert ScriptGenerator.get_sif_name("/images/tool.sif") is None
+
+
+def test_quote_path():
+    assert quote_path("/scratch/sifs") == "/scratch/sifs"
+    assert quote_path("/scratch/my sifs") == "'/scratch/my sifs'"
+    assert quote_path("~/my sifs") == "\"$HOME\"'/my sifs'"
+    assert quote_path("~") == '"$HOME"'
+
+
+def test_sif_cache(tmp_path, fake_apptainer, stub_registry, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path / "cache"))
+    registry, _ = stub_registry
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("\n".join(str(i) for i in range(1, 9)))
+    sifs = tmp_path / "sifs;cache"
+    config = SlapptConfig(
+        image=f"docker://{registry}/library/alpine",
+        entrypoint="cat '$SLAPPT_SIF'",
+        inputs=str(inputs),
+        sif_cache=str(sifs),
+    )
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    assert any(
+        line.startswith('apptainer exec "$SLAPPT_SIF"') for line in script
+    )
+
+    # the tag is pulled (and the SIF named) by the digest it points to
+    pinned = f"{config.image}@{stub_digest('library/alpine', 'latest')}"
+
+    # tasks starting at once pull the image once, and all run it
+    with ThreadPoolExecutor(8) as pool:
+        results = list(
+            pool.map(
+                lambda t: run_task(script, t, fake_apptainer, tmp_path),
+                range(1, 9),
+            )
+        )
+    assert [r.returncode for r in results] == [0] * 8
+    assert {r.stdout for r in results} == {f"{pinned}\n"}
+    calls = (fake_apptainer / "calls").read_text().splitlines()
+    assert calls == [f"pull {pinned}"]
+    sif = ScriptGenerator.get_sif_name(pinned)
+    assert sorted(p.name for p in sifs.iterdir()) == [sif, f"{sif}.lock"]
+
+    # later jobs reuse it
+    assert run_task(script, 9, fake_apptainer, tmp_path).returncode == 0
+    assert len((fake_apptainer / "calls").read_text().splitlines()) == 1
+
+
+def test_node_local(tmp_path, fake_apptainer, stub_registry, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path / "cache"))
+    registry, _ = stub_registry
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("\n".join(str(i) for i in range(1, 9)))
+    node = tmp_path / "node"
+    node.mkdir()
+    config = SlapptConfig(
+        image=f"docker://{registry}/library/alpine",
+        entrypoint="cat $SLAPPT_INPUTS | wc -l",
+        inputs=str(inputs),
+        sif_cache=str(tmp_path / "sifs"),
+        node_local=True,
+    )
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    assert any(
+        line.startswith('apptainer exec "$SLAPPT_LOCAL/image.sif"')
+        for line in script
+    )
+
+    # the array's tasks on a node share one copy, removed by the last
+    with ThreadPoolExecutor(8) as pool:
+        results = list(
+            pool.map(
+                lambda t: run_task(
+                    script,
+                    t,
+                    fake_apptainer,
+                    tmp_path,
+                    TMPDIR=str(node),
+                    SLURM_ARRAY_JOB_ID="7",
+                ),
+                range(1, 9),
+            )
+        )
+    assert [r.returncode for r in results] == [0] * 8
+    assert {r.stdout.strip() for r in results} == {"7"}
+
+    # nothing is left behind, lock and user count included
+    assert list(node.iterdir()) == []
+
+
+def test_node_local_multi_node(tmp_path, fake_apptainer):
+    # srun runs its command once (as if on one node), sbcast copies
+    (fake_apptainer / "srun").write_text(
+        '#!/bin/bash\nwhile [[ "$1" == -* ]]; do\n'
+        '    if [[ "$1" == *=* ]]; then shift; else shift 2; fi\ndone\n'
+        'echo "srun $1" >> "$(dirname "$0")/calls"\nexec "$@"\n'
+    )
+    (fake_apptainer / "sbcast").write_text(
+        '#!/bin/bash\necho "sbcast $3" >> "$(dirname "$0")/calls"\n'
+        'cp "$2" "$3"\n'
+    )
+    for name in ("srun", "sbcast"):
+        (fake_apptainer / name).chmod(0o755)
+    image = tmp_path / "tool.sif"
+    image.write_text("tool")
+    node = tmp_path / "node"
+    node.mkdir()
+    config = SlapptConfig(
+        image=str(image),
+        entrypoint="cat $SLAPPT_LOCAL/image.sif",
+        nodes=2,
+        node_local=True,
+    )
+    script = ScriptGenerator(config, validate=False).get_job_script()
+    result = run_task(script, 1, fake_apptainer, tmp_path, TMPDIR=str(node))
+    assert result.returncode == 0 and result.stdout == "tool"
+    calls = (fake_apptainer / "calls").read_text().splitlines()
+    assert calls == [
+        "srun mkdir",
+        f"sbcast {node}/slappt.101/image.sif",
+        "srun rm",
+    ]
+    assert not list(node.iterdir())
@@ -1,23 +1,41 @@
 import pytest
 
-pytestmark = pytest.mark.skip
+from slappt.models import SlapptConfig
+from slappt.scripts import ScriptGenerator
 
 
+@pytest.mark.skip
 def test_validate_config():
     pass
 
 
+@pytest.mark.parametrize("block_size", [0, -1])
+def test_validate_upload_block_size(block_size):
+    config = SlapptConfig(
+        image="image.sif", entrypoint="echo", upload_block_size=block_size
+    )
+    assert ScriptGenerator.get_errors(config, True) == [
+        f"upload_block_size must be positive, not {block_size}"
+    ]
+    config.upload_block_size = 1
+    assert ScriptGenerator.get_errors(config, True) == []
+
+
+@pytest.mark.skip
 def test_get_walltime():
     pass
 
 
+@pytest.mark.skip
 def test_get_job_headers():
     pass
 
 
+@pytest.mark.skip
 def test_get_job_command():
     pass
 
 
+@pytest.mark.skip
 def test_get_container_invocation():
     pass
@@ -20,7 +20,7 @@ CLUSTER_HOME_DIR = environ.get("CLUSTER_HOME_DIR")
 CLUSTER_PARTITION = environ.get("CLUSTER_PARTITION")
 CLUSTER_EMAIL = environ.get("CLUSTER_EMAIL")
 SCRIPT_NAME = "slurm_template.sh"
-SCRIPT_PATH_REMOTE = Path(CLUSTER_HOME_DIR) / SCRIPT_NAME
+SCRIPT_PATH_REMOTE = Path(CLUSTER_HOME_DIR or "") / SCRIPT_NAME
 SCRIPT_BODY = """\
 #!/bin/bash
 #SBATCH --job-name=slappt_test
@@ -36,9 +36,7 @@ SCRIPT_BODY = """\
 #SBATCH --error=slappt_test.%j.err
 
 echo "hello world"
-""".format(
-    partition=CLUSTER_PARTITION, email=CLUSTER_EMAIL
-)
+""".format(partition=CLUSTER_PARTITION, email=CLUSTER_EMAIL)
 
 
 # todo parametrize with optional params (e.g. account)
@@ -174,7 +172,7 @@ def test_submit_with_password_auth(tmp_path):
         port=22,
         username=CLUSTER_USER,
         password=CLUSTER_PASSWORD,
-        workdir=join(CLUSTER_HOME_DIR, test_id),
+        workdir=join(CLUSTER_HOME_DIR or "", test_id),
         file=str(script_path),
     )
     submit_script(config, SCRIPT_BODY)
@@ -194,7 +192,7 @@ def test_submit_with_key_auth(tmp_path):
         port=22,
         username=CLUSTER_USER,
         pkey=CLUSTER_KEY_PATH,
-        workdir=join(CLUSTER_HOME_DIR, test_id),
+        workdir=join(CLUSTER_HOME_DIR or "", test_id),
         file=str(script_path),
     )
     submit_script(config, SCRIPT_BODY)
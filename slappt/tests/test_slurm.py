@@ -0,0 +1,24 @@
+from slappt.slurm import (
+    DEFAULT_MAX_ARRAY_SIZE,
+    get_category,
+    is_complete,
+    parse_max_array_size,
+)
+
+
+def test_parse_max_array_size():
+    config = """\
+Configuration data as of 2023-01-01T00:00:00
+MaxArraySize            = 10001
+MaxBatchRequeue         = 5
+"""
+    assert parse_max_array_size(config) == 10001
+    assert parse_max_array_size("") == DEFAULT_MAX_ARRAY_SIZE
+
+
+def test_state_categories():
+    assert get_category("CD") == "success"
+    assert get_category("OUT_OF_MEMORY") == "failure"
+    assert get_category("UNKNOWN") is None
+    assert is_complete("TIMEOUT") and is_complete("CANCELLED")
+    assert not is_complete("PENDING") and not is_complete("UNKNOWN")
@@ -1,8 +1,10 @@
+from collections import Counter
 from os import environ
 
+import paramiko
 import pytest
 
-from slappt.ssh import SSH
+from slappt.ssh import SSH, SSHPool, execute_command, read_channel
 
 CLUSTER_HOST = environ.get("CLUSTER_HOST")
 CLUSTER_USER = environ.get("CLUSTER_USER")
@@ -57,3 +59,204 @@ def test_command_key_auth():
     ) as client:
         stdin, stdout, stderr = client.exec_command("pwd")
         assert f"{CLUSTER_HOME_DIR}\n" == stdout.readlines()[0]
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def is_authenticated(self):
+        return True
+
+    def send_ignore(self):
+        pass
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    connections = []
+
+    def connect(self):
+        connections.append(FakeClient())
+        return connections[-1], FakeClient()
+
+    monkeypatch.setattr(SSH, "connect", connect)
+    return connections
+
+
+def test_pool_reuses_connection(fake_connect):
+    pool = SSHPool(keepalive=15)
+    ssh = SSH(host="cluster", port=22, username="user", pool=pool)
+    with ssh as first:
+        with SSH(host="cluster", port=22, username="user", pool=pool) as c:
+            assert c is first
+    with ssh as second:
+        assert second is first
+    assert len(fake_connect) == 1
+    assert first.transport.keepalive == 15
+    assert not first.closed
+
+    with SSH(host="other", port=22, username="user", pool=pool):
+        pass
+    assert len(fake_connect) == 2
+    assert len(pool) == 2
+
+    pool.close()
+    assert all(c.closed for c in fake_connect)
+    assert len(pool) == 0
+
+
+def test_pool_replaces_stale_connection(fake_connect):
+    pool = SSHPool()
+    ssh = SSH(host="cluster", port=22, username="user", pool=pool)
+    with ssh as first:
+        pass
+    first.transport.active = False
+    with ssh as second:
+        assert second is not first
+    assert first.closed
+
+
+def test_pool_release_after_replacement(fake_connect):
+    pool = SSHPool()
+    fresh = SSH(host="cluster", port=22, username="user", pool=pool)
+    with SSH(host="cluster", port=22, username="user", pool=pool) as first:
+        # another borrower finds the connection stale and replaces it
+        first.transport.active = False
+        fresh.__enter__()
+        assert fresh.client is not first
+
+    # releasing the stale connection leaves the replacement in use
+    assert fresh.pooled.users == 1
+    fresh.__exit__(None, None, None)
+    assert pool._connections[SSHPool.key(fresh)].users == 0
+
+
+def test_pool_evicts_idle_connections(fake_connect):
+    pool = SSHPool(idle_timeout=0)
+    with SSH(host="cluster", port=22, username="user", pool=pool) as first:
+        pool.evict_idle()
+        assert not first.closed  # still in use
+    with SSH(host="other", port=22, username="user", pool=pool):
+        pass
+    assert first.closed
+    assert len(pool) == 1
+
+
+def test_connection_local_cluster(slurm_cluster, tmp_path):
+    key_path = tmp_path / "id_rsa"
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(str(key_path))
+    slurm_cluster.authorized_keys = [key]
+    known_hosts = slurm_cluster.write_known_hosts(tmp_path / "known_hosts")
+
+    for auth in ({"password": "slappt"}, {"pkey": str(key_path)}):
+        with SSH(
+            host=slurm_cluster.host,
+            port=slurm_cluster.port,
+            username="slappt",
+            known_hosts=known_hosts,
+            require_host_key=True,
+            **auth,
+        ) as client:
+            stdin, stdout, stderr = client.exec_command("pwd")
+            assert stdout.read().decode() == f"{slurm_cluster.root}\n"
+
+
+def test_execute_command_local_cluster(slurm_cluster):
+    (slurm_cluster.root / "work").mkdir()
+    (slurm_cluster.root / "work" / "job.sh").write_text("#!/bin/bash\n")
+    ssh = SSH(
+        host=slurm_cluster.host,
+        port=slurm_cluster.port,
+        username="slappt",
+        password="slappt",
+    )
+    with ssh:
+        lines = list(
+            execute_command(ssh, "true", "sbatch job.sh", directory="work")
+        )
+        assert lines == ["Submitted batch job 1\n"]
+
+        with pytest.raises(Exception, match="non-zero exit status"):
+            list(execute_command(ssh, "true", "scancel 2"))
+    assert slurm_cluster.commands[0].startswith("bash --login -c")
+
+
+def test_execute_command_stderr(slurm_cluster):
+    ssh = SSH(
+        host=slurm_cluster.host,
+        port=slurm_cluster.port,
+        username="slappt",
+        password="slappt",
+    )
+    with ssh:
+        with pytest.raises(Exception, match="Received stderr"):
+            list(
+                execute_command(
+                    ssh, "true", 'echo out; echo "<b>oops</b>" >&2'
+                )
+            )
+        lines = list(
+            execute_command(
+                ssh,
+                "true",
+                'echo out; echo "<b>oops</b>" >&2',
+                allow_stderr=True,
+            )
+        )
+        assert sorted(lines) == ["oops\n", "out\n"]
+
+
+def test_read_channel_drains_both_streams(slurm_cluster):
+    # each stream alone overflows the channel window, so reading one to
+    # the end before the other would stall both sides
+    command = (
+        "yes err | head -n 2000000 >&2 & yes out | head -n 2000000; wait; "
+        "printf partial"
+    )
+    with slurm_cluster.connect() as client:
+        _, stdout, _ = client.exec_command(command)
+        counts = Counter()
+        last = {}
+        for name, line in read_channel(stdout.channel):
+            counts[name, line] += 1
+            last[name] = line
+        assert stdout.channel.recv_exit_status() == 0
+    assert counts == {
+        ("stdout", "out\n"): 2000000,
+        ("stderr", "err\n"): 2000000,
+        ("stdout", "partial"): 1,
+    }
+    assert last["stdout"] == "partial"
+
+
+def test_read_channel_long_lines(slurm_cluster):
+    # lines spanning many reads (e.g. progress bars redrawn with `\r`) are
+    # put back together once, when they end
+    command = (
+        "echo start; head -c 20000000 /dev/zero | tr '\\0' x; echo; printf end"
+    )
+    with slurm_cluster.connect() as client:
+        _, stdout, _ = client.exec_command(command)
+        lines = [line for _, line in read_channel(stdout.channel)]
+    assert lines == ["start\n", "x" * 20000000 + "\n", "end"]
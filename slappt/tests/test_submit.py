@@ -0,0 +1,275 @@
+from dataclasses import replace
+from os import environ
+
+import pytest
+
+import slappt.slappt
+from slappt.exceptions import ExitStatusException
+from slappt.models import SlapptConfig
+from slappt.slappt import (
+    cache_max_array_size,
+    get_cached_max_array_size,
+    get_max_array_size,
+    get_submit_commands,
+    parse_batch_output,
+    prepare_remote_inputs,
+    submit,
+    submit_scripts,
+    wait_for_jobs,
+)
+from slappt.slurm import DEFAULT_MAX_ARRAY_SIZE
+from slappt.transfer import REMOTE_CACHE_SUBDIRECTORY
+
+
+def test_parse_batch_output():
+    output = """\
+slappt:submit a
+Submitted batch job 1
+slappt:submit b
+sbatch: error: Batch job submission failed
+slappt:submit c
+Submitted batch job 3
+Submitted batch job 4
+"""
+    job_ids, messages = parse_batch_output(output)
+    assert job_ids == {"a": ["1"], "b": [], "c": ["3", "4"]}
+    assert messages == {"b": "sbatch: error: Batch job submission failed\n"}
+
+
+def test_submit_scripts_single_connection(slurm_cluster):
+    jobs = [
+        (
+            slurm_cluster.config(name=f"job{i}", workdir="work"),
+            ["#!/bin/bash", f"echo {i}"],
+        )
+        for i in range(20)
+    ]
+    job_ids = submit_scripts(jobs)
+    assert slurm_cluster.connections == 1
+    assert job_ids == {f"job{i}": [str(i + 1)] for i in range(20)}
+
+
+def test_submit_scripts_duplicate_name(slurm_cluster):
+    jobs = [(slurm_cluster.config(name="job", workdir="work"), [])] * 2
+    with pytest.raises(ValueError):
+        submit_scripts(jobs)
+
+
+def test_submit_scripts_failure(slurm_cluster, monkeypatch):
+    # nothing uploaded, so sbatch can't find the script
+    monkeypatch.setattr(slappt.slappt, "upload_job", lambda *args: (0, []))
+    jobs = [(slurm_cluster.config(name="job", workdir="work"), [])]
+    with pytest.raises(ExitStatusException):
+        submit_scripts(jobs)
+
+
+def test_get_submit_commands_splits_arrays():
+    config = SlapptConfig(name="job", workdir="work", inputs="inputs.txt")
+    assert get_submit_commands(config, 1000, 1001) == [
+        "sbatch --array=1-1000 work/job.sh"
+    ]
+
+    config.array_throttle = 50
+    assert get_submit_commands(config, 2500, 1001) == [
+        "sbatch --array=1-1000%17 --export=ALL,SLAPPT_TASK_OFFSET=0 work/job.sh",
+        "sbatch --array=1-1000%17 --export=ALL,SLAPPT_TASK_OFFSET=1000 work/job.sh",
+        "sbatch --array=1-500%16 --export=ALL,SLAPPT_TASK_OFFSET=2000 work/job.sh",
+    ]
+
+    config.array_throttle = 2  # fewer slots than parts: one each
+    assert [c.split()[1] for c in get_submit_commands(config, 2500, 1001)] == [
+        "--array=1-1000%1",
+        "--array=1-1000%1",
+        "--array=1-500%1",
+    ]
+
+
+def test_submit_scripts_split_arrays(slurm_cluster, tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path / "cache"))
+    slurm_cluster.slurm.max_array_size = 11
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("\n".join(str(i) for i in range(25)))
+    config = slurm_cluster.config(
+        name="job", workdir="work", inputs=str(inputs)
+    )
+
+    assert submit_scripts([(config, [])]) == {"job": ["1", "2", "3"]}
+    assert [len(j.tasks) for j in slurm_cluster.slurm.jobs.values()] == [
+        10,
+        10,
+        5,
+    ]
+    assert get_max_array_size(config) == 11  # now cached for the host
+
+    # another account or port on the same host has its own entry
+    assert get_cached_max_array_size(replace(config, port=1)) is None
+    assert get_cached_max_array_size(replace(config, username="x")) is None
+
+
+def test_max_array_size_fallback_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("SLAPPT_CACHE_DIR", str(tmp_path / "cache"))
+    config = SlapptConfig(host="cluster", name="job")
+    assert cache_max_array_size(config, "") == DEFAULT_MAX_ARRAY_SIZE
+    assert get_cached_max_array_size(config) is None
+    assert cache_max_array_size(config, "MaxArraySize = 11\n") == 11
+    assert get_cached_max_array_size(config) == 11
+
+
+def test_submit_scripts_remote_inputs(slurm_cluster):
+    # the inputs file is already on the cluster, and never uploaded
+    (slurm_cluster.root / "work").mkdir()
+    (slurm_cluster.root / "work" / "inputs.txt").write_text("a\nb\nc")
+    config = slurm_cluster.config(
+        name="job",
+        workdir="work",
+        inputs="work/inputs.txt",
+        remote_inputs=True,
+        max_array_size=1001,
+    )
+
+    assert submit_scripts([(config, [])]) == {"job": ["1"]}
+    assert slurm_cluster.slurm.jobs[1].tasks == [1, 2, 3]
+
+
+def test_prepare_remote_inputs_index_failure(slurm_cluster):
+    (slurm_cluster.root / "work").mkdir()
+    (slurm_cluster.root / "work" / "inputs.txt").write_text("a\nb\nc")
+    (slurm_cluster.root / "work" / "inputs.txt.idx").mkdir()  # unwritable
+    config = slurm_cluster.config(
+        name="job",
+        workdir="work",
+        inputs="work/inputs.txt",
+        remote_inputs=True,
+        input_index=True,
+    )
+
+    with slurm_cluster.connect() as client:
+        with pytest.raises(ExitStatusException, match="Failed to index"):
+            prepare_remote_inputs(client, config)
+
+
+def test_wait_for_jobs(slurm_cluster):
+    (slurm_cluster.root / "job.sh").write_text("#!/bin/bash\n")
+    with slurm_cluster.connect() as client:
+        for _ in range(2):
+            client.exec_command("sbatch job.sh")[1].read()
+    slurm_cluster.slurm.set_state("2", "FAILED")
+    jobs = [
+        (slurm_cluster.config(name="a"), ["1"]),
+        (slurm_cluster.config(name="b"), ["2"]),
+    ]
+
+    status, summary = wait_for_jobs(jobs)
+    assert slurm_cluster.connections == 2  # ours, then one for both jobs
+    assert status == 1
+    assert summary == {"success": 1, "failure": 1}
+
+
+def test_submit_with_open_client(slurm_cluster, tmp_path):
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("a\nb")
+    config = slurm_cluster.config(
+        name="job",
+        workdir="work",
+        inputs=str(inputs),
+        max_array_size=1001,
+    )
+
+    # the given connection is used, rather than opening another
+    with slurm_cluster.connect() as client:
+        results = [submit(config, [], client) for _ in range(3)]
+    assert slurm_cluster.connections == 1
+
+    assert [r.job_ids for r in results] == [["1"], ["2"], ["3"]]
+    assert results[0].script_path == "work/job.sh"
+    assert results[0].inputs_path == "work/inputs.txt"
+    assert results[0].input_count == 2
+    assert set(results[0].timings) == {"upload", "submit", "total"}
+    assert slurm_cluster.slurm.jobs[1].tasks == [1, 2]
+    assert (slurm_cluster.root / "work" / "inputs.txt").read_text() == "a\nb"
+
+
+def test_submit_local(slurm_cluster, tmp_path, monkeypatch):
+    # no host, so sbatch (the cluster's shim) runs here
+    monkeypatch.setenv("PATH", f"{slurm_cluster.shim_dir}:{environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    result = submit(SlapptConfig(name="job", workdir="work"), ["echo hi"])
+
+    assert result.job_ids == ["1"]
+    assert (tmp_path / "work" / "job.sh").read_text() == "echo hi"
+    assert slurm_cluster.connections == 0
+
+
+def test_submit_local_cluster(slurm_cluster, tmp_path):
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("a\nb\nc")
+    config = slurm_cluster.config(
+        name="job",
+        workdir="work",
+        inputs=str(inputs),
+        max_array_size=1001,
+    )
+
+    result = submit(config, ["#!/bin/bash", "echo hi"])
+    assert result.job_ids == ["1"]
+    assert (slurm_cluster.root / "work" / "inputs.txt").read_text() == (
+        "a\nb\nc"
+    )
+    assert slurm_cluster.slurm.jobs[1].tasks == [1, 2, 3]
+
+    status, summary = wait_for_jobs([(config, result.job_ids)], interval=0)
+    assert status == 0
+    assert summary == {"success": 3}
+
+
+def test_submit_remote_cache(slurm_cluster, tmp_path):
+    slurm_cluster.slurm.max_array_size = 2001
+    inputs = tmp_path / "inputs.txt"
+    inputs.write_text("".join(f"{i}\n" for i in range(1500)))
+    configs = [
+        slurm_cluster.config(
+            name=name,
+            workdir="work",
+            inputs=str(inputs),
+            max_array_size=2001,
+            remote_cache=".slappt/cache",
+        )
+        for name in ("a", "b")
+    ]
+    script = ["#!/bin/bash", "echo hi"]
+
+    submit(configs[0], script)
+    submit(configs[1], script)
+    submit(configs[1], script)
+    root = slurm_cluster.root
+    objects = root / ".slappt" / "cache" / REMOTE_CACHE_SUBDIRECTORY
+    cached = sorted(p.name for p in objects.iterdir())
+    # one script, one inputs file and its index, however many submissions
+    assert len(cached) == 3
+    assert (root / "work" / "b.sh").is_symlink()
+    assert (root / "work" / "inputs.txt.idx").is_symlink()
+    assert (root / "work" / "inputs.txt").read_text() == inputs.read_text()
+    jobs = slurm_cluster.slurm.jobs.values()
+    assert [j.tasks[-1] for j in jobs] == [1500] * 3
+
+
+def test_submit_with_upload(slurm_cluster, tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    for name in ("a.jpg", "b.jpg", "skip.txt"):
+        (data / name).write_text(name)
+    config = slurm_cluster.config(
+        name="job",
+        workdir="work",
+        # as loaded from YAML
+        upload={
+            "path": str(data),
+            "dest": "images",
+            "exclude_names": ["skip.txt"],
+        },
+    )
+
+    submit(config, ["#!/bin/bash"])
+    staged = slurm_cluster.root / "work" / "images"
+    assert sorted(p.name for p in staged.iterdir()) == ["a.jpg", "b.jpg"]
+    assert (staged / "b.jpg").read_text() == "b.jpg"
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from slappt.testing import FakeSlurm, parse_array_spec
+
+
+@pytest.mark.parametrize(
+    "spec,tasks",
+    [
+        ("1-3", [1, 2, 3]),
+        ("1,4,7", [1, 4, 7]),
+        ("0-8:4%2", [0, 4, 8]),
+        ("5", [5]),
+    ],
+)
+def test_parse_array_spec(spec, tasks):
+    assert parse_array_spec(spec) == tasks
+
+
+def test_sbatch(tmp_path):
+    (tmp_path / "job.sh").write_text("#!/bin/bash\n#SBATCH --job-name=hi\n")
+    slurm = FakeSlurm(max_array_size=10)
+
+    assert slurm.run("sbatch", str(tmp_path), ["job.sh"]) == (
+        0,
+        "Submitted batch job 1\n",
+        "",
+    )
+    assert slurm.run(
+        "sbatch", str(tmp_path), ["--parsable", "--array=1-3", "job.sh"]
+    ) == (0, "2\n", "")
+    assert slurm.jobs[1].name == "hi"
+    assert slurm.jobs[2].tasks == [1, 2, 3]
+
+    status, _, err = slurm.run("sbatch", str(tmp_path), ["missing.sh"])
+    assert status == 1 and "Unable to open file missing.sh" in err
+    status, _, err = slurm.run(
+        "sbatch", str(tmp_path), ["-a", "0-10", "job.sh"]
+    )
+    assert status == 1 and "Invalid job array" in err
+    assert slurm.calls == {"sbatch": 4}
+
+
+def test_job_lifecycle(tmp_path):
+    (tmp_path / "job.sh").touch()
+    slurm = FakeSlurm(pending_time=0.05, run_time=0.05)
+    slurm.run("sbatch", str(tmp_path), ["--array=1-2", "job.sh"])
+    slurm.run("sbatch", str(tmp_path), ["job.sh"])
+
+    squeue = ["-h", "-r", "-o", "%.18i %T"]
+    assert slurm.run("squeue", "", squeue)[1] == (
+        "1_1 PENDING\n1_2 PENDING\n2 PENDING\n"
+    )
+    assert slurm.run("scancel", "", ["1_2"]) == (0, "", "")
+    time.sleep(0.05)
+    assert slurm.run("squeue", "", squeue)[1] == "1_1 RUNNING\n2 RUNNING\n"
+
+    time.sleep(0.05)
+    slurm.set_state("2", "FAILED")
+    sacct = ["--noheader", "--parsable2", "--format=JobID,State,ExitCode"]
+    assert slurm.run("sacct", "", sacct + ["--jobs=1,2,3"])[1] == (
+        "1_1|COMPLETED|0:0\n1_2|CANCELLED|1:0\n2|FAILED|1:0\n"
+    )
+    assert slurm.run("squeue", "", squeue)[1] == ""
+
+    status, _, err = slurm.run("scancel", "", ["7"])
+    assert status == 1 and "Invalid job id specified" in err
+
+
+def test_scontrol_and_unknown_commands():
+    slurm = FakeSlurm(max_array_size=501)
+    assert slurm.run("scontrol", "", ["show", "config"])[1] == (
+        "MaxArraySize            = 501\n"
+    )
+    assert slurm.run("srun", "", [])[0] == 127
+
+
+def test_latency(tmp_path):
+    slurm = FakeSlurm(latency={"squeue": 0.05})
+    start = time.monotonic()
+    slurm.run("sacct", "", [])
+    assert time.monotonic() - start < 0.05
+    slurm.run("squeue", "", [])
+    assert time.monotonic() - start >= 0.05
+
+
+def test_cluster(slurm_cluster):
+    import paramiko
+
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    with pytest.raises(paramiko.SSHException):
+        client.connect(
+            slurm_cluster.host,
+            slurm_cluster.port,
+            username=slurm_cluster.username,
+            password="wrong",
+            look_for_keys=False,
+            allow_agent=False,
+        )
+    client.connect(
+        slurm_cluster.host,
+        slurm_cluster.port,
+        username=slurm_cluster.username,
+        password=slurm_cluster.password,
+        look_for_keys=False,
+        allow_agent=False,
+    )
+    with client:
+        # relative paths resolve to the cluster's home directory
+        with client.open_sftp() as sftp:
+            sftp.mkdir("work")
+            with sftp.open("work/job.sh", "w") as f:
+                f.write("#!/bin/bash\n")
+            assert sftp.listdir("work") == ["job.sh"]
+
+        _, stdout, stderr = client.exec_command(
+            "cd work && sbatch job.sh && sbatch missing.sh"
+        )
+        assert stdout.read() == b"Submitted batch job 1\n"
+        assert b"Unable to open file" in stderr.read()
+        assert stdout.channel.recv_exit_status() == 1
+    assert slurm_cluster.slurm.jobs[1].name == "job.sh"
+
+
+def test_cluster_forgets_closed_connections(slurm_cluster):
+    for _ in range(10):
+        with slurm_cluster.connect():
+            pass
+        # the server side notices the disconnection shortly after
+        deadline = time.monotonic() + 5
+        while (
+            any(t.is_active() for t in slurm_cluster._transports)
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.01)
+    with slurm_cluster.connect():
+        assert len(slurm_cluster._transports) == 1
+    assert slurm_cluster.connections == 11
@@ -0,0 +1,151 @@
+import io
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from slappt.transfer import (
+    REMOTE_CACHE_SUBDIRECTORY,
+    RemoteCache,
+    TransferStats,
+    upload_cached,
+    upload_file,
+    upload_files,
+    upload_lines,
+)
+from slappt.utils import list_local_files
+
+
+class RecordingFile(io.BytesIO):
+    def __init__(self, writes):
+        super().__init__()
+        self.writes = writes
+        self.pipelined = False
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def write(self, data):
+        self.writes.append(len(data))
+        return super().write(data)
+
+    def close(self):
+        self.contents = self.getvalue()
+        super().close()
+
+
+class RecordingSFTP:
+    def __init__(self):
+        self.files = {}
+        self.writes = []
+
+    def open(self, path, mode="r", bufsize=-1):
+        self.files[path] = RecordingFile(self.writes)
+        return self.files[path]
+
+
+def test_upload_file_byte_for_byte(tmp_path):
+    local = tmp_path / "inputs.txt"
+    data = b"".join(f"input {i}\r\n".encode() for i in range(100000))
+    data += b"no trailing newline \xe2\x9c\x93"
+    local.write_bytes(data)
+
+    sftp = RecordingSFTP()
+    stats = upload_file(sftp, local, "remote.txt", block_size=64 * 1024)
+    remote = sftp.files["remote.txt"]
+    assert remote.contents == data
+    assert remote.pipelined
+    assert stats.bytes == len(data)
+    assert len(sftp.writes) == -(-len(data) // (64 * 1024))
+    assert "in" in str(stats)
+
+
+def test_upload_lines():
+    sftp = RecordingSFTP()
+    stats = upload_lines(sftp, ["#!/bin/bash", "echo hello"], "job.sh")
+    assert sftp.files["job.sh"].contents == b"#!/bin/bash\necho hello\n"
+    assert len(sftp.writes) == 1
+    assert stats.bytes == 23
+
+
+def test_transfer_stats_rate():
+    assert TransferStats("f", 2048, 2.0).rate == 1024
+    assert TransferStats("f", 2048, 0).rate == 0
+
+
+@pytest.fixture
+def cluster_client(slurm_cluster):
+    with slurm_cluster.connect() as client:
+        yield client
+
+
+def test_remote_cache(slurm_cluster, cluster_client):
+    sftp = cluster_client.open_sftp()
+    cache = RemoteCache(sftp, ".cache/blobs", ttl=60)
+    root = slurm_cluster.root
+
+    stats = upload_cached(cache, b"echo hi\n", "a.sh")
+    assert [s.bytes for s in stats] == [8]
+    # identical content is linked, not uploaded again
+    assert upload_cached(cache, b"echo hi\n", "b.sh") == []
+    assert (root / "b.sh").read_text() == "echo hi\n"
+    assert (root / "b.sh").resolve() == (root / "a.sh").resolve()
+    objects = root / ".cache" / "blobs" / REMOTE_CACHE_SUBDIRECTORY
+    assert len(list(objects.iterdir())) == 1
+
+    # entries unused for longer than the TTL are evicted, other files never
+    upload_cached(cache, b"echo bye\n", "c.sh")
+    stale = (root / "a.sh").resolve()
+    os.utime(stale, (0, 0))
+    for other in (root / ".cache" / "blobs" / "notes.txt", objects / "x"):
+        other.write_text("mine")
+        os.utime(other, (0, 0))
+    assert cache.evict() == 1
+    assert not stale.exists()
+    assert (objects / "x").exists()
+
+
+def test_list_local_files(tmp_path):
+    for name in ("a.jpg", "b.JPG", "c.png", "notes.txt"):
+        (tmp_path / name).touch()
+    (tmp_path / "sub").mkdir()
+
+    def names(**kwargs):
+        return [Path(p).name for p in list_local_files(tmp_path, **kwargs)]
+
+    assert names() == ["a.jpg", "b.JPG", "c.png", "notes.txt"]
+    assert names(include_patterns=[".jpg"]) == ["a.jpg", "b.JPG"]
+    assert names(include_names=["c.png"]) == ["c.png"]
+    assert names(include_patterns=[".jpg"], include_names=["c.png"]) == [
+        "a.jpg",
+        "b.JPG",
+        "c.png",
+    ]
+    assert names(exclude_patterns=[".jpg"], exclude_names=["c.png"]) == [
+        "notes.txt"
+    ]
+
+
+def test_upload_files(slurm_cluster, cluster_client, tmp_path):
+    local = tmp_path / "images"
+    local.mkdir()
+    (slurm_cluster.root / "data").mkdir()
+    files = []
+    for i in range(50):
+        (local / f"{i}.jpg").write_bytes(bytes([i]) * (i + 1))
+        files.append((str(local / f"{i}.jpg"), f"data/{i}.jpg"))
+
+    stats = upload_files(cluster_client, files, workers=4)
+    assert len(stats) == 50
+    for i in range(50):
+        remote = slurm_cluster.root / "data" / f"{i}.jpg"
+        assert remote.read_bytes() == bytes([i]) * (i + 1)
+
+    # unchanged files are skipped, changed ones sent again
+    assert upload_files(cluster_client, files, workers=4) == []
+    (local / "7.jpg").write_bytes(b"changed")
+    os.utime(local / "7.jpg", (time.time() + 10, time.time() + 10))
+    stats = upload_files(cluster_client, files, workers=4)
+    assert [s.path for s in stats] == ["data/7.jpg"]
+    assert (slurm_cluster.root / "data" / "7.jpg").read_bytes() == b"changed"
@@ -0,0 +1,407 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import stat
+import time
+import uuid
+from dataclasses import dataclass
+from os.path import dirname
+from pathlib import Path
+from queue import Queue
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from slappt.utils import patch_istarmap, readable_bytes
+
+# bytes to read from disk and hand to SFTP per write. paramiko splits large
+# writes into protocol-sized requests and, with pipelining on, sends them
+# without waiting for each acknowledgement
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# how many files `upload_files` (or `map_sessions`) transfers at once
+DEFAULT_UPLOAD_WORKERS = 8
+
+# how long cached uploads are kept on the cluster after their last use
+DEFAULT_REMOTE_CACHE_TTL = 7 * 24 * 60 * 60
+
+# the subdirectory of a remote cache directory slappt keeps entries in, and
+# the names of those entries (a content hash, optionally an index, and
+# optionally the suffix of a temporary upload). only these are ever evicted
+REMOTE_CACHE_SUBDIRECTORY = "slappt-objects"
+REMOTE_CACHE_ENTRY = re.compile(r"[0-9a-f]{64}(\.idx)?(\.[0-9a-f]{32}\.tmp)?")
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransferStats:
+    path: str
+    bytes: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return f"{readable_bytes(self.bytes)} in {self.seconds:.2f}s ({readable_bytes(self.rate)}/s)"
+
+
+def upload_fileobj(
+    sftp,
+    fileobj: BinaryIO,
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TransferStats:
+    """
+    Streams the given binary file object to the remote path in large,
+    pipelined writes, so the remote file matches the source byte for byte.
+
+    Args:
+        sftp: An open SFTP client.
+        fileobj: The source, opened for reading in binary mode.
+        remote_path: The destination path on the remote host.
+        block_size: How many bytes to read and write at a time.
+    Returns:
+        The number of bytes transferred and how long it took.
+    """
+    return upload_chunks(
+        sftp,
+        iter(lambda: fileobj.read(block_size), b""),
+        remote_path,
+        block_size,
+    )
+
+
+def upload_chunks(
+    sftp,
+    chunks: Iterable[bytes],
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TransferStats:
+    """
+    Writes the given chunks of bytes to the remote path as they are produced,
+    in pipelined writes. See `upload_fileobj`.
+    """
+    start = time.perf_counter()
+    total = 0
+    with sftp.open(remote_path, "wb", bufsize=block_size) as remote_file:
+        remote_file.set_pipelined(True)
+        for chunk in chunks:
+            if chunk:
+                remote_file.write(chunk)
+                total += len(chunk)
+    return TransferStats(remote_path, total, time.perf_counter() - start)
+
+
+def upload_file(
+    sftp, local_path, remote_path: str, block_size: int = DEFAULT_BLOCK_SIZE
+) -> TransferStats:
+    with Path(local_path).open("rb") as local_file:
+        return upload_fileobj(sftp, local_file, remote_path, block_size)
+
+
+def upload_lines(
+    sftp,
+    lines: List[str],
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TransferStats:
+    data = "".join(f"{line}\n" for line in lines).encode("utf-8")
+    return upload_fileobj(sftp, io.BytesIO(data), remote_path, block_size)
+
+
+def content_digest(chunks: Iterable[bytes]) -> str:
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def makedirs(sftp, path: str):
+    """
+    Creates the given remote directory and any missing parents.
+    """
+    parts = path.split("/")
+    for i in range(1, len(parts) + 1):
+        parent = "/".join(parts[:i])
+        if not parts[i - 1]:
+            continue
+        try:
+            sftp.mkdir(parent)
+        except OSError:
+            pass  # exists (or can't be created, which stat will reveal)
+    sftp.stat(path)
+
+
+class RemoteCache:
+    """
+    Content-addressed store of uploads in a directory on the cluster. Each
+    file is uploaded once, under its content hash, and linked to wherever
+    jobs need it, so identical scripts and inputs move no data after their
+    first upload. Checking for a file is a single SFTP `stat`.
+
+    Entries are kept in a subdirectory of the given directory which slappt
+    owns (`REMOTE_CACHE_SUBDIRECTORY`). Entries unused for `ttl` seconds are
+    evicted the first time something new is stored in each session. Only
+    files named like entries are ever evicted, so nothing else is deleted
+    even if the subdirectory is shared. Using an entry refreshes its
+    modification time, so files linked by a job still waiting in the queue
+    are only evicted if it has been waiting longer than that.
+    """
+
+    def __init__(
+        self, sftp, directory: str, ttl: float = DEFAULT_REMOTE_CACHE_TTL
+    ):
+        self.sftp = sftp
+        self.ttl = ttl
+        self.evicted = False
+        directory = f"{directory.rstrip('/')}/{REMOTE_CACHE_SUBDIRECTORY}"
+        try:
+            sftp.stat(directory)
+        except IOError:
+            makedirs(sftp, directory)
+        # links must be absolute, since they live in other directories
+        self.directory = sftp.normalize(directory)
+
+    def path(self, key: str) -> str:
+        return f"{self.directory}/{key}"
+
+    def has(self, *keys: str) -> bool:
+        """
+        Whether all of the given entries are stored, refreshing them if so.
+        """
+        for key in keys:
+            try:
+                self.sftp.stat(self.path(key))
+            except IOError:
+                return False
+        for key in keys:
+            self.sftp.utime(self.path(key), None)
+        return True
+
+    def store(
+        self, keys: List[str], upload: Callable[..., List[TransferStats]]
+    ) -> List[TransferStats]:
+        """
+        Stores entries by calling `upload` with a temporary path for each
+        key, then moving them into place, so concurrent uploads of the
+        same content never expose a partial file.
+        """
+        if not self.evicted:
+            self.evict()
+        suffix = f".{uuid.uuid4().hex}.tmp"
+        temps = [self.path(key) + suffix for key in keys]
+        stats = upload(*temps)
+        for temp, key in zip(temps, keys):
+            self.sftp.posix_rename(temp, self.path(key))
+        return stats
+
+    def link(self, key: str, remote_path: str):
+        """
+        Points the given path at the given entry, replacing any file there.
+        """
+        try:
+            self.sftp.remove(remote_path)
+        except IOError:
+            pass
+        self.sftp.symlink(self.path(key), remote_path)
+
+    def evict(self, now: float = None) -> int:
+        """
+        Removes entries (and abandoned temporary files) unused for longer
+        than the cache's TTL.
+
+        Returns:
+            The number of files removed.
+        """
+        self.evicted = True
+        cutoff = (now if now is not None else time.time()) - self.ttl
+        evicted = 0
+        for attr in self.sftp.listdir_attr(self.directory):
+            if (
+                stat.S_ISREG(attr.st_mode)
+                and REMOTE_CACHE_ENTRY.fullmatch(attr.filename)
+                and attr.st_mtime < cutoff
+            ):
+                try:
+                    self.sftp.remove(self.path(attr.filename))
+                    evicted += 1
+                except IOError:
+                    pass  # removed by another process
+        if evicted:
+            _logger.debug(f"Evicted {evicted} file(s) from {self.directory}")
+        return evicted
+
+
+def upload_cached(
+    cache: RemoteCache,
+    data: bytes,
+    remote_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> List[TransferStats]:
+    """
+    Uploads the given bytes to the cache (unless already there) and links
+    the remote path to them.
+
+    Returns:
+        Stats for the upload, or none if the content was already cached.
+    """
+    key = content_digest([data])
+    stats = []
+    if not cache.has(key):
+        stats = cache.store(
+            [key],
+            lambda temp: [
+                upload_fileobj(cache.sftp, io.BytesIO(data), temp, block_size)
+            ],
+        )
+    cache.link(key, remote_path)
+    return stats
+
+
+def get_remote_attrs(sftp, directories: Iterable[str]) -> Dict[str, tuple]:
+    """
+    Lists the given remote directories, one round trip each.
+
+    Returns:
+        The size and modification time of each file found, by path.
+    """
+    attrs = {}
+    for directory in directories:
+        try:
+            entries = sftp.listdir_attr(directory or ".")
+        except IOError:
+            continue  # doesn't exist yet
+        for entry in entries:
+            path = (
+                f"{directory}/{entry.filename}"
+                if directory
+                else entry.filename
+            )
+            attrs[path] = (entry.st_size, entry.st_mtime)
+    return attrs
+
+
+def upload_files(
+    client,
+    files: List[Tuple[str, str]],
+    workers: int = DEFAULT_UPLOAD_WORKERS,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    progress: bool = False,
+) -> List[TransferStats]:
+    """
+    Uploads many files at once, each worker over its own SFTP session (a
+    channel on the given connection), so per-file round trips overlap and
+    throughput is bounded by bandwidth. Files whose remote copy has the
+    same size and modification time are skipped: uploaded files are given
+    their local modification time, so unchanged files are never sent twice.
+
+    Args:
+        client: An open connection.
+        files: Pairs of local and remote path.
+        workers: The number of concurrent uploads.
+        block_size: How many bytes to read and write at a time.
+        progress: Whether to show a progress bar.
+    Returns:
+        Stats for each file uploaded.
+    """
+    with client.open_sftp() as sftp:
+        remote = get_remote_attrs(sftp, {dirname(r) for _, r in files})
+    pending = []
+    for local, remote_path in files:
+        st = Path(local).stat()
+        if remote.get(remote_path, None) != (st.st_size, int(st.st_mtime)):
+            pending.append((local, remote_path, st))
+    if not pending:
+        return []
+
+    def upload(session, local, remote_path, st):
+        stats = upload_file(session, local, remote_path, block_size)
+        session.utime(remote_path, (st.st_atime, st.st_mtime))
+        return stats
+
+    return map_sessions(
+        client,
+        upload,
+        pending,
+        workers,
+        sum(st.st_size for _, _, st in pending),
+        progress,
+    )
+
+
+def map_sessions(
+    client,
+    func: Callable[..., TransferStats],
+    items: List[tuple],
+    workers: int = DEFAULT_UPLOAD_WORKERS,
+    total: int = 0,
+    progress: bool = False,
+) -> List[TransferStats]:
+    """
+    Calls `func(session, *item)` for each item, up to `workers` at a time,
+    each worker with its own SFTP session (a channel on the given
+    connection), counting bytes transferred towards `total` for the
+    progress bar.
+
+    Returns:
+        The stats returned for each item, in order.
+    """
+    if not items:
+        return []
+
+    # paramiko isn't fork-safe, so use threads; multiprocessing is slow to
+    # import, so only import it when there is something to transfer
+    from multiprocessing.pool import ThreadPool
+
+    from tqdm import tqdm
+
+    patch_istarmap()
+    sessions = Queue()
+    for _ in range(max(1, min(workers, len(items)))):
+        sessions.put(client.open_sftp())
+
+    def call(*item):
+        session = sessions.get()
+        try:
+            return func(session, *item)
+        finally:
+            sessions.put(session)
+
+    stats = []
+    try:
+        with ThreadPool(sessions.qsize()) as pool, tqdm(
+            total=total, unit="B", unit_scale=True, disable=not progress
+        ) as bar:
+            for s in pool.istarmap(call, items):
+                stats.append(s)
+                bar.update(s.bytes)
+    finally:
+        while not sessions.empty():
+            sessions.get().close()
+    return stats
+
+
+def download_file(
+    sftp, remote_path: str, local_path, mtime: Optional[float] = None
+) -> TransferStats:
+    """
+    Downloads the given remote file, reading ahead with pipelined requests,
+    and gives the local copy the remote's modification time (if known).
+    """
+    start = time.perf_counter()
+    Path(local_path).parent.mkdir(parents=True, exist_ok=True)
+    with sftp.open(remote_path, "rb") as remote_file:
+        remote_file.prefetch()
+        with open(local_path, "wb") as local_file:
+            total = 0
+            for chunk in iter(
+                lambda: remote_file.read(DEFAULT_BLOCK_SIZE), b""
+            ):
+                local_file.write(chunk)
+                total += len(chunk)
+    if mtime is not None:
+        os.utime(local_path, (mtime, mtime))
+    return TransferStats(str(local_path), total, time.perf_counter() - start)
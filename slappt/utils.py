@@ -1,7 +1,8 @@
 import re
 import traceback
+from glob import glob
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isdir, isfile, join
 
 
 def pattern_matches(path, patterns):
@@ -15,69 +16,59 @@ def list_local_files(
     exclude_patterns=None,
     exclude_names=None,
 ):
+    """
+    Lists the files in the given directory (not its subdirectories). If any
+    include patterns or names are given, only files matching at least one
+    are listed. Files matching any exclude pattern or name are left out.
+    Patterns match case-insensitive substrings of the path, and names match
+    the file name (or the full path).
+    """
     # gather all files
-    all_paths = [
+    all_paths = sorted(
         join(path, file) for file in listdir(path) if isfile(join(path, file))
-    ]
-
-    # add files matching included patterns
-    included_by_pattern = (
-        [
-            pth
-            for pth in all_paths
-            if any(
-                pattern.lower() in pth.lower() for pattern in include_patterns
-            )
-        ]
-        if include_patterns is not None
-        else all_paths
     )
 
-    # add files included by name
-    included_by_name = (
-        (
-            [
-                pth
-                for pth in all_paths
-                if pth.rpartition("/")[2] in [name for name in include_names]
-            ]
-            if include_names is not None
-            else included_by_pattern
+    # keep files matching included patterns or names (all if none given)
+    def included(pth):
+        if include_patterns is None and include_names is None:
+            return True
+        return (
+            include_patterns is not None
+            and pattern_matches(pth, include_patterns)
+        ) or (
+            include_names is not None
+            and (basename(pth) in include_names or pth in include_names)
         )
-        + [pth for pth in all_paths if pth in [name for name in include_names]]
-        if include_names is not None
-        else included_by_pattern
-    )
 
-    # gather only included files
-    included = set(included_by_pattern + included_by_name)
-
-    # remove files matched excluded patterns
-    excluded_by_pattern = (
-        [
-            name
-            for name in included
-            if all(
-                pattern.lower() not in name.lower()
-                for pattern in exclude_patterns
-            )
-        ]
-        if exclude_patterns is not None
-        else included
-    )
+    # remove files matching excluded patterns or names
+    def excluded(pth):
+        return (
+            exclude_patterns is not None
+            and pattern_matches(pth, exclude_patterns)
+        ) or (exclude_names is not None and basename(pth) in exclude_names)
 
-    # remove files excluded by name
-    excluded_by_name = (
-        [
-            pattern
-            for pattern in excluded_by_pattern
-            if pattern.split("/")[-1] not in exclude_names
-        ]
-        if exclude_names is not None
-        else excluded_by_pattern
-    )
+    return [pth for pth in all_paths if included(pth) and not excluded(pth)]
 
-    return excluded_by_name
+
+def expand_config_paths(paths) -> list:
+    """
+    Expands the given paths to configuration files. Directories expand to
+    the YAML files they contain, and glob patterns to their matches.
+    """
+    expanded = []
+    for path in paths:
+        if isdir(path):
+            expanded += sorted(
+                join(path, file)
+                for file in listdir(path)
+                if file.endswith((".yaml", ".yml"))
+                and isfile(join(path, file))
+            )
+        elif any(c in path for c in "*?["):
+            expanded += sorted(glob(path))
+        else:
+            expanded.append(path)
+    return expanded
 
 
 def del_none(d) -> dict:
@@ -192,12 +183,11 @@ def replace_text(path, pattern, replace, flags=0):
         file.write(contents)
 
 
-# istarmap.py for Python <3.8
-import multiprocessing.pool as mpp
-
-
+# referenced from https://stackoverflow.com/a/57364423, for Python 3.8+
 def istarmap(self, func, iterable, chunksize=1):
     """starmap-version of imap"""
+    import multiprocessing.pool as mpp
+
     if self._state != mpp.RUN:
         raise ValueError("Pool not running")
 
@@ -205,7 +195,7 @@ def istarmap(self, func, iterable, chunksize=1):
         raise ValueError("Chunksize must be 1+, not {0:n}".format(chunksize))
 
     task_batches = mpp.Pool._get_tasks(func, iterable, chunksize)
-    result = mpp.IMapIterator(self._cache)
+    result = mpp.IMapIterator(self)
     self._taskqueue.put(
         (
             self._guarded_task_generation(
@@ -217,13 +207,21 @@ def istarmap(self, func, iterable, chunksize=1):
     return (item for chunk in result for item in chunk)
 
 
-mpp.Pool.istarmap = istarmap
+def patch_istarmap():
+    """
+    Adds `istarmap` to `multiprocessing.pool.Pool` (and so `ThreadPool`).
+    Call this before using it: multiprocessing isn't imported until then.
+    """
+    import multiprocessing.pool as mpp
+
+    mpp.Pool.istarmap = istarmap
+
+
+HTML_TAG = re.compile("<.*?>")
 
 
 def clean_html(raw_html: str) -> str:
-    expr = re.compile("<.*?>")
-    text = re.sub(expr, "", raw_html)
-    return text
+    return HTML_TAG.sub("", raw_html)
 
 
 def parse_job_id(line: str) -> str:
@@ -233,3 +231,13 @@ def parse_job_id(line: str) -> str:
         raise Exception(
             f"Failed to parse job ID from '{line}'\n{traceback.format_exc()}"
         )
+
+
+def parse_parsable_job_id(line: str) -> str:
+    # `sbatch --parsable` prints `<job id>` or `<job id>;<cluster>`
+    try:
+        return str(int(line.strip().split(";")[0]))
+    except:
+        raise Exception(
+            f"Failed to parse job ID from '{line}'\n{traceback.format_exc()}"
+        )